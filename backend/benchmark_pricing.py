@@ -0,0 +1,114 @@
+"""Benchmark cart pricing: compiled campaign index vs. scanning every campaign per line.
+
+Builds a synthetic catalog and campaign set in memory (no database needed) and
+prices random carts both ways:
+
+    python benchmark_pricing.py --catalog 10000 --campaigns 300 --cart-size 50
+"""
+import argparse
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pricing import CAMPAIGN_SCOPES, LAB_PACKAGES, LAB_TESTS, MEDICINES, CompiledCampaign, PricingEngine
+
+
+def synthetic_catalog(size: int):
+    medicines = [{"id": str(uuid.uuid4()), "name": f"Medicine {n}", "price": round(random.uniform(5, 500), 2)} for n in range(int(size * 0.8))]
+    lab_tests = [{"id": str(uuid.uuid4()), "name": f"Test {n}", "price": round(random.uniform(100, 3000), 2)} for n in range(int(size * 0.15))]
+    lab_packages = [{"id": str(uuid.uuid4()), "name": f"Package {n}", "package_price": round(random.uniform(1000, 9000), 2)} for n in range(int(size * 0.05))]
+    return medicines, lab_tests, lab_packages
+
+
+def synthetic_campaigns(count: int, medicines, lab_tests):
+    today = datetime.utcnow()
+    campaigns = []
+    for n in range(count):
+        applicable_to = random.choice(["medicines", "medicines", "lab_tests", "all"])
+        pool = lab_tests if applicable_to == "lab_tests" else medicines
+        start = today + timedelta(days=random.randint(-60, 10))
+        campaigns.append({
+            "id": str(uuid.uuid4()),
+            "name": f"Campaign {n}",
+            "campaign_type": random.choice(["discount", "discount", "festive_offer", "buy_one_get_one"]),
+            "discount_percentage": random.choice([5, 10, 15, 20, 25]),
+            "applicable_to": applicable_to,
+            # A few catalog-wide campaigns, the rest targeting a handful of items
+            "applicable_items": [] if random.random() < 0.05 else [item["id"] for item in random.sample(pool, random.randint(5, 50))],
+            "start_date": start.strftime("%Y-%m-%d"),
+            "end_date": (start + timedelta(days=random.randint(5, 90))).strftime("%Y-%m-%d"),
+            "is_active": random.random() < 0.9,
+        })
+    return campaigns
+
+
+def naive_price_cart(engine: PricingEngine, campaigns, lines, today: str):
+    """Reference pricing that checks every campaign for every line"""
+    compiled = [(campaign, CompiledCampaign(campaign)) for campaign in campaigns if campaign.get("is_active", True)]
+    total = 0.0
+    for catalog, item_id, quantity in lines:
+        unit_price = engine.prices[catalog][item_id]
+        best = 0.0
+        for campaign, rule in compiled:
+            if catalog not in CAMPAIGN_SCOPES[campaign["applicable_to"]]:
+                continue
+            if campaign["applicable_items"] and item_id not in campaign["applicable_items"]:
+                continue
+            if rule.is_live(today):
+                best = max(best, rule.discount(unit_price, quantity))
+        gross = round(unit_price * quantity, 2)
+        total += gross - round(min(best, gross), 2)
+    return round(total, 2)
+
+
+def timed(label, runs):
+    durations = []
+    results = []
+    for run in runs:
+        started = time.perf_counter()
+        results.append(run())
+        durations.append((time.perf_counter() - started) * 1e6)
+    durations.sort()
+    p95 = durations[max(int(len(durations) * 0.95) - 1, 0)]
+    print(f"{label:<36} mean {statistics.mean(durations):10.1f} µs   p95 {p95:10.1f} µs")
+    return results
+
+
+def run_benchmark(args):
+    random.seed(args.seed)
+    medicines, lab_tests, lab_packages = synthetic_catalog(args.catalog)
+    campaigns = synthetic_campaigns(args.campaigns, medicines, lab_tests)
+
+    engine = PricingEngine()
+    started = time.perf_counter()
+    engine.load(medicines, lab_tests, lab_packages, campaigns)
+    print(f"Snapshot of {args.catalog:,} catalog entries and {args.campaigns} campaigns compiled in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    catalog_items = (
+        [(MEDICINES, item["id"]) for item in medicines]
+        + [(LAB_TESTS, item["id"]) for item in lab_tests]
+        + [(LAB_PACKAGES, item["id"]) for item in lab_packages]
+    )
+    carts = [
+        [(catalog, item_id, random.randint(1, 5)) for catalog, item_id in random.sample(catalog_items, args.cart_size)]
+        for _ in range(args.carts)
+    ]
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+
+    print(f"\nPricing {args.carts} carts of {args.cart_size} lines")
+    compiled = timed("compiled campaign index", [(lambda cart=cart: engine.price_cart(cart, today)["total_amount"]) for cart in carts])
+    naive = timed("scan every campaign per line", [(lambda cart=cart: naive_price_cart(engine, campaigns, cart, today)) for cart in carts])
+    mismatches = sum(1 for fast, slow in zip(compiled, naive) if abs(fast - slow) > 0.01)
+    print(f"totals differing between methods: {mismatches}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--catalog", type=int, default=10000)
+    parser.add_argument("--campaigns", type=int, default=300)
+    parser.add_argument("--cart-size", type=int, default=50)
+    parser.add_argument("--carts", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    run_benchmark(parser.parse_args())
@@ -0,0 +1,143 @@
+"""Benchmark point-in-time stock queries: snapshots + ledger tail vs. full ledger replay.
+
+Seeds a throwaway database with a synthetic stock ledger (a few million rows by
+default) and daily snapshots, then times the same queries both ways:
+
+    python benchmark_stock_snapshots.py --rows 3000000 --items 500 --days 365
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import InsertOne
+
+import server
+from stock_ledger import StockLedger
+
+BATCH_SIZE = 50000
+
+
+async def seed(db, rows: int, items: int, days: int):
+    print(f"Seeding {rows:,} ledger rows for {items} items over {days} days...")
+    await db.stock_transactions.drop()
+    await db.stock_snapshots.drop()
+    await db.inventory_items.drop()
+
+    start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    item_ids = [str(uuid.uuid4()) for _ in range(items)]
+    stock = {item_id: 0 for item_id in item_ids}
+    step = timedelta(days=days) / rows
+    snapshots = []
+    next_midnight = start + timedelta(days=1)
+
+    batch = []
+    seeded_at = time.perf_counter()
+    for n in range(rows):
+        moment = start + step * n
+        while moment > next_midnight:
+            snapshots.extend(
+                {"inventory_item_id": item_id, "snapshot_at": next_midnight, "stock": level, "created_at": next_midnight}
+                for item_id, level in stock.items()
+            )
+            next_midnight += timedelta(days=1)
+
+        item_id = random.choice(item_ids)
+        if random.random() < 0.3:
+            transaction_type, quantity = "purchase", random.randint(20, 200)
+        else:
+            transaction_type, quantity = "usage", random.randint(1, 20)
+        change = quantity if transaction_type == "purchase" else -quantity
+        stock[item_id] += change
+        batch.append(InsertOne({
+            "id": str(uuid.uuid4()),
+            "inventory_item_id": item_id,
+            "transaction_type": transaction_type,
+            "quantity": quantity,
+            "stock_change": change,
+            "performed_by": "benchmark",
+            "transaction_date": moment
+        }))
+        if len(batch) >= BATCH_SIZE:
+            await db.stock_transactions.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.stock_transactions.bulk_write(batch, ordered=False)
+
+    await db.inventory_items.insert_many([
+        {"id": item_id, "name": f"Item {i}", "category": "medicine", "current_stock": level,
+         "minimum_stock": 0, "unit": "pieces", "cost_per_unit": 1.0}
+        for i, (item_id, level) in enumerate(stock.items())
+    ])
+    for offset in range(0, len(snapshots), BATCH_SIZE):
+        await db.stock_snapshots.insert_many(snapshots[offset:offset + BATCH_SIZE])
+
+    await db.stock_transactions.create_index([("inventory_item_id", 1), ("transaction_date", 1)])
+    await db.stock_snapshots.create_index([("inventory_item_id", 1), ("snapshot_at", -1)], unique=True)
+    print(f"Seeded in {time.perf_counter() - seeded_at:.1f}s ({len(snapshots):,} snapshots)")
+    return item_ids, start
+
+
+async def timed(label, runs):
+    durations = []
+    results = []
+    for run in runs:
+        started = time.perf_counter()
+        results.append(await run())
+        durations.append((time.perf_counter() - started) * 1000)
+    durations.sort()
+    p95 = durations[max(int(len(durations) * 0.95) - 1, 0)]
+    print(f"{label:<42} mean {statistics.mean(durations):9.2f} ms   p95 {p95:9.2f} ms")
+    return results
+
+
+async def run_benchmark(args):
+    db = server.client[args.db_name]
+    server.db = db  # route the server's query helpers to the benchmark database
+    server.stock_ledger = StockLedger(db)  # the synthetic ledger is seeded in the document layout
+
+    item_ids, start = await seed(db, args.rows, args.items, args.days)
+    samples = [
+        (random.choice(item_ids), start + timedelta(seconds=random.uniform(0, args.days * 86400)))
+        for _ in range(args.queries)
+    ]
+
+    print(f"\nPoint-in-time stock for one item ({args.queries} queries)")
+    replayed = await timed("full ledger replay", [
+        (lambda item_id=item_id, at=at: server.sum_stock_changes([item_id], until=at))
+        for item_id, at in samples
+    ])
+    snapshotted = await timed("nearest snapshot + ledger tail", [
+        (lambda item_id=item_id, at=at: server.get_stock_levels_at(at, [item_id]))
+        for item_id, at in samples
+    ])
+    mismatches = sum(
+        1 for (item_id, _), full, fast in zip(samples, replayed, snapshotted)
+        if full.get(item_id, 0) != fast.get(item_id)
+    )
+    print(f"results differing between methods: {mismatches}")
+
+    print(f"\nPoint-in-time stock for all {args.items} items (5 queries)")
+    dates = [start + timedelta(seconds=random.uniform(0, args.days * 86400)) for _ in range(5)]
+    await timed("full ledger replay", [(lambda at=at: server.sum_stock_changes(item_ids, until=at)) for at in dates])
+    await timed("nearest snapshot + ledger tail", [(lambda at=at: server.get_stock_levels_at(at, item_ids)) for at in dates])
+
+    print("\nSnapshot creation")
+    await timed("create_stock_snapshots (all items, now)", [server.create_stock_snapshots])
+
+    if not args.keep:
+        await server.client.drop_database(args.db_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=3000000)
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--db-name", default="unicare_stock_benchmark")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark database afterwards")
+    asyncio.run(run_benchmark(parser.parse_args()))
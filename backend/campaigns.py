@@ -0,0 +1,202 @@
+"""Campaign helpers: the cached set of currently running campaigns and usage counters.
+
+Campaign start_date/end_date are calendar days ("YYYY-MM-DD"), so the running set
+only changes at midnight boundaries where some campaign starts or ends. The cache
+computes the next such boundary when it loads and serves the same set until then,
+or until a campaign write on this worker invalidates it.
+
+Redemptions are counted with conditional increments guarded by the usage limit, so
+concurrent checkouts can never push a campaign past it. Campaigns with
+counter_shards > 1 split the limit across that many counter documents, spreading
+the writes of a hot campaign instead of serialising them on one document. Their
+usage_count never reaches usage_limit, so once every shard is full the campaign is
+flagged exhausted until a use is given back or its limit is reconfigured.
+"""
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+
+def day_start(value: str) -> Optional[datetime]:
+    """Midnight of a campaign date string, or None when it is not a date"""
+    try:
+        return datetime.strptime(value[:10], "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+
+class ActiveCampaignCache:
+    """Running campaigns valid until the next activation/expiry boundary (TTL bounds other workers)"""
+
+    def __init__(self, ttl_seconds: int = 300):
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self._entry: Optional[tuple] = None  # (version, loaded_at, valid_until, campaigns)
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self.version += 1
+        self._entry = None
+
+    def _fresh(self, now: datetime) -> bool:
+        if self._entry is None:
+            return False
+        version, loaded_at, valid_until, _ = self._entry
+        return version == self.version and now < valid_until and time.monotonic() - loaded_at < self.ttl_seconds
+
+    @property
+    def valid_until(self) -> Optional[datetime]:
+        return self._entry[2] if self._entry else None
+
+    async def get(self, collection, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        now = now or datetime.utcnow()
+        if not self._fresh(now):
+            async with self._lock:
+                if not self._fresh(now):
+                    await self._load(collection, now)
+        return self._entry[3]
+
+    async def _load(self, collection, now: datetime):
+        version = self.version
+        today = now.strftime("%Y-%m-%d")
+        campaigns = await collection.find({
+            "is_active": True,
+            "exhausted": {"$ne": True},
+            "start_date": {"$lte": today},
+            "end_date": {"$gte": today}
+        }, {"_id": 0}).to_list(None)
+        upcoming = await collection.find(
+            {"is_active": True, "start_date": {"$gt": today}}, {"_id": 0, "start_date": 1}
+        ).sort("start_date", 1).limit(1).to_list(1)
+
+        # A running campaign drops out the day after its end_date; an upcoming one joins on its start_date
+        next_midnight = datetime(now.year, now.month, now.day) + timedelta(days=1)
+        boundaries = [
+            (day_start(campaign.get("end_date")) or now) + timedelta(days=1)
+            for campaign in campaigns
+        ]
+        boundaries.extend(day_start(campaign["start_date"]) or next_midnight for campaign in upcoming)
+        valid_until = max(min(boundaries, default=datetime.max), next_midnight)
+
+        # Tagged with the version read before the query, so a write during the load forces a reload
+        self._entry = (version, time.monotonic(), valid_until, campaigns)
+
+
+def shard_limits(remaining: int, shards: int) -> List[int]:
+    """Split the remaining redemptions over the shards; the parts always add up to `remaining`"""
+    remaining = max(remaining, 0)
+    return [remaining // shards + (1 if shard < remaining % shards else 0) for shard in range(shards)]
+
+
+class CampaignCounters:
+    def __init__(self, db):
+        self.db = db
+
+    async def ensure_indexes(self):
+        await self.db.campaign_counters.create_index([("campaign_id", 1), ("shard", 1)], unique=True)
+
+    async def redeem(self, campaign_id: str) -> Optional[Dict[str, Any]]:
+        """Count one use of a campaign; None when its usage limit is exhausted
+
+        The returned token identifies the counter that was incremented and is
+        passed to release() to give the use back.
+        """
+        result = await self.db.campaigns.update_one(
+            {
+                "id": campaign_id,
+                "counter_shards": {"$not": {"$gt": 1}},
+                "$or": [{"usage_limit": None}, {"$expr": {"$lt": ["$usage_count", "$usage_limit"]}}]
+            },
+            {"$inc": {"usage_count": 1}}
+        )
+        if result.modified_count == 1:
+            return {"campaign_id": campaign_id, "shard": None}
+
+        # Sharded campaign: start at a random shard and move on to the others when it is full
+        shards = await self.db.campaign_counters.find(
+            {"campaign_id": campaign_id, "$expr": {"$lt": ["$count", "$limit"]}}, {"_id": 0, "shard": 1}
+        ).to_list(None)
+        random.shuffle(shards)
+        for shard in shards:
+            result = await self.db.campaign_counters.update_one(
+                {"campaign_id": campaign_id, "shard": shard["shard"], "$expr": {"$lt": ["$count", "$limit"]}},
+                {"$inc": {"count": 1}}
+            )
+            if result.modified_count == 1:
+                return {"campaign_id": campaign_id, "shard": shard["shard"]}
+        await self._mark_exhausted(campaign_id)
+        return None
+
+    async def _has_free_shard(self, campaign_id: str) -> bool:
+        return await self.db.campaign_counters.find_one(
+            {"campaign_id": campaign_id, "$expr": {"$lt": ["$count", "$limit"]}}, {"_id": 1}
+        ) is not None
+
+    async def _mark_exhausted(self, campaign_id: str):
+        """Flag a sharded campaign whose shards are all full, so snapshots stop offering it"""
+        result = await self.db.campaigns.update_one(
+            {"id": campaign_id, "counter_shards": {"$gt": 1}, "exhausted": {"$ne": True}},
+            {"$set": {"exhausted": True}}
+        )
+        # A use given back while the flag was being set must not stay hidden behind it
+        if result.modified_count and await self._has_free_shard(campaign_id):
+            await self.db.campaigns.update_one({"id": campaign_id}, {"$set": {"exhausted": False}})
+
+    async def release(self, token: Dict[str, Any]) -> bool:
+        """Give back a use taken by redeem(); True when this reopens an exhausted campaign"""
+        if token.get("shard") is None:
+            await self.db.campaigns.update_one(
+                {"id": token["campaign_id"], "usage_count": {"$gt": 0}}, {"$inc": {"usage_count": -1}}
+            )
+            return False
+        result = await self.db.campaign_counters.update_one(
+            {"campaign_id": token["campaign_id"], "shard": token["shard"], "count": {"$gt": 0}},
+            {"$inc": {"count": -1}}
+        )
+        if not result.modified_count:
+            return False
+        result = await self.db.campaigns.update_one(
+            {"id": token["campaign_id"], "exhausted": True}, {"$set": {"exhausted": False}}
+        )
+        return result.modified_count == 1
+
+    async def configure(self, campaign_id: str):
+        """(Re)build the counter shards after a campaign is created or its limit/shard count changes
+
+        Uses already counted on old shards are folded into the campaign's usage_count
+        first; redemptions racing with the rebuild are refused rather than overcounted.
+        """
+        folded = 0
+        while True:
+            shard = await self.db.campaign_counters.find_one_and_delete({"campaign_id": campaign_id})
+            if shard is None:
+                break
+            folded += shard.get("count", 0)
+        campaign = await self.db.campaigns.find_one_and_update(
+            {"id": campaign_id}, {"$inc": {"usage_count": folded}, "$set": {"exhausted": False}}, return_document=True
+        )
+        if campaign is None:
+            return
+        shards = campaign.get("counter_shards") or 0
+        if shards <= 1:
+            return
+        if campaign.get("usage_limit") is None:
+            # Unlimited campaigns have nothing to enforce and count on the campaign document
+            await self.db.campaigns.update_one({"id": campaign_id}, {"$set": {"counter_shards": 0}})
+            return
+
+        limits = shard_limits(campaign["usage_limit"] - campaign.get("usage_count", 0), shards)
+        await self.db.campaign_counters.insert_many([
+            {"campaign_id": campaign_id, "shard": shard, "count": 0, "limit": limit}
+            for shard, limit in enumerate(limits)
+        ])
+
+    async def usage_counts(self, campaign_ids: List[str]) -> Dict[str, int]:
+        """Uses counted on shards per campaign, to add to the campaign's own usage_count"""
+        rows = await self.db.campaign_counters.aggregate([
+            {"$match": {"campaign_id": {"$in": list(campaign_ids)}}},
+            {"$group": {"_id": "$campaign_id", "count": {"$sum": "$count"}}}
+        ]).to_list(None)
+        return {row["_id"]: row["count"] for row in rows}
@@ -0,0 +1,123 @@
+"""Thumbnail / first-page previews of patient documents, rendered in a process pool.
+
+Decoding multi-MB scans and rasterising PDF pages is CPU-bound, so rendering runs
+in a small ProcessPoolExecutor off the event loop, with a semaphore bounding how
+many renders can queue for it. Images are handled with Pillow; PDF previews need
+the optional PyMuPDF package and are marked unsupported without it. Previews are
+JPEGs stored next to the original blob.
+"""
+import asyncio
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from html import escape
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+PREVIEW_SIZE = (320, 320)
+PREVIEW_SUFFIX = ".preview.jpg"
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+PDF_EXTENSIONS = {".pdf"}
+
+
+def can_preview(extension: str) -> bool:
+    extension = extension.lower()
+    return extension in IMAGE_EXTENSIONS or (extension in PDF_EXTENSIONS and fitz is not None)
+
+
+def render_preview(source: str, destination: str, max_size: Tuple[int, int] = PREVIEW_SIZE) -> Dict[str, int]:
+    """Write a JPEG preview of an image or of a PDF's first page (runs in a worker process)"""
+    from PIL import Image, ImageOps
+
+    if Path(source).suffix.lower() in PDF_EXTENSIONS:
+        with fitz.open(source) as pdf:
+            page = pdf.load_page(0)
+            # Rasterise at twice the preview size, then downsample for smoother text
+            zoom = 2 * min(max_size[0] / page.rect.width, max_size[1] / page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+    else:
+        image = Image.open(source)
+        # JPEG scans decode directly at a reduced scale instead of full resolution
+        image.draft("RGB", max_size)
+        image = ImageOps.exif_transpose(image)
+
+    image.thumbnail(max_size)
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    # Unique per render, so overlapping renders of one blob never write the same file
+    temp_path = f"{destination}.{uuid.uuid4().hex}.part"
+    try:
+        image.save(temp_path, "JPEG", quality=80, optimize=True)
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return {"width": image.width, "height": image.height}
+
+
+def placeholder_svg(label: str, status: str) -> bytes:
+    """Generic document icon shown while a preview is pending or when there is none"""
+    caption = {"pending": "Preview pending", "failed": "No preview"}.get(status, "No preview")
+    return f"""<svg xmlns="http://www.w3.org/2000/svg" width="{PREVIEW_SIZE[0]}" height="{PREVIEW_SIZE[1]}" viewBox="0 0 320 320">
+<rect width="320" height="320" fill="#f3f4f6"/>
+<path d="M110 60h70l40 40v140a10 10 0 0 1-10 10H110a10 10 0 0 1-10-10V70a10 10 0 0 1 10-10z" fill="#fff" stroke="#9ca3af" stroke-width="4"/>
+<path d="M180 60v40h40" fill="none" stroke="#9ca3af" stroke-width="4"/>
+<text x="160" y="180" font-family="sans-serif" font-size="28" font-weight="bold" fill="#4b5563" text-anchor="middle">{escape(label.upper()[:5])}</text>
+<text x="160" y="290" font-family="sans-serif" font-size="18" fill="#6b7280" text-anchor="middle">{caption}</text>
+</svg>""".encode()
+
+
+class PreviewGenerator:
+    def __init__(self, max_workers: int = 2, max_pending: Optional[int] = None):
+        self.max_workers = max_workers
+        self._slots = asyncio.Semaphore(max_pending or max_workers * 4)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # destination -> running render, shared by concurrent requests for the same preview
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned workers: forking the server process would copy its event loop and driver threads
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def render(self, source: Path, destination: Path) -> Dict[str, int]:
+        key = str(destination)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._render(source, destination))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # One caller giving up must not cancel the render for the others
+        return await asyncio.shield(task)
+
+    async def _render(self, source: Path, destination: Path) -> Dict[str, int]:
+        async with self._slots:
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self._pool(), render_preview, str(source), str(destination)
+                )
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory on a huge scan); later renders get a fresh pool
+                self._executor = None
+                raise
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,330 @@
+"""Streaming, content-addressed storage of uploaded patient documents.
+
+Uploads are copied to a temporary file in fixed-size chunks, hashed (SHA-256)
+while they are written and cut off as soon as they exceed the size limit.
+
+Files are stored once per content as blobs named by their digest in a two-level
+fan-out tree (blobs/ab/cd/abcd...<ext>), so identical uploads share one file and
+no directory grows past a few thousand entries. document_blobs counts the
+patient_documents referencing each blob; a blob is claimed before its document
+is inserted and only moved into place afterwards, and unreferenced blobs are
+deleted by collect() once a grace period has passed.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiofiles
+import aiofiles.os
+from pymongo.errors import DuplicateKeyError
+
+CHUNK_SIZE = 1024 * 1024
+TEMP_SUFFIX = ".part"
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes: int, message: Optional[str] = None):
+        super().__init__(message or f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+        self.max_bytes = max_bytes
+
+
+class TotalSizeLimit:
+    """Byte budget shared by several readers, e.g. every file and ZIP member of one bulk upload
+
+    ZIP headers can understate member sizes, so the budget is charged with the bytes
+    actually read rather than with the declared sizes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.used = 0
+
+    def wrap(self, reader) -> "LimitedReader":
+        return LimitedReader(reader, self)
+
+
+class LimitedReader:
+    def __init__(self, reader, limit: TotalSizeLimit):
+        self.reader = reader
+        self.limit = limit
+
+    async def read(self, size: int = -1) -> bytes:
+        chunk = await self.reader.read(size)
+        self.limit.used += len(chunk)
+        if self.limit.used > self.limit.max_bytes:
+            raise UploadTooLarge(
+                self.limit.max_bytes,
+                f"Files exceed the {self.limit.max_bytes // (1024 * 1024)} MB total limit once extracted"
+            )
+        return chunk
+
+
+class ThreadedReader:
+    """Async read() over a blocking file object (e.g. a ZIP member), run in a worker thread"""
+
+    def __init__(self, file):
+        self.file = file
+
+    async def read(self, size: int = -1) -> bytes:
+        return await asyncio.to_thread(self.file.read, size)
+
+    def close(self):
+        self.file.close()
+
+
+class StagedUpload:
+    """An upload written to a temporary file, waiting to be committed or discarded"""
+
+    def __init__(self, temp_path: Path, size: int, sha256: str):
+        self.temp_path = temp_path
+        self.size = size
+        self.sha256 = sha256
+
+    async def commit(self, destination: Path):
+        """Atomically move the file to its final path (same filesystem)"""
+        await aiofiles.os.replace(self.temp_path, destination)
+
+    async def discard(self):
+        try:
+            await aiofiles.os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+
+async def stage_upload(upload, directory: Path, max_bytes: int, chunk_size: int = CHUNK_SIZE) -> StagedUpload:
+    """Copy an UploadFile into `directory` chunk by chunk, hashing as it goes
+
+    Raises UploadTooLarge (after removing the partial file) once more than
+    max_bytes have been read.
+    """
+    temp_path = directory / f".{uuid.uuid4().hex}{TEMP_SUFFIX}"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(temp_path, "wb") as f:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                digest.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        staged = StagedUpload(temp_path, size, "")
+        await staged.discard()
+        raise
+    return StagedUpload(temp_path, size, digest.hexdigest())
+
+
+class RequestSizeLimitMiddleware:
+    """ASGI middleware refusing request bodies over a per-route limit while they stream in
+
+    Multipart bodies are parsed (and spooled) before the endpoint runs, so the
+    limit has to be applied to the raw body: a declared Content-Length over the
+    limit is refused up front, and chunked bodies are cut off once they pass it.
+    """
+
+    def __init__(self, app, limits: List[Tuple[str, int]]):
+        self.app = app
+        self.limits = [(re.compile(pattern), max_bytes) for pattern, max_bytes in limits]
+
+    def _limit(self, path: str) -> Optional[int]:
+        for pattern, max_bytes in self.limits:
+            if pattern.match(path):
+                return max_bytes
+        return None
+
+    async def _reject(self, send, max_bytes: int):
+        body = json.dumps({"detail": "Request body too large"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self._limit(scope["path"]) if scope["type"] == "http" else None
+        if max_bytes is None:
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+            return await self._reject(send, max_bytes)
+
+        received = 0
+        exceeded = response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    exceeded = True
+                    raise UploadTooLarge(max_bytes)
+            return message
+
+        async def limited_send(message):
+            # The body parser may turn the error into its own response; answer 413 instead
+            nonlocal response_started
+            if exceeded:
+                if message["type"] == "http.response.start" and not response_started:
+                    response_started = True
+                    await self._reject(send, max_bytes)
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except UploadTooLarge:
+            if response_started:
+                return
+            await self._reject(send, max_bytes)
+
+
+class BlobStore:
+    # Attempts to reference a blob that the collector is deleting at that moment
+    CLAIM_ATTEMPTS = 5
+    CLAIM_RETRY_SECONDS = 0.2
+
+    def __init__(self, db, root: Path):
+        self.db = db
+        self.root = root
+        self.temp_dir = root / "tmp"
+
+    def ensure_directories(self):
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+
+    async def ensure_indexes(self):
+        await self.db.document_blobs.create_index("key", unique=True)
+        await self.db.document_blobs.create_index([("ref_count", 1), ("released_at", 1)])
+
+    @staticmethod
+    def blob_key(sha256: str, extension: str) -> str:
+        return f"{sha256}{extension.lower()}"
+
+    def relative_path(self, key: str) -> str:
+        return f"{key[:2]}/{key[2:4]}/{key}"
+
+    def path(self, key: str) -> Path:
+        return self.root / self.relative_path(key)
+
+    def derivative_path(self, key: str, suffix: str) -> Path:
+        """Files generated from a blob (previews) live next to it and are collected with it"""
+        return self.path(key).with_name(f"{key}{suffix}")
+
+    async def stage(self, upload, max_bytes: int) -> StagedUpload:
+        return await stage_upload(upload, self.temp_dir, max_bytes)
+
+    async def stage_file(self, source: Path) -> StagedUpload:
+        """Stage a file already on disk (hard-linked when possible) for claim() and store()"""
+        temp_path = self.temp_dir / f".{uuid.uuid4().hex}{TEMP_SUFFIX}"
+        try:
+            await aiofiles.os.link(source, temp_path)
+        except OSError:
+            await asyncio.to_thread(shutil.copyfile, source, temp_path)
+        digest = hashlib.sha256()
+        size = 0
+        async with aiofiles.open(temp_path, "rb") as f:
+            while True:
+                chunk = await f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                digest.update(chunk)
+        return StagedUpload(temp_path, size, digest.hexdigest())
+
+    async def claim(self, staged: StagedUpload, extension: str) -> Tuple[str, bool]:
+        """Reference the blob for a staged upload, creating the blob record if needed
+
+        Returns (key, created). The staged file is kept until store() decides
+        whether it is needed.
+        """
+        key = self.blob_key(staged.sha256, extension)
+        for _ in range(self.CLAIM_ATTEMPTS):
+            try:
+                result = await self.db.document_blobs.update_one(
+                    {"key": key, "collecting": {"$ne": True}},
+                    {
+                        "$inc": {"ref_count": 1},
+                        "$set": {"released_at": None},
+                        "$setOnInsert": {"sha256": staged.sha256, "size": staged.size, "created_at": datetime.utcnow()}
+                    },
+                    upsert=True
+                )
+                return key, result.upserted_id is not None
+            except DuplicateKeyError:
+                # The collector is deleting this blob; its record goes away once the file is gone
+                await asyncio.sleep(self.CLAIM_RETRY_SECONDS)
+        raise RuntimeError("Document storage is busy, please retry")
+
+    async def store(self, staged: StagedUpload, key: str):
+        """Move the staged file into place unless the blob already exists (then it is dropped)
+
+        Safe against the collector: a claimed blob has ref_count > 0 and is never collected.
+        """
+        destination = self.path(key)
+        if await aiofiles.os.path.exists(destination):
+            await staged.discard()
+            return
+        await aiofiles.os.makedirs(destination.parent, exist_ok=True)
+        await staged.commit(destination)
+
+    async def release(self, key: str):
+        """Drop one reference; the blob becomes collectable when none are left"""
+        await self.db.document_blobs.update_one(
+            {"key": key, "ref_count": {"$gt": 0}},
+            {"$inc": {"ref_count": -1}, "$set": {"released_at": datetime.utcnow()}}
+        )
+
+    async def collect(self, grace: timedelta, temp_max_age: timedelta = timedelta(days=1)) -> Dict[str, Any]:
+        """Delete blobs unreferenced for longer than `grace`, and abandoned temp files"""
+        cutoff = datetime.utcnow() - grace
+        blobs = freed = 0
+        # Blobs marked by an interrupted earlier run are finished first
+        candidates = await self.db.document_blobs.find(
+            {"ref_count": {"$lte": 0}, "$or": [{"released_at": {"$lte": cutoff}}, {"collecting": True}]},
+            {"_id": 0, "key": 1}
+        ).to_list(None)
+        for candidate in candidates:
+            # Marking blocks new claims until the file and the record are both gone
+            blob = await self.db.document_blobs.find_one_and_update(
+                {"key": candidate["key"], "ref_count": {"$lte": 0}}, {"$set": {"collecting": True}}
+            )
+            if blob is None:
+                continue
+            try:
+                await aiofiles.os.remove(self.path(blob["key"]))
+                freed += blob.get("size") or 0
+            except FileNotFoundError:
+                pass
+            for derivative in self.path(blob["key"]).parent.glob(f"{blob['key']}.*"):
+                try:
+                    await aiofiles.os.remove(derivative)
+                except FileNotFoundError:
+                    pass
+            await self.db.document_blobs.delete_one({"key": blob["key"], "collecting": True})
+            blobs += 1
+
+        temp_files = 0
+        oldest = time.time() - temp_max_age.total_seconds()
+        for temp_path in self.temp_dir.glob(f"*{TEMP_SUFFIX}"):
+            try:
+                if temp_path.stat().st_mtime < oldest:
+                    await aiofiles.os.remove(temp_path)
+                    temp_files += 1
+            except FileNotFoundError:
+                pass
+        return {"blobs_deleted": blobs, "bytes_freed": freed, "temp_files_deleted": temp_files}
@@ -0,0 +1,182 @@
+"""Rolling feedback trends per doctor and category from daily rollups.
+
+submit_feedback adds each rating to a feedback_daily document per (doctor, day).
+Trends load the last 2 x 90 days of rollups into doctor-by-day numpy matrices once,
+then every rolling window is a difference of cumulative sums, and the trend delta
+compares a window with the window before it. Results are cached until the feedback
+collection grows (new feedback on any worker) or the day changes; a TTL bounds
+a worker that read the new count just before the matching rollup was written.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+WINDOWS = (7, 30, 90)
+# Days of rollups loaded: the longest window and the window before it
+HORIZON_DAYS = 2 * max(WINDOWS)
+# A 30-day average this far below the previous 30 days flags the doctor as declining
+DECLINE_DELTA = 0.5
+DECLINE_WINDOW = 30
+# Length of the daily rolling-average series returned for one doctor
+SERIES_DAYS = 90
+
+
+def rollup_increments(feedback: Dict[str, Any]) -> Dict[str, int]:
+    """$inc fields for one feedback entry (shared by daily rollups and lifetime summaries)"""
+    increments = {"count": 1, "rating_sum": feedback["rating"]}
+    for name, score in (feedback.get("feedback_categories") or {}).items():
+        increments[f"category_sums.{name}"] = score
+        increments[f"category_counts.{name}"] = 1
+    return increments
+
+
+def rolling_sums(matrix: np.ndarray, window: int) -> np.ndarray:
+    """Sums over every `window`-day span along the last axis; [..., j] covers days j..j+window-1"""
+    cumulative = np.cumsum(matrix, axis=-1)
+    padded = np.concatenate([np.zeros(matrix.shape[:-1] + (1,)), cumulative], axis=-1)
+    return padded[..., window:] - padded[..., :-window]
+
+
+def averages(sums: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    return np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+
+
+def rounded(value: float) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def window_stats(sums: np.ndarray, counts: np.ndarray) -> Dict[str, Dict[str, Any]]:
+    """Current vs previous window for one row of daily sums and counts"""
+    stats = {}
+    for window in WINDOWS:
+        window_sums, window_counts = rolling_sums(sums, window), rolling_sums(counts, window)
+        current = averages(window_sums[-1], window_counts[-1])
+        previous = averages(window_sums[-1 - window], window_counts[-1 - window])
+        stats[str(window)] = {
+            "count": int(window_counts[-1]),
+            "average": rounded(current),
+            "previous_average": rounded(previous),
+            "delta": rounded(current - previous),
+        }
+    return stats
+
+
+def compute_trends(rollups: List[Dict[str, Any]], today: datetime, series: bool = False) -> List[Dict[str, Any]]:
+    """Windowed averages and deltas for every doctor in the rollups"""
+    first_day = today - timedelta(days=HORIZON_DAYS - 1)
+    doctors = sorted({rollup["doctor_id"] for rollup in rollups})
+    categories = sorted({name for rollup in rollups for name in rollup.get("category_counts", {})})
+    doctor_index = {doctor_id: row for row, doctor_id in enumerate(doctors)}
+    category_index = {name: row for row, name in enumerate(categories)}
+
+    counts = np.zeros((len(doctors), HORIZON_DAYS))
+    sums = np.zeros((len(doctors), HORIZON_DAYS))
+    category_counts = np.zeros((len(categories), len(doctors), HORIZON_DAYS))
+    category_sums = np.zeros((len(categories), len(doctors), HORIZON_DAYS))
+    for rollup in rollups:
+        day = (datetime.strptime(rollup["day"], "%Y-%m-%d") - first_day).days
+        if not 0 <= day < HORIZON_DAYS:
+            continue
+        row = doctor_index[rollup["doctor_id"]]
+        counts[row, day] += rollup.get("count", 0)
+        sums[row, day] += rollup.get("rating_sum", 0)
+        for name, count in rollup.get("category_counts", {}).items():
+            category_counts[category_index[name], row, day] += count
+            category_sums[category_index[name], row, day] += rollup.get("category_sums", {}).get(name, 0)
+
+    trends = []
+    for doctor_id, row in doctor_index.items():
+        windows = window_stats(sums[row], counts[row])
+        decline = windows[str(DECLINE_WINDOW)]["delta"]
+        trend = {
+            "doctor_id": doctor_id,
+            "windows": windows,
+            "categories": {
+                name: window_stats(category_sums[index, row], category_counts[index, row])
+                for name, index in category_index.items()
+                if category_counts[index, row].any()
+            },
+            "declining": decline is not None and decline <= -DECLINE_DELTA,
+        }
+        if series:
+            rolling = averages(rolling_sums(sums[row], 7), rolling_sums(counts[row], 7))[-SERIES_DAYS:]
+            trend["rolling_7_day"] = [
+                {"date": (today - timedelta(days=SERIES_DAYS - 1 - offset)).strftime("%Y-%m-%d"), "average": rounded(value)}
+                for offset, value in enumerate(rolling)
+            ]
+        trends.append(trend)
+    return trends
+
+
+class FeedbackAnalytics:
+    def __init__(self, db, ttl_seconds: int = 300):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self._cache: Dict[Tuple[Optional[str], str], Tuple[int, int, float, List[Dict[str, Any]]]] = {}
+        self._lock = asyncio.Lock()
+
+    async def ensure_indexes(self):
+        await self.db.feedback_daily.create_index([("day", 1), ("doctor_id", 1)], unique=True)
+        await self.db.feedback_daily.create_index([("doctor_id", 1), ("day", 1)])
+
+    def invalidate(self):
+        self.version += 1
+        self._cache = {}
+
+    async def record(self, feedback: Dict[str, Any]):
+        """Add one feedback entry to its doctor's rollup for the day"""
+        await self.db.feedback_daily.update_one(
+            {"doctor_id": feedback["doctor_id"], "day": feedback["created_at"].strftime("%Y-%m-%d")},
+            {"$inc": rollup_increments(feedback)},
+            upsert=True
+        )
+        self.invalidate()
+
+    async def rebuild(self) -> Dict[str, int]:
+        """Recompute every daily rollup from the feedback collection"""
+        rollups: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        async for feedback in self.db.feedback.find(
+            {}, {"_id": 0, "doctor_id": 1, "rating": 1, "feedback_categories": 1, "created_at": 1}
+        ):
+            day = feedback["created_at"].strftime("%Y-%m-%d")
+            rollup = rollups.setdefault((feedback["doctor_id"], day), {
+                "doctor_id": feedback["doctor_id"], "day": day, "count": 0, "rating_sum": 0,
+                "category_sums": {}, "category_counts": {}
+            })
+            for path, amount in rollup_increments(feedback).items():
+                field, _, key = path.partition(".")
+                if key:
+                    rollup[field][key] = rollup[field].get(key, 0) + amount
+                else:
+                    rollup[field] += amount
+
+        await self.db.feedback_daily.delete_many({})
+        if rollups:
+            await self.db.feedback_daily.insert_many(list(rollups.values()))
+        self.invalidate()
+        return {"rollups": len(rollups), "feedback": sum(rollup["count"] for rollup in rollups.values())}
+
+    async def trends(self, doctor_id: Optional[str] = None, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Trends for all doctors, or one doctor with its daily rolling series"""
+        now = now or datetime.utcnow()
+        today = datetime(now.year, now.month, now.day)
+        key = (doctor_id, today.strftime("%Y-%m-%d"))
+        # Feedback is append-only, so its size changes exactly when feedback arrives on any worker
+        feedback_count = await self.db.feedback.estimated_document_count()
+        entry = self._cache.get(key)
+        if entry and entry[:2] == (self.version, feedback_count) and time.monotonic() - entry[2] < self.ttl_seconds:
+            return entry[3]
+
+        async with self._lock:
+            version = self.version
+            query = {"day": {"$gte": (today - timedelta(days=HORIZON_DAYS - 1)).strftime("%Y-%m-%d")}}
+            if doctor_id:
+                query["doctor_id"] = doctor_id
+            rollups = await self.db.feedback_daily.find(query, {"_id": 0}).to_list(None)
+            trends = compute_trends(rollups, today, series=doctor_id is not None)
+            self._cache[key] = (version, feedback_count, time.monotonic(), trends)
+        return trends
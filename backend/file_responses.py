@@ -0,0 +1,161 @@
+"""File download responses with cache validators, byte ranges and zero-copy sends.
+
+Whole files go out as Starlette FileResponse, which uses the ASGI pathsend
+extension when the server offers it. A single byte range is sent with
+zerocopysend (os.sendfile in the server) when available, otherwise read in chunks.
+With an nginx front end the transfer can be handed off entirely through
+X-Accel-Redirect to an internal location, e.g.
+
+    location /protected-uploads/ { internal; alias /app/backend/uploads/; }
+"""
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+
+import aiofiles
+import aiofiles.os
+from starlette.responses import FileResponse, Response
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Inclusive (start, end) of a single "bytes=" range, or None to send the whole file
+
+    Multiple ranges and malformed headers are ignored, as RFC 9110 allows.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, separator, last = header[6:].strip().partition("-")
+    if not separator:
+        return None
+    try:
+        if first == "":
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(size - suffix, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start < 0 or (last and end < start):
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def content_disposition(filename: str, disposition: str = "inline") -> str:
+    quoted = quote(filename)
+    if quoted == filename:
+        return f'{disposition}; filename="{filename}"'
+    return f"{disposition}; filename*=utf-8''{quoted}"
+
+
+def is_not_modified(request_headers, etag: str, modified_at: float) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(modified_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class FileRangeResponse(Response):
+    """206 response for one byte range of a file"""
+
+    def __init__(self, path: Path, start: int, end: int, size: int, headers: Dict[str, str], media_type: str):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.status_code = 206
+        self.media_type = media_type
+        self.background = None
+        self.init_headers({
+            **headers,
+            "content-range": f"bytes {start}-{end}/{size}",
+            "content-length": str(end - start + 1),
+        })
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        count = self.end - self.start + 1
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as f:
+                await send({"type": "http.response.zerocopysend", "file": f, "offset": self.start, "count": count})
+            return
+
+        async with aiofiles.open(self.path, "rb") as f:
+            await f.seek(self.start)
+            while count > 0:
+                chunk = await f.read(min(CHUNK_SIZE, count))
+                if not chunk:
+                    break
+                count -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": count > 0})
+        if count > 0:
+            # File shrank underneath us; close the response rather than hang
+            await send({"type": "http.response.body", "body": b""})
+
+
+async def file_download_response(
+    request,
+    path: Path,
+    filename: str,
+    media_type: Optional[str] = None,
+    etag: Optional[str] = None,
+    disposition: str = "inline",
+    x_accel_redirect: Optional[str] = None,
+) -> Response:
+    """Serve `path` honouring If-None-Match/If-Modified-Since, Range and If-Range
+
+    Raises FileNotFoundError when the file is missing.
+    """
+    stat_result = await aiofiles.os.stat(path)
+    size = stat_result.st_size
+    etag = etag or f'"{int(stat_result.st_mtime):x}-{size:x}"'
+    last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+    media_type = media_type or "application/octet-stream"
+    headers = {
+        "etag": etag,
+        "last-modified": last_modified,
+        "accept-ranges": "bytes",
+        "cache-control": "private, no-cache",
+        "content-disposition": content_disposition(filename, disposition),
+    }
+
+    if is_not_modified(request.headers, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers={key: headers[key] for key in ("etag", "last-modified", "cache-control")})
+
+    if x_accel_redirect:
+        # nginx serves the body (including ranges) from its internal location
+        return Response(headers={**headers, "x-accel-redirect": x_accel_redirect}, media_type=media_type)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and if_range not in (etag, last_modified):
+        # The client's copy is outdated: send the whole current file
+        range_header = None
+    try:
+        byte_range = parse_byte_range(range_header, size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={"content-range": f"bytes */{size}", "accept-ranges": "bytes"})
+
+    if byte_range is None:
+        return FileResponse(path, headers=headers, media_type=media_type, stat_result=stat_result)
+    return FileRangeResponse(path, byte_range[0], byte_range[1], size, headers, media_type)
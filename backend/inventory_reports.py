@@ -0,0 +1,172 @@
+"""Vectorized inventory reports: stock valuation, monthly consumption and reorder suggestions.
+
+The stock ledger is streamed from a MongoDB cursor in fixed-size batches into
+columnar numpy arrays, so a report never materialises millions of ledger
+documents as Python dicts at once. All arithmetic runs on pandas/numpy columns.
+"""
+import json
+import time
+from datetime import datetime
+from typing import Any, AsyncIterable, Callable, Dict, Hashable, List
+
+import numpy as np
+import pandas as pd
+
+LEDGER_COLUMNS = ["inventory_item_id", "transaction_type", "quantity", "stock_change", "cost_per_unit", "transaction_date"]
+LEDGER_BATCH_SIZE = 10000
+
+# Ledger entries that take stock out of use and count as consumption
+CONSUMPTION_TYPES = ["usage", "expired"]
+
+
+def _records(frame: pd.DataFrame) -> List[Dict[str, Any]]:
+    """JSON-safe list of dicts (numpy scalars and NaN become plain Python values)"""
+    return json.loads(frame.to_json(orient="records", date_format="iso"))
+
+
+def _batch_to_frame(batch: Dict[str, list]) -> pd.DataFrame:
+    return pd.DataFrame({
+        "inventory_item_id": np.array(batch["inventory_item_id"], dtype=object),
+        "transaction_type": np.array(batch["transaction_type"], dtype=object),
+        "quantity": np.array(batch["quantity"], dtype=np.int64),
+        "stock_change": np.array(batch["stock_change"], dtype=np.float64),
+        "cost_per_unit": np.array(batch["cost_per_unit"], dtype=np.float64),
+        "transaction_date": np.array(batch["transaction_date"], dtype="datetime64[ms]"),
+    })
+
+
+async def ledger_frame(rows: AsyncIterable[dict], batch_size: int = LEDGER_BATCH_SIZE) -> pd.DataFrame:
+    """Stream ledger documents into a columnar frame, one batch of arrays at a time"""
+    frames = []
+    batch = {column: [] for column in LEDGER_COLUMNS}
+    count = 0
+    async for row in rows:
+        batch["inventory_item_id"].append(row.get("inventory_item_id"))
+        batch["transaction_type"].append(row.get("transaction_type"))
+        batch["quantity"].append(row.get("quantity") or 0)
+        batch["stock_change"].append(np.nan if row.get("stock_change") is None else row["stock_change"])
+        batch["cost_per_unit"].append(np.nan if row.get("cost_per_unit") is None else row["cost_per_unit"])
+        batch["transaction_date"].append(row.get("transaction_date"))
+        count += 1
+        if count == batch_size:
+            frames.append(_batch_to_frame(batch))
+            batch = {column: [] for column in LEDGER_COLUMNS}
+            count = 0
+    if count:
+        frames.append(_batch_to_frame(batch))
+    if not frames:
+        return _batch_to_frame({column: [] for column in LEDGER_COLUMNS})
+
+    ledger = pd.concat(frames, ignore_index=True)
+    # Entries written before stock_change was stored derive it from type and quantity
+    sign = ledger["transaction_type"].map({"purchase": 1, "adjustment": 1, "usage": -1, "expired": -1}).fillna(0)
+    ledger["stock_change"] = ledger["stock_change"].fillna(sign * ledger["quantity"])
+    return ledger
+
+
+def items_frame(items: List[dict]) -> pd.DataFrame:
+    frame = pd.DataFrame(items, columns=["id", "name", "category", "unit", "current_stock", "minimum_stock", "cost_per_unit"])
+    frame["current_stock"] = pd.to_numeric(frame["current_stock"], errors="coerce").fillna(0)
+    frame["minimum_stock"] = pd.to_numeric(frame["minimum_stock"], errors="coerce").fillna(0)
+    frame["cost_per_unit"] = pd.to_numeric(frame["cost_per_unit"], errors="coerce").fillna(0.0)
+    return frame
+
+
+def stock_valuation(items: pd.DataFrame, top: int = 20) -> Dict[str, Any]:
+    """Stock value per category and the most valuable items"""
+    items = items.assign(stock_value=items["current_stock"].clip(lower=0) * items["cost_per_unit"])
+    by_category = (
+        items.groupby("category", dropna=False)
+        .agg(item_count=("id", "size"), units=("current_stock", "sum"), stock_value=("stock_value", "sum"))
+        .reset_index()
+        .sort_values("stock_value", ascending=False)
+    )
+    by_category["stock_value"] = by_category["stock_value"].round(2)
+    top_items = items.nlargest(top, "stock_value")[["id", "name", "category", "current_stock", "unit", "cost_per_unit", "stock_value"]]
+    return {
+        "total_value": round(float(items["stock_value"].sum()), 2),
+        "item_count": int(len(items)),
+        "by_category": _records(by_category),
+        "top_items": _records(top_items.round({"stock_value": 2})),
+    }
+
+
+def monthly_consumption(ledger: pd.DataFrame, items: pd.DataFrame) -> Dict[str, Any]:
+    """Quantity and cost consumed per month and category"""
+    consumed = ledger[ledger["transaction_type"].isin(CONSUMPTION_TYPES)]
+    categories = items.set_index("id")["category"]
+    item_costs = items.set_index("id")["cost_per_unit"]
+
+    unit_cost = consumed["cost_per_unit"].fillna(consumed["inventory_item_id"].map(item_costs)).fillna(0.0)
+    frame = pd.DataFrame({
+        "month": consumed["transaction_date"].dt.strftime("%Y-%m"),
+        "category": consumed["inventory_item_id"].map(categories).fillna("unknown"),
+        "quantity": consumed["quantity"].abs(),
+        "cost": consumed["quantity"].abs() * unit_cost,
+    })
+    rows = (
+        frame.groupby(["month", "category"])
+        .agg(quantity=("quantity", "sum"), cost=("cost", "sum"), transactions=("quantity", "size"))
+        .reset_index()
+        .sort_values(["month", "category"])
+    )
+    rows["cost"] = rows["cost"].round(2)
+    totals = rows.groupby("month").agg(quantity=("quantity", "sum"), cost=("cost", "sum")).reset_index()
+    return {"rows": _records(rows), "monthly_totals": _records(totals.round({"cost": 2}))}
+
+
+def reorder_suggestions(ledger: pd.DataFrame, items: pd.DataFrame, window_days: int, lead_time_days: int, cover_days: int) -> List[Dict[str, Any]]:
+    """Average daily usage over the window, days of cover and suggested reorder quantities"""
+    codes, uniques = pd.factorize(items["id"])
+    usage = ledger[ledger["transaction_type"] == "usage"]
+    usage_codes = pd.Index(uniques).get_indexer(usage["inventory_item_id"])
+    known = usage_codes >= 0
+    used = np.bincount(usage_codes[known], weights=usage["quantity"].to_numpy()[known], minlength=len(uniques))
+
+    stock = items["current_stock"].to_numpy(dtype=np.float64)
+    minimum = items["minimum_stock"].to_numpy(dtype=np.float64)
+    average_daily = used[codes] / max(window_days, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        days_of_cover = np.where(average_daily > 0, stock / average_daily, np.inf)
+    reorder_point = average_daily * lead_time_days + minimum
+    suggested = np.ceil(np.maximum(reorder_point + average_daily * cover_days - stock, 0))
+
+    frame = items[["id", "name", "category", "unit", "current_stock", "minimum_stock", "cost_per_unit"]].assign(
+        average_daily_usage=np.round(average_daily, 3),
+        days_of_cover=np.round(days_of_cover, 1),
+        reorder_point=np.ceil(reorder_point),
+        suggested_quantity=suggested,
+        estimated_cost=np.round(suggested * items["cost_per_unit"].to_numpy(), 2),
+    )
+    # Items with neither usage nor a minimum have no reorder point to fall below
+    frame = frame[(stock <= reorder_point) & (reorder_point > 0)].sort_values("days_of_cover")
+    frame["days_of_cover"] = frame["days_of_cover"].replace(np.inf, None)
+    return _records(frame)
+
+
+class ReportCache:
+    """Memoises report results until the inventory changes (or the TTL lapses on other workers)"""
+
+    def __init__(self, ttl_seconds: int = 300):
+        self.ttl_seconds = ttl_seconds
+        self.version = 0
+        self._entries: Dict[Hashable, tuple] = {}
+
+    def invalidate(self):
+        self.version += 1
+        self._entries.clear()
+
+    async def get(self, key: Hashable, compute: Callable[[], Any]) -> Dict[str, Any]:
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry and entry[0] == self.version and now - entry[1] < self.ttl_seconds:
+            return {**entry[2], "cached": True}
+
+        version = self.version
+        started = time.perf_counter()
+        result = await compute()
+        result = {**result, "generated_at": datetime.utcnow().isoformat(), "compute_ms": round((time.perf_counter() - started) * 1000, 2)}
+        # Only keep the result if no write invalidated the cache while it was computed
+        if version == self.version:
+            self._entries[key] = (version, now, result)
+        return {**result, "cached": False}
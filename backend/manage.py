@@ -0,0 +1,116 @@
+"""Maintenance commands for the Unicare backend.
+
+    python manage.py migrate-stock-ledger --bucket day
+    python manage.py rebuild-feedback-summaries
+    python manage.py migrate-documents-to-blobs
+"""
+import asyncio
+from pathlib import Path
+
+import typer
+
+import server
+from stock_ledger import StockLedger
+
+app = typer.Typer(help="Unicare backend maintenance commands")
+
+
+@app.callback()
+def main():
+    """Unicare backend maintenance commands"""
+
+
+@app.command("migrate-stock-ledger")
+def migrate_stock_ledger(
+    bucket: str = typer.Option(server.STOCK_LEDGER_BUCKET, help="Bucket span: day or hour"),
+    batch_size: int = typer.Option(1000, help="Buckets written per bulk round trip"),
+    drop_source: bool = typer.Option(False, help="Drop stock_transactions after a verified migration"),
+):
+    """Copy stock_transactions into the bucketed ledger layout (safe to re-run)"""
+    async def run():
+        ledger = StockLedger(server.db, layout="bucket", bucket=bucket)
+        await ledger.ensure_indexes()
+        report = await ledger.migrate_documents_to_buckets(
+            batch_size=batch_size,
+            progress=lambda r: print(f"  {r['transactions']:,} transactions -> {r['buckets']:,} buckets")
+        )
+        print(f"Migrated {report['transactions']:,} transactions into {report['buckets']:,} buckets in {report['duration_seconds']}s")
+
+        verification = await ledger.verify_buckets()
+        print(
+            f"Verification: {verification['document_transactions']:,} documents / {verification['bucket_transactions']:,} bucket entries, "
+            f"net change {verification['document_net_change']} / {verification['bucket_net_change']}"
+        )
+        if not verification["matches"]:
+            print("Ledger layouts differ; stock_transactions left in place")
+            raise typer.Exit(code=1)
+        if drop_source:
+            await server.db.stock_transactions.drop()
+            print("Dropped stock_transactions")
+        print("Set STOCK_LEDGER_LAYOUT=bucket to read and write the bucketed ledger")
+
+    asyncio.run(run())
+
+
+@app.command("rebuild-feedback-summaries")
+def rebuild_feedback_summaries():
+    """Backfill the per-doctor feedback summaries and daily rollups from existing feedback"""
+    async def run():
+        await server.db.doctor_feedback_summary.create_index("doctor_id", unique=True)
+        await server.feedback_analytics.ensure_indexes()
+        report = await server.rebuild_feedback_summaries()
+        print(f"Summarised {report['feedback']:,} feedback entries for {report['doctors']:,} doctors")
+        rollups = await server.feedback_analytics.rebuild()
+        print(f"Rebuilt {rollups['rollups']:,} daily feedback rollups")
+
+    asyncio.run(run())
+
+
+@app.command("migrate-documents-to-blobs")
+def migrate_documents_to_blobs(
+    keep_originals: bool = typer.Option(False, help="Leave the flat patient_documents files in place"),
+):
+    """Move flat patient document files into the content-addressed blob store (safe to re-run)"""
+    async def run():
+        store = server.blob_store
+        await store.ensure_indexes()
+        migrated = missing = duplicates = 0
+        async for document in server.db.patient_documents.find({"blob_key": None}, {"_id": 0, "id": 1, "file_path": 1}):
+            source = Path("/app/backend" + document["file_path"])
+            if not source.exists():
+                missing += 1
+                print(f"  missing file for document {document['id']}: {document['file_path']}")
+                continue
+            staged = await store.stage_file(source)
+            key, created = await store.claim(staged, source.suffix)
+            result = await server.db.patient_documents.update_one(
+                {"id": document["id"], "blob_key": None},
+                {"$set": {"blob_key": key, "file_path": server.document_download_url(document["id"]), "sha256": staged.sha256, "file_size": staged.size}}
+            )
+            if result.modified_count == 0:
+                # Migrated or deleted concurrently
+                await store.release(key)
+                await staged.discard()
+                continue
+            await store.store(staged, key)
+            if not keep_originals:
+                source.unlink()
+            migrated += 1
+            duplicates += 0 if created else 1
+
+        # Blob documents once recorded a static /uploads/blobs/ URL that is not served
+        relinked = 0
+        async for document in server.db.patient_documents.find(
+            {"blob_key": {"$ne": None}, "file_path": {"$regex": "^/uploads/"}}, {"_id": 0, "id": 1}
+        ):
+            await server.db.patient_documents.update_one(
+                {"id": document["id"]}, {"$set": {"file_path": server.document_download_url(document["id"])}}
+            )
+            relinked += 1
+        print(f"Migrated {migrated:,} documents ({duplicates:,} duplicate contents), {missing:,} files missing, {relinked:,} links updated")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    app()
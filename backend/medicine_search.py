@@ -0,0 +1,237 @@
+"""In-memory search index over the medicine catalog.
+
+Medicine name, generic_name and manufacturer are split into lowercase tokens.
+Prefix matches come from a sorted token list (bisect), typo-tolerant matches from a
+trigram index over the same tokens, scored by trigram overlap. The index only
+ranks ids; callers load the current documents (price, stock) from the database.
+Writes update the index incrementally through upsert() and remove(), including the
+name-ordered id list that serves unfiltered browsing and the facet value counts.
+"""
+import re
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Relative weight of a match in each indexed field
+SEARCH_FIELDS = {"name": 1.0, "generic_name": 0.8, "manufacturer": 0.5}
+
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.75
+FUZZY_SCORE = 0.5
+# Minimum trigram similarity for a token to count as a typo of the query token
+FUZZY_THRESHOLD = 0.4
+# Query tokens shorter than this only match exactly or by prefix
+FUZZY_MIN_LENGTH = 4
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+def trigrams(token: str) -> Set[str]:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class MedicineSearchIndex:
+    def __init__(self):
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        # token -> {medicine id: best field weight of that token in the medicine}
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.sorted_tokens: List[str] = []
+        self.trigram_tokens: Dict[str, Set[str]] = {}
+        # token -> size of its trigram set, the denominator term of the Jaccard score
+        self.trigram_counts: Dict[str, int] = {}
+        # (lowercase name, id) for every medicine, in browse order
+        self.name_order: List[Tuple[str, str]] = []
+        self.facet_counts: Dict[str, Counter] = {"category": Counter(), "dosage_form": Counter()}
+        self._facets: Optional[Dict[str, List[str]]] = None
+        self.loaded_at: Optional[float] = None
+
+    def __len__(self):
+        return len(self.documents)
+
+    @property
+    def loaded(self) -> bool:
+        return self.loaded_at is not None
+
+    def load(self, medicines: Iterable[dict]):
+        """Rebuild from the full catalog"""
+        self.documents, self.postings, self.sorted_tokens, self.trigram_tokens = {}, {}, [], {}
+        self.trigram_counts, self.name_order = {}, []
+        self.facet_counts = {"category": Counter(), "dosage_form": Counter()}
+        self._facets = None
+        for medicine in medicines:
+            self._add(medicine)
+        self.sorted_tokens = sorted(self.postings)
+        self.name_order.sort()
+        self.loaded_at = time.monotonic()
+
+    def _tokens(self, medicine: dict) -> Dict[str, float]:
+        weights = {}
+        for field, weight in SEARCH_FIELDS.items():
+            for token in tokenize(medicine.get(field)):
+                weights[token] = max(weights.get(token, 0.0), weight)
+        return weights
+
+    def _add(self, medicine: dict, keep_sorted: bool = False):
+        medicine_id = medicine["id"]
+        self.documents[medicine_id] = {
+            "id": medicine_id,
+            "name": medicine.get("name") or "",
+            "category": medicine.get("category") or "",
+            "dosage_form": medicine.get("dosage_form") or "",
+            "tokens": self._tokens(medicine),
+        }
+        document = self.documents[medicine_id]
+        entry = (document["name"].lower(), medicine_id)
+        if keep_sorted:
+            insort(self.name_order, entry)
+        else:
+            self.name_order.append(entry)
+        self._count_facets(document, 1)
+        for token, weight in document["tokens"].items():
+            if token not in self.postings:
+                self.postings[token] = {}
+                if keep_sorted:
+                    insort(self.sorted_tokens, token)
+                token_trigrams = trigrams(token)
+                self.trigram_counts[token] = len(token_trigrams)
+                for trigram in token_trigrams:
+                    self.trigram_tokens.setdefault(trigram, set()).add(token)
+            self.postings[token][medicine_id] = weight
+
+    def _count_facets(self, document: Dict[str, Any], delta: int):
+        for field, counts in self.facet_counts.items():
+            value = document[field]
+            if not value:
+                continue
+            counts[value] += delta
+            if counts[value] <= 0:
+                del counts[value]
+                self._facets = None
+            elif counts[value] == delta:
+                # First medicine with this value
+                self._facets = None
+
+    def remove(self, medicine_id: str):
+        document = self.documents.pop(medicine_id, None)
+        if document is None:
+            return
+        entry = (document["name"].lower(), medicine_id)
+        position = bisect_left(self.name_order, entry)
+        if position < len(self.name_order) and self.name_order[position] == entry:
+            del self.name_order[position]
+        self._count_facets(document, -1)
+        for token in document["tokens"]:
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(medicine_id, None)
+            if not postings:
+                del self.postings[token]
+                del self.trigram_counts[token]
+                position = bisect_left(self.sorted_tokens, token)
+                if position < len(self.sorted_tokens) and self.sorted_tokens[position] == token:
+                    del self.sorted_tokens[position]
+                for trigram in trigrams(token):
+                    tokens = self.trigram_tokens.get(trigram)
+                    if tokens is not None:
+                        tokens.discard(token)
+                        if not tokens:
+                            del self.trigram_tokens[trigram]
+
+    def upsert(self, medicine: dict):
+        """Index a created or updated medicine"""
+        self.remove(medicine["id"])
+        self._add(medicine, keep_sorted=True)
+
+    def _prefix_tokens(self, prefix: str) -> List[str]:
+        start = bisect_left(self.sorted_tokens, prefix)
+        matches = []
+        for token in self.sorted_tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            matches.append(token)
+        return matches
+
+    def _fuzzy_tokens(self, token: str) -> List[Tuple[str, float]]:
+        query_trigrams = trigrams(token)
+        overlap: Dict[str, int] = {}
+        for trigram in query_trigrams:
+            for candidate in self.trigram_tokens.get(trigram, ()):
+                overlap[candidate] = overlap.get(candidate, 0) + 1
+        matches = []
+        for candidate, shared in overlap.items():
+            # Jaccard similarity: shared trigrams over the union of both trigram sets
+            similarity = shared / (len(query_trigrams) + self.trigram_counts[candidate] - shared)
+            if similarity >= FUZZY_THRESHOLD:
+                matches.append((candidate, similarity))
+        return matches
+
+    def _token_scores(self, token: str) -> Dict[str, float]:
+        """Best score per medicine id for one query token"""
+        scores: Dict[str, float] = {}
+
+        def add(candidate: str, score: float):
+            for medicine_id, weight in self.postings[candidate].items():
+                if weight * score > scores.get(medicine_id, 0.0):
+                    scores[medicine_id] = weight * score
+
+        for candidate in self._prefix_tokens(token):
+            add(candidate, EXACT_SCORE if candidate == token else PREFIX_SCORE * (0.5 + 0.5 * len(token) / len(candidate)))
+        if len(token) >= FUZZY_MIN_LENGTH:
+            for candidate, similarity in self._fuzzy_tokens(token):
+                if not candidate.startswith(token):
+                    add(candidate, FUZZY_SCORE * similarity)
+        return scores
+
+    def search(
+        self,
+        query: str = "",
+        category: Optional[str] = None,
+        dosage_form: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> Tuple[List[Tuple[str, float]], int]:
+        """Ranked (medicine id, score) pairs matching every query token, and the total match count"""
+        category = category.lower() if category else None
+        dosage_form = dosage_form.lower() if dosage_form else None
+
+        def allowed(medicine_id: str) -> bool:
+            document = self.documents[medicine_id]
+            return (category is None or document["category"].lower() == category) and \
+                (dosage_form is None or document["dosage_form"].lower() == dosage_form)
+
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            if category is None and dosage_form is None:
+                page = self.name_order[offset:offset + limit]
+                return [(medicine_id, 0.0) for _, medicine_id in page], len(self.name_order)
+            matches = [(medicine_id, 0.0) for _, medicine_id in self.name_order if allowed(medicine_id)]
+            return matches[offset:offset + limit], len(matches)
+
+        totals: Optional[Dict[str, float]] = None
+        for token in query_tokens:
+            scores = self._token_scores(token)
+            if totals is None:
+                totals = {medicine_id: score for medicine_id, score in scores.items() if allowed(medicine_id)}
+            else:
+                totals = {medicine_id: total + scores[medicine_id] for medicine_id, total in totals.items() if medicine_id in scores}
+            if not totals:
+                return [], 0
+
+        ranked = sorted(totals.items(), key=lambda match: (-match[1], self.documents[match[0]]["name"].lower()))
+        return ranked[offset:offset + limit], len(ranked)
+
+    def facets(self) -> Dict[str, List[str]]:
+        """Distinct categories and dosage forms, re-sorted only after the set of values changes"""
+        if self._facets is None:
+            self._facets = {
+                "categories": sorted(self.facet_counts["category"]),
+                "dosage_forms": sorted(self.facet_counts["dosage_form"]),
+            }
+        return self._facets
@@ -0,0 +1,108 @@
+"""In-process pub/sub broker feeding the notification push channel.
+
+Subscribers are per-user asyncio queues (one per open SSE connection). When
+REDIS_URL is configured, events are published to a Redis channel and every
+worker's listener dispatches them to its own local subscribers, so a
+notification created on one worker reaches clients connected to any other.
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHANNEL = "unicare:notifications"
+
+
+class NotificationBroker:
+    def __init__(self, redis_url: Optional[str] = None, channel: str = DEFAULT_CHANNEL, queue_size: int = 100):
+        self.redis_url = redis_url
+        self.channel = channel
+        self.queue_size = queue_size
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+
+    @property
+    def connection_count(self) -> int:
+        return sum(len(queues) for queues in self.subscribers.values())
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[user_id]
+
+    def _dispatch_local(self, user_id: str, event: Dict[str, Any]):
+        for queue in self.subscribers.get(user_id, ()):
+            if queue.full():
+                # A stalled client loses its oldest event rather than blocking publishers
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def publish(self, user_id: str, event: Dict[str, Any]):
+        """Deliver a JSON-serialisable event to every connection of `user_id`"""
+        if self._redis is not None:
+            try:
+                await self._redis.publish(self.channel, json.dumps({"user_id": user_id, "event": event}))
+                return
+            except Exception as e:
+                logger.error(f"Redis publish failed, delivering locally only: {e}")
+        self._dispatch_local(user_id, event)
+
+    async def _listen(self):
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        payload = json.loads(message["data"])
+                        self._dispatch_local(payload["user_id"], payload["event"])
+                    except (ValueError, KeyError) as e:
+                        logger.error(f"Malformed notification broker message: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis subscription lost, reconnecting: {e}")
+                await asyncio.sleep(5)
+            finally:
+                await pubsub.close()
+
+    async def start(self):
+        """Connect the optional Redis fan-out; without it the broker stays in-process"""
+        if not self.redis_url:
+            return
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError:
+            logger.warning("redis package not installed; notification push is limited to this worker")
+            return
+
+        try:
+            self._redis = redis_asyncio.from_url(self.redis_url, decode_responses=True)
+            await self._redis.ping()
+        except Exception as e:
+            logger.error(f"Could not connect to Redis at {self.redis_url}; using in-process broker: {e}")
+            self._redis = None
+            return
+        self._listener = asyncio.create_task(self._listen())
+        logger.info("Notification broker fan-out via Redis enabled")
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
@@ -0,0 +1,171 @@
+"""Server-side order pricing from an in-memory catalog snapshot and compiled campaign rules.
+
+The snapshot maps every medicine, lab test and lab package id to its price. Active
+campaigns are compiled into an index keyed by (catalog, item id) plus one list of
+catalog-wide campaigns per catalog, so pricing a cart line only looks at the few
+campaigns that can apply to it instead of scanning every campaign.
+"""
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+MEDICINES = "medicines"
+LAB_TESTS = "lab_tests"
+LAB_PACKAGES = "lab_packages"
+
+# Campaign.applicable_to -> catalogs the campaign covers; lab campaigns cover tests and packages
+CAMPAIGN_SCOPES = {
+    "medicines": (MEDICINES,),
+    "lab_tests": (LAB_TESTS, LAB_PACKAGES),
+    "all": (MEDICINES, LAB_TESTS, LAB_PACKAGES),
+}
+
+
+class PricingError(ValueError):
+    """A cart that cannot be priced (unknown item, invalid quantity)"""
+
+
+class CompiledCampaign:
+    __slots__ = ("id", "name", "campaign_type", "percentage", "start_date", "end_date", "usage_limit", "usage_count", "exhausted")
+
+    def __init__(self, campaign: Dict[str, Any]):
+        self.id = campaign["id"]
+        self.name = campaign.get("name")
+        self.campaign_type = campaign.get("campaign_type", "discount")
+        self.percentage = min(max(campaign.get("discount_percentage") or 0.0, 0.0), 100.0)
+        self.start_date = campaign.get("start_date") or ""
+        self.end_date = campaign.get("end_date") or "9999-12-31"
+        self.usage_limit = campaign.get("usage_limit")
+        self.usage_count = campaign.get("usage_count") or 0
+        self.exhausted = bool(campaign.get("exhausted"))
+
+    def is_live(self, today: str) -> bool:
+        if not self.start_date <= today <= self.end_date or self.exhausted:
+            return False
+        return self.usage_limit is None or self.usage_count < self.usage_limit
+
+    def discount(self, unit_price: float, quantity: int) -> float:
+        if self.campaign_type == "buy_one_get_one":
+            return unit_price * (quantity // 2)
+        return unit_price * quantity * self.percentage / 100
+
+
+class PricingEngine:
+    def __init__(self):
+        self.prices: Dict[str, Dict[str, float]] = {MEDICINES: {}, LAB_TESTS: {}, LAB_PACKAGES: {}}
+        self.names: Dict[str, Dict[str, str]] = {MEDICINES: {}, LAB_TESTS: {}, LAB_PACKAGES: {}}
+        self.item_campaigns: Dict[Tuple[str, str], List[CompiledCampaign]] = {}
+        self.catalog_campaigns: Dict[str, List[CompiledCampaign]] = {MEDICINES: [], LAB_TESTS: [], LAB_PACKAGES: []}
+        self._live: Optional[tuple] = None
+        self.loaded_at: Optional[float] = None
+        self.version = 0
+
+    def load(self, medicines: Iterable[dict], lab_tests: Iterable[dict], lab_packages: Iterable[dict], campaigns: Iterable[dict]):
+        """Replace the snapshot; the new catalogs and index are swapped in together"""
+        prices = {MEDICINES: {}, LAB_TESTS: {}, LAB_PACKAGES: {}}
+        names = {MEDICINES: {}, LAB_TESTS: {}, LAB_PACKAGES: {}}
+        for catalog, rows, price_field in (
+            (MEDICINES, medicines, "price"),
+            (LAB_TESTS, lab_tests, "price"),
+            (LAB_PACKAGES, lab_packages, "package_price"),
+        ):
+            for row in rows:
+                prices[catalog][row["id"]] = float(row.get(price_field) or 0.0)
+                names[catalog][row["id"]] = row.get("name")
+
+        item_campaigns = {}
+        catalog_campaigns = {MEDICINES: [], LAB_TESTS: [], LAB_PACKAGES: []}
+        for campaign in campaigns:
+            if not campaign.get("is_active", True):
+                continue
+            compiled = CompiledCampaign(campaign)
+            for catalog in CAMPAIGN_SCOPES.get(campaign.get("applicable_to", "medicines"), ()):
+                if campaign.get("applicable_items"):
+                    for item_id in campaign["applicable_items"]:
+                        if item_id in prices[catalog]:
+                            item_campaigns.setdefault((catalog, item_id), []).append(compiled)
+                else:
+                    catalog_campaigns[catalog].append(compiled)
+
+        self.prices, self.names = prices, names
+        self.item_campaigns, self.catalog_campaigns = item_campaigns, catalog_campaigns
+        self._live = None
+        self.loaded_at = time.monotonic()
+        self.version += 1
+
+    def is_stale(self, ttl_seconds: float) -> bool:
+        return self.loaded_at is None or time.monotonic() - self.loaded_at >= ttl_seconds
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    def live_index(self, today: str):
+        """Index narrowed to the campaigns running on `today`, memoised for that day"""
+        if self._live is None or self._live[0] != today:
+            item_campaigns = {}
+            for key, campaigns in self.item_campaigns.items():
+                live = [campaign for campaign in campaigns if campaign.is_live(today)]
+                if live:
+                    item_campaigns[key] = live
+            catalog_campaigns = {
+                catalog: [campaign for campaign in campaigns if campaign.is_live(today)]
+                for catalog, campaigns in self.catalog_campaigns.items()
+            }
+            self._live = (today, item_campaigns, catalog_campaigns)
+        return self._live[1], self._live[2]
+
+    def best_campaign(self, catalog: str, item_id: str, unit_price: float, quantity: int, today: str, exclude=()):
+        """Largest single discount for a line; campaigns never stack"""
+        item_campaigns, catalog_campaigns = self.live_index(today)
+        best, best_discount = None, 0.0
+        for campaigns in (item_campaigns.get((catalog, item_id), ()), catalog_campaigns[catalog]):
+            for campaign in campaigns:
+                if campaign.id in exclude:
+                    continue
+                discount = campaign.discount(unit_price, quantity)
+                if discount > best_discount:
+                    best, best_discount = campaign, discount
+        return best, best_discount
+
+    def price_cart(self, lines: Iterable[Tuple[str, str, int]], today: Optional[str] = None, exclude=()) -> Dict[str, Any]:
+        """Price (catalog, item_id, quantity) lines; client-supplied prices are never consulted
+
+        Campaigns in `exclude` (e.g. ones whose usage limit was just reached) are skipped.
+        """
+        today = today or datetime.utcnow().strftime("%Y-%m-%d")
+        priced = []
+        subtotal = discount_total = 0.0
+        applied = {}
+        for catalog, item_id, quantity in lines:
+            if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+                raise PricingError(f"Invalid quantity for {item_id}: {quantity}")
+            unit_price = self.prices[catalog].get(item_id)
+            if unit_price is None:
+                raise PricingError(f"Unknown {catalog.replace('_', ' ')[:-1]} '{item_id}'")
+
+            campaign, discount = self.best_campaign(catalog, item_id, unit_price, quantity, today, exclude)
+            gross = round(unit_price * quantity, 2)
+            discount = round(min(discount, gross), 2)
+            priced.append({
+                "item_type": catalog,
+                "item_id": item_id,
+                "name": self.names[catalog].get(item_id),
+                "quantity": quantity,
+                "unit_price": unit_price,
+                "discount": discount,
+                "line_total": round(gross - discount, 2),
+                "campaign_id": campaign.id if campaign else None,
+            })
+            subtotal += gross
+            discount_total += discount
+            if campaign:
+                applied[campaign.id] = campaign.name
+
+        return {
+            "lines": priced,
+            "subtotal": round(subtotal, 2),
+            "discount_amount": round(discount_total, 2),
+            "total_amount": round(subtotal - discount_total, 2),
+            "applied_campaigns": [{"id": campaign_id, "name": name} for campaign_id, name in applied.items()],
+            "priced_on": today,
+        }
@@ -0,0 +1,301 @@
+"""Cron-style periodic job registry for the Unicare background scheduler.
+
+Jobs are registered with a five-field cron expression (minute hour day-of-month
+month day-of-week, evaluated in UTC). The next due slot of every job is persisted
+in MongoDB, so a restart catches up on a missed slot exactly once and several
+workers sharing the database never run the same slot twice.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# (low, high) bounds for minute, hour, day-of-month, month, day-of-week
+CRON_FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+# Upper bound on the next-slot search; an expression such as "0 0 30 2 *" never matches
+MAX_SCHEDULE_LOOKAHEAD = timedelta(days=366 * 5)
+
+# The scheduler never sleeps longer than this, so registry changes are picked up promptly
+MAX_IDLE_SECONDS = 60
+
+
+class CronSchedule:
+    """Parsed cron expression supporting '*', lists, ranges and steps (e.g. '*/15', '1-5', '8,20')"""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields, got {len(fields)}: '{expression}'")
+
+        self.expression = expression
+        parsed = [self._parse_field(field, low, high) for field, (low, high) in zip(fields, CRON_FIELD_RANGES)]
+        self.minutes, self.hours, self.days, self.months, self.weekdays = parsed
+        # Standard cron semantics: when both day fields are restricted, either may match
+        self.day_restricted = fields[2] != "*"
+        self.weekday_restricted = fields[4] != "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> Set[int]:
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step_text = part.split("/", 1)
+                step = int(step_text)
+                if step <= 0:
+                    raise ValueError(f"Invalid cron step: '{field}'")
+
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start_text, end_text = part.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+
+            # Allow 7 as an alias for Sunday in the day-of-week field
+            if high == 6 and start == end == 7:
+                start = end = 0
+            elif high == 6 and end == 7:
+                end = 6
+                values.add(0)
+            if start < low or end > high or start > end:
+                raise ValueError(f"Cron field '{field}' out of range {low}-{high}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays  # cron: 0 = Sunday
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        """Return the first matching minute strictly after `moment`"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + MAX_SCHEDULE_LOOKAHEAD
+
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + (1 if candidate.month == 12 else 0)
+                month = 1 if candidate.month == 12 else candidate.month + 1
+                candidate = datetime(year, month, 1)
+                continue
+            if not self._day_matches(candidate):
+                candidate = datetime(candidate.year, candidate.month, candidate.day) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
+
+
+class ScheduledJob:
+    """A registered job together with its in-process run metrics"""
+
+    def __init__(self, name: str, expression: str, func: Callable[[], Awaitable[Any]], catch_up: bool = True):
+        self.name = name
+        self.schedule = CronSchedule(expression)
+        self.func = func
+        self.catch_up = catch_up
+        self.next_run_at: Optional[datetime] = None
+        self.running = False
+        self.last_run_at: Optional[datetime] = None
+        self.last_duration_ms: Optional[float] = None
+        self.max_duration_ms: float = 0.0
+        self.total_duration_ms: float = 0.0
+        self.run_count = 0
+        self.failure_count = 0
+        self.last_error: Optional[str] = None
+        self.last_result: Any = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "schedule": self.schedule.expression,
+            "catch_up": self.catch_up,
+            "next_run_at": self.next_run_at,
+            "running": self.running,
+            "last_run_at": self.last_run_at,
+            "last_duration_ms": self.last_duration_ms,
+            "max_duration_ms": round(self.max_duration_ms, 2),
+            "average_duration_ms": round(self.total_duration_ms / self.run_count, 2) if self.run_count else None,
+            "run_count": self.run_count,
+            "failure_count": self.failure_count,
+            "last_error": self.last_error,
+            "last_result": self.last_result,
+        }
+
+
+class JobRegistry:
+    """Registry of cron jobs whose schedule state lives in a MongoDB collection"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+
+    def register(self, name: str, expression: str, func: Callable[[], Awaitable[Any]], catch_up: bool = True) -> ScheduledJob:
+        """Register `func` to run on the cron `expression`; catch_up runs one missed slot after downtime"""
+        if name in self.jobs:
+            raise ValueError(f"Job '{name}' is already registered")
+        job = ScheduledJob(name, expression, func, catch_up=catch_up)
+        self.jobs[name] = job
+        self._wakeup.set()
+        return job
+
+    async def _load_job(self, job: ScheduledJob, now: datetime):
+        await self.collection.update_one(
+            {"name": job.name},
+            {"$setOnInsert": {"name": job.name, "next_run_at": job.schedule.next_after(now), "run_count": 0, "failure_count": 0}},
+            upsert=True
+        )
+        state = await self.collection.find_one({"name": job.name})
+
+        # A persisted slot from another schedule expression is recomputed from now
+        if state.get("schedule") not in (None, job.schedule.expression):
+            state["next_run_at"] = None
+        job.run_count = state.get("run_count", 0)
+        job.failure_count = state.get("failure_count", 0)
+        job.last_run_at = state.get("last_run_at")
+        job.last_duration_ms = state.get("last_duration_ms")
+        job.max_duration_ms = state.get("max_duration_ms", 0.0)
+        job.total_duration_ms = state.get("total_duration_ms", 0.0)
+        job.last_error = state.get("last_error")
+
+        next_run_at = state.get("next_run_at")
+        if next_run_at is None or (next_run_at <= now and not job.catch_up):
+            next_run_at = job.schedule.next_after(now)
+            await self.collection.update_one(
+                {"name": job.name},
+                {"$set": {"next_run_at": next_run_at, "schedule": job.schedule.expression}}
+            )
+        elif next_run_at <= now:
+            logger.info(f"Job {job.name} missed its slot at {next_run_at}; catching up")
+        job.next_run_at = next_run_at
+
+    async def load(self):
+        """Initialise persisted state for every registered job"""
+        await self.collection.create_index("name", unique=True)
+        now = datetime.utcnow()
+        for job in self.jobs.values():
+            await self._load_job(job, now)
+
+    async def _claim(self, job: ScheduledJob, now: datetime) -> bool:
+        """Atomically advance the persisted slot; only the worker that advances it runs the job"""
+        slot = job.next_run_at
+        next_slot = job.schedule.next_after(now)
+        result = await self.collection.update_one(
+            {"name": job.name, "next_run_at": slot},
+            {"$set": {"next_run_at": next_slot, "schedule": job.schedule.expression, "claimed_at": now}}
+        )
+        if result.modified_count == 1:
+            job.next_run_at = next_slot
+            return True
+
+        # Another worker took this slot; follow the persisted schedule
+        state = await self.collection.find_one({"name": job.name})
+        job.next_run_at = state.get("next_run_at") if state and state.get("next_run_at") else next_slot
+        return False
+
+    async def _execute(self, job: ScheduledJob, slot: Optional[datetime]):
+        job.running = True
+        started_at = datetime.utcnow()
+        start = time.perf_counter()
+        error = None
+        try:
+            job.last_result = await job.func()
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Job {job.name} failed: {e}")
+        finally:
+            duration_ms = round((time.perf_counter() - start) * 1000, 2)
+            job.running = False
+            job.last_run_at = started_at
+            job.last_duration_ms = duration_ms
+            job.max_duration_ms = max(job.max_duration_ms, duration_ms)
+            job.total_duration_ms += duration_ms
+            job.run_count += 1
+            job.last_error = error
+            if error:
+                job.failure_count += 1
+
+        try:
+            await self.collection.update_one(
+                {"name": job.name},
+                {
+                    "$set": {
+                        "last_run_at": started_at,
+                        "last_slot": slot,
+                        "last_duration_ms": duration_ms,
+                        "last_error": error,
+                    },
+                    "$max": {"max_duration_ms": duration_ms},
+                    "$inc": {
+                        "run_count": 1,
+                        "failure_count": 1 if error else 0,
+                        "total_duration_ms": duration_ms,
+                    },
+                }
+            )
+        except Exception as e:
+            logger.error(f"Could not persist metrics for job {job.name}: {e}")
+
+    def _spawn(self, job: ScheduledJob, slot: Optional[datetime]):
+        task = asyncio.create_task(self._execute(job, slot))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def run_pending(self) -> datetime:
+        """Start every due job and return the earliest upcoming slot"""
+        now = datetime.utcnow()
+        for job in self.jobs.values():
+            if job.next_run_at is None:
+                await self._load_job(job, now)
+            if job.next_run_at <= now and not job.running:
+                slot = job.next_run_at
+                if await self._claim(job, now):
+                    self._spawn(job, slot)
+        return min((job.next_run_at for job in self.jobs.values()), default=now + timedelta(seconds=MAX_IDLE_SECONDS))
+
+    async def run_forever(self):
+        """Sleep until the next slot boundary instead of a fixed interval, so slots never drift"""
+        await self.load()
+        while True:
+            try:
+                self._wakeup.clear()
+                next_due = await self.run_pending()
+                delay = (next_due - datetime.utcnow()).total_seconds()
+                delay = min(max(delay, 0.05), MAX_IDLE_SECONDS)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in job scheduler: {e}")
+                await asyncio.sleep(MAX_IDLE_SECONDS)
+
+    async def run_now(self, name: str) -> Dict[str, Any]:
+        """Run a job immediately outside its schedule (the persisted slot is left untouched)"""
+        job = self.jobs[name]
+        if job.running:
+            raise RuntimeError(f"Job '{name}' is already running")
+        await self._execute(job, None)
+        return job.to_dict()
+
+    def metrics(self) -> List[Dict[str, Any]]:
+        return [job.to_dict() for job in self.jobs.values()]
@@ -1,14 +1,23 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks, File, UploadFile
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, BackgroundTasks, File, UploadFile, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
 import os
+import json
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Dict, Any
 import uuid
+import io
+import mimetypes
+import zipfile
+from collections import defaultdict
 from datetime import datetime, timedelta
 import hashlib
 import jwt
@@ -17,9 +26,23 @@ import random
 import re
 from twilio.rest import Client
 import asyncio
+import time
 import shutil
 import aiofiles
+import pandas as pd
 from fastapi.staticfiles import StaticFiles
+from scheduler import JobRegistry
+from notification_broker import NotificationBroker
+import inventory_reports
+from stock_ledger import StockLedger
+from stock_lots import LotAllocationError, LotBook
+from campaigns import ActiveCampaignCache, CampaignCounters
+from medicine_search import MedicineSearchIndex
+from feedback_analytics import FeedbackAnalytics, rollup_increments
+from document_store import BlobStore, RequestSizeLimitMiddleware, ThreadedReader, TotalSizeLimit, UploadTooLarge
+from file_responses import file_download_response
+from document_previews import PREVIEW_SUFFIX, PreviewGenerator, can_preview, placeholder_svg
+from pricing import PricingEngine, PricingError, MEDICINES, LAB_TESTS, LAB_PACKAGES
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -34,6 +57,30 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'unicare-secret-key-2025')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+# Notification retention: sent-and-read notifications older than the retention age are
+# moved to notifications_archive ("archive") or removed ("delete") by a nightly job
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', '90'))
+NOTIFICATION_RETENTION_MODE = os.environ.get('NOTIFICATION_RETENTION_MODE', 'archive')
+NOTIFICATION_RETENTION_BATCH_SIZE = int(os.environ.get('NOTIFICATION_RETENTION_BATCH_SIZE', '500'))
+NOTIFICATION_RETENTION_PAUSE_MS = int(os.environ.get('NOTIFICATION_RETENTION_PAUSE_MS', '200'))
+# Optional TTL for archived notifications (unset keeps the archive forever)
+NOTIFICATION_ARCHIVE_TTL_DAYS = os.environ.get('NOTIFICATION_ARCHIVE_TTL_DAYS')
+
+# Notification push channel (SSE); REDIS_URL enables fan-out across workers
+REDIS_URL = os.environ.get('REDIS_URL')
+SSE_HEARTBEAT_SECONDS = 25
+notification_broker = NotificationBroker(REDIS_URL)
+
+# Stock ledger layout: "document" (one document per transaction) or "bucket" (one document
+# per item per day/hour); migrate with `python manage.py migrate-stock-ledger` before switching
+STOCK_LEDGER_LAYOUT = os.environ.get('STOCK_LEDGER_LAYOUT', 'document')
+STOCK_LEDGER_BUCKET = os.environ.get('STOCK_LEDGER_BUCKET', 'day')
+stock_ledger = StockLedger(db, layout=STOCK_LEDGER_LAYOUT, bucket=STOCK_LEDGER_BUCKET)
+# Stock postings need multi-document transactions (a replica set); without one the lot,
+# ledger and stock writes are separate and a crash between them leaves them out of step.
+# Set to false only for local development against a standalone mongod.
+STOCK_REQUIRE_TRANSACTIONS = os.environ.get('STOCK_REQUIRE_TRANSACTIONS', 'true').lower() == 'true'
+
 # Twilio Configuration
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID')  # Will be set by user
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN')    # Will be set by user
@@ -56,14 +103,42 @@ UPLOADS_DIR.mkdir(exist_ok=True)
 (UPLOADS_DIR / "patient_documents").mkdir(exist_ok=True)
 (UPLOADS_DIR / "profile_images").mkdir(exist_ok=True)
 
-# Mount static files for serving uploaded documents
-app.mount("/uploads", StaticFiles(directory="/app/backend/uploads"), name="uploads")
+# Uploads are streamed to disk in chunks and refused once they pass this size
+DOCUMENT_MAX_UPLOAD_MB = int(os.environ.get('DOCUMENT_MAX_UPLOAD_MB', '100'))
+DOCUMENT_MAX_UPLOAD_BYTES = DOCUMENT_MAX_UPLOAD_MB * 1024 * 1024
+# Allowance for multipart boundaries and form fields on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+# Bulk uploads: total request size, files (including ZIP members) per request and files written at once
+DOCUMENT_BULK_MAX_UPLOAD_MB = int(os.environ.get('DOCUMENT_BULK_MAX_UPLOAD_MB', '500'))
+DOCUMENT_BULK_MAX_FILES = int(os.environ.get('DOCUMENT_BULK_MAX_FILES', '200'))
+DOCUMENT_BULK_CONCURRENCY = int(os.environ.get('DOCUMENT_BULK_CONCURRENCY', '4'))
+# ZIP bomb guards: total bytes a bulk upload may expand to, and the highest member compression ratio
+DOCUMENT_BULK_MAX_EXTRACTED_MB = int(os.environ.get('DOCUMENT_BULK_MAX_EXTRACTED_MB', '1024'))
+DOCUMENT_BULK_MAX_EXTRACTED_BYTES = DOCUMENT_BULK_MAX_EXTRACTED_MB * 1024 * 1024
+DOCUMENT_ZIP_MAX_RATIO = int(os.environ.get('DOCUMENT_ZIP_MAX_RATIO', '100'))
+# Unreferenced document blobs are deleted this long after their last document is removed
+DOCUMENT_BLOB_GC_GRACE_MINUTES = int(os.environ.get('DOCUMENT_BLOB_GC_GRACE_MINUTES', '60'))
+# Patient documents are stored once per content under uploads/blobs/ab/cd/<sha256><ext>
+blob_store = BlobStore(db, UPLOADS_DIR / "blobs")
+blob_store.ensure_directories()
+# Signed document links (for <a href> and media players that cannot send headers) expire after this
+DOCUMENT_LINK_TTL_SECONDS = int(os.environ.get('DOCUMENT_LINK_TTL_SECONDS', '300'))
+# Set to an nginx internal location aliasing UPLOADS_DIR (e.g. /protected-uploads) to let nginx send files
+DOCUMENT_X_ACCEL_PREFIX = os.environ.get('DOCUMENT_X_ACCEL_PREFIX', '').rstrip('/')
+# Document previews render in a process pool of this size, after the upload has been answered
+DOCUMENT_PREVIEW_WORKERS = int(os.environ.get('DOCUMENT_PREVIEW_WORKERS', '2'))
+preview_generator = PreviewGenerator(DOCUMENT_PREVIEW_WORKERS)
+
+# Mount static files for public uploads; patient documents are only served through
+# the authenticated /api/documents/{id}/download endpoint
+app.mount("/uploads/profile_images", StaticFiles(directory="/app/backend/uploads/profile_images"), name="uploads")
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 # Pydantic Models
 class UserRole(str):
@@ -164,6 +239,8 @@ class InventoryItem(BaseModel):
     supplier: Optional[str] = None
     expiry_date: Optional[str] = None
     location: Optional[str] = None  # pharmacy, lab_room_1, etc.
+    is_low_stock: bool = False  # maintained on every stock/minimum change: current_stock <= minimum_stock
+    low_stock_alerted: bool = False  # set once admins were notified of the current low-stock episode
     last_updated: datetime = Field(default_factory=datetime.utcnow)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -172,11 +249,28 @@ class StockTransaction(BaseModel):
     inventory_item_id: str
     transaction_type: str  # purchase, usage, adjustment, expired
     quantity: int
+    stock_change: int = 0  # signed effect on current_stock, derived from type and quantity
     cost_per_unit: Optional[float] = None
     total_cost: Optional[float] = None
     notes: Optional[str] = None
     performed_by: str  # admin user_id
     transaction_date: datetime = Field(default_factory=datetime.utcnow)
+    lot_number: Optional[str] = None  # supplier batch number for received stock
+    expiry_date: Optional[str] = None  # "2026-03-31"; expiry of the lot received by this transaction
+    lot_id: Optional[str] = None  # write off a specific lot instead of first-expired-first-out
+    lot_allocations: List[Dict[str, Any]] = []  # [{"lot_id": "...", "quantity": 5}] filled on depletion
+
+class InventoryLot(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    inventory_item_id: str
+    transaction_id: str  # receiving stock transaction
+    lot_number: Optional[str] = None
+    quantity_received: int
+    quantity_remaining: int
+    expiry_date: Optional[datetime] = None
+    cost_per_unit: Optional[float] = None
+    expiry_alerted: bool = False
+    received_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Campaign(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -191,6 +285,7 @@ class Campaign(BaseModel):
     is_active: bool = True
     usage_limit: Optional[int] = None  # max uses per campaign
     usage_count: int = 0
+    counter_shards: int = 0  # >1 spreads usage counting of a hot campaign over that many counters
     created_by: str  # admin user_id
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -222,8 +317,11 @@ class PatientDocument(BaseModel):
     patient_id: str
     document_type: str  # "opcard", "lab_result", "ecg_result", "prescription", "medical_report"
     document_name: str
-    file_path: str
+    file_path: str  # download endpoint URL; legacy flat files keep their /uploads/... path
     file_size: Optional[int] = None
+    sha256: Optional[str] = None  # hex digest of the file content, computed while uploading
+    blob_key: Optional[str] = None  # content-addressed blob holding the file (None for legacy flat files)
+    preview_status: Optional[str] = None  # pending, ready, failed, unsupported
     mime_type: Optional[str] = None
     uploaded_by: str  # admin user_id who uploaded
     description: Optional[str] = None
@@ -261,9 +359,11 @@ class LabPackage(BaseModel):
     name: str
     description: str
     test_ids: List[str]
-    original_price: float
+    original_price: float = 0.0  # sum of the current test prices, maintained by the server
     package_price: float
-    discount_percentage: float
+    discount_percentage: float = 0.0  # derived from original_price and package_price
+    price_above_tests: bool = False  # set when test price cuts leave the package dearer than its tests
+    pricing_updated_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Appointment(BaseModel):
@@ -281,20 +381,33 @@ class MedicineOrder(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     patient_id: str
     items: List[Dict[str, Any]]  # [{"medicine_id": "...", "quantity": 2, "price": 100}]
+    subtotal: float = 0.0
+    discount_amount: float = 0.0
     total_amount: float
-    status: str = "pending"  # pending, ready_for_pickup, completed, cancelled
+    applied_campaigns: List[Dict[str, Any]] = []
+    campaign_redemptions: List[Dict[str, Any]] = []  # counter tokens, released if the order is cancelled
+    status: str = "pending"  # pending, ready_for_pickup, completed, cancelled, expired
     order_date: datetime = Field(default_factory=datetime.utcnow)
     pickup_date: Optional[datetime] = None
+    reserved_until: Optional[datetime] = None  # stock is released if not picked up by then
+    stock_reserved: bool = False  # False for orders placed before stock was reserved at checkout
+    stock_released: bool = False
 
 class LabOrder(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     patient_id: str
     test_ids: List[str] = []
     package_ids: List[str] = []
+    items: List[Dict[str, Any]] = []  # priced tests and packages
+    subtotal: float = 0.0
+    discount_amount: float = 0.0
     total_amount: float
-    status: str = "scheduled"  # scheduled, sample_collected, in_progress, completed
+    applied_campaigns: List[Dict[str, Any]] = []
+    campaign_redemptions: List[Dict[str, Any]] = []  # counter tokens, released if the order is cancelled
+    status: str = "scheduled"  # scheduled, sample_collected, in_progress, completed, cancelled
     order_date: datetime = Field(default_factory=datetime.utcnow)
     sample_collection_date: Optional[datetime] = None
+    status_timestamps: Dict[str, datetime] = Field(default_factory=dict)  # time each status was entered
 
 class MedicalRecord(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -308,6 +421,50 @@ class MedicalRecord(BaseModel):
     is_confidential: bool = True
 
 # Utility Functions
+# Sign applied to a transaction's quantity when posting it to current_stock
+STOCK_CHANGE_SIGN = {"purchase": 1, "adjustment": 1, "usage": -1, "expired": -1}
+STOCK_BULK_CHUNK_SIZE = 500
+
+# Order prices come from an in-memory catalog snapshot, reloaded after catalog or
+# campaign writes on this worker and at least every PRICING_SNAPSHOT_TTL_SECONDS
+PRICING_SNAPSHOT_TTL_SECONDS = int(os.environ.get('PRICING_SNAPSHOT_TTL_SECONDS', '60'))
+pricing_engine = PricingEngine()
+pricing_reload_lock = asyncio.Lock()
+ACTIVE_CAMPAIGN_CACHE_TTL_SECONDS = int(os.environ.get('ACTIVE_CAMPAIGN_CACHE_TTL_SECONDS', '300'))
+active_campaign_cache = ActiveCampaignCache(ACTIVE_CAMPAIGN_CACHE_TTL_SECONDS)
+campaign_counters = CampaignCounters(db)
+
+# Medicine search index; rebuilt from the database periodically to pick up other workers' writes
+MEDICINE_SEARCH_MAX_LIMIT = 100
+medicine_search_index = MedicineSearchIndex()
+
+# Feedback trend results are cached until new feedback arrives (TTL bounds other workers)
+FEEDBACK_TRENDS_CACHE_TTL_SECONDS = int(os.environ.get('FEEDBACK_TRENDS_CACHE_TTL_SECONDS', '300'))
+feedback_analytics = FeedbackAnalytics(db, FEEDBACK_TRENDS_CACHE_TTL_SECONDS)
+
+# Medicine orders hold (decrement) stock when placed; unclaimed reservations expire after this
+MEDICINE_RESERVATION_HOURS = int(os.environ.get('MEDICINE_RESERVATION_HOURS', '72'))
+# Orders in these states still hold their reserved stock
+MEDICINE_ORDER_OPEN_STATUSES = ["pending", "ready_for_pickup"]
+
+# Inventory report results are cached until the next stock change (TTL bounds other workers)
+REPORT_CACHE_TTL_SECONDS = int(os.environ.get('REPORT_CACHE_TTL_SECONDS', '300'))
+inventory_report_cache = inventory_reports.ReportCache(REPORT_CACHE_TTL_SECONDS)
+
+# Lots expiring within this many days are reported by the daily expiry job
+INVENTORY_EXPIRY_ALERT_DAYS = int(os.environ.get('INVENTORY_EXPIRY_ALERT_DAYS', '30'))
+
+# Update-pipeline stage recomputing the low-stock flag from the document's new values;
+# the alert marker is cleared as soon as the item is restocked above its minimum
+LOW_STOCK_FLAG_STAGE = {"$set": {
+    "is_low_stock": {"$lte": ["$current_stock", "$minimum_stock"]},
+    "low_stock_alerted": {"$cond": [
+        {"$lte": ["$current_stock", "$minimum_stock"]},
+        {"$ifNull": ["$low_stock_alerted", False]},
+        False
+    ]}
+}}
+
 def serialize_doc(doc):
     """Convert MongoDB document to JSON serializable format"""
     if doc is None:
@@ -323,6 +480,16 @@ def serialize_doc(doc):
         return result
     return doc
 
+def parse_datetime_param(value: str, field: str) -> datetime:
+    """Parse an ISO 8601 request value into a naive UTC datetime (HTTP 400 when invalid)"""
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid '{field}' timestamp, expected ISO 8601")
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
 
@@ -393,6 +560,87 @@ async def send_sms_notification(phone: str, message: str) -> bool:
         print(f"SMS sending failed: {e}")
         return False
 
+NOTIFICATION_STATS_ID = "global"
+
+async def adjust_notification_counters(user_unread: Dict[str, int] = None, total: int = 0, unread: int = 0, sent: int = 0):
+    """Apply deltas to the per-user unread counters and the global notification stats"""
+    for user_id, delta in (user_unread or {}).items():
+        if delta:
+            await db.notification_counters.update_one(
+                {"user_id": user_id},
+                {"$inc": {"unread": delta}},
+                upsert=True
+            )
+    if total or unread or sent:
+        await db.notification_stats.update_one(
+            {"id": NOTIFICATION_STATS_ID},
+            {"$inc": {"total": total, "unread": unread, "sent": sent}},
+            upsert=True
+        )
+
+async def push_notification(notification: dict):
+    """Publish a delivered notification to the user's open push connections"""
+    try:
+        # Scheduled reminders are counted as unread when created, so clients take the
+        # badge count from the event instead of incrementing their own
+        counter = await db.notification_counters.find_one({"user_id": notification["user_id"]})
+        await notification_broker.publish(
+            notification["user_id"],
+            {
+                "type": "notification",
+                "notification": jsonable_encoder(serialize_doc(notification)),
+                "unread_count": max(counter.get("unread", 0), 0) if counter else 0
+            }
+        )
+    except Exception as e:
+        print(f"Error pushing notification {notification.get('id')}: {e}")
+
+async def insert_notification(notification: Notification):
+    """Insert a notification and keep the unread counters and stats in step"""
+    await db.notifications.insert_one(notification.dict())
+    is_unread = 0 if notification.is_read else 1
+    await adjust_notification_counters(
+        {notification.user_id: is_unread},
+        total=1,
+        unread=is_unread,
+        sent=1 if notification.sent_at else 0
+    )
+    # Scheduled reminders are pushed by the scheduler once they fall due
+    if notification.scheduled_for is None or notification.scheduled_for <= datetime.utcnow():
+        await push_notification(notification.dict())
+
+async def mark_notifications_read(user_id: str, query: dict) -> int:
+    """Mark a user's matching unread notifications read with one update_many"""
+    result = await db.notifications.update_many(
+        {**query, "user_id": user_id, "is_read": False},
+        {"$set": {"is_read": True}}
+    )
+    if result.modified_count:
+        await adjust_notification_counters({user_id: -result.modified_count}, unread=-result.modified_count)
+    return result.modified_count
+
+async def rebuild_notification_counters():
+    """Recompute the unread counters and stats from the notifications collection"""
+    per_user = await db.notifications.aggregate([
+        {"$match": {"is_read": False}},
+        {"$group": {"_id": "$user_id", "unread": {"$sum": 1}}}
+    ]).to_list(None)
+
+    await db.notification_counters.delete_many({})
+    if per_user:
+        await db.notification_counters.insert_many(
+            [{"user_id": row["_id"], "unread": row["unread"]} for row in per_user]
+        )
+
+    stats = {
+        "total": await db.notifications.count_documents({}),
+        "unread": sum(row["unread"] for row in per_user),
+        "sent": await db.notifications.count_documents({"sent_at": {"$ne": None}}),
+        "rebuilt_at": datetime.utcnow()
+    }
+    await db.notification_stats.update_one({"id": NOTIFICATION_STATS_ID}, {"$set": stats}, upsert=True)
+    return stats
+
 async def schedule_appointment_notifications(appointment_id: str):
     """Schedule notifications for an appointment"""
     try:
@@ -423,7 +671,7 @@ async def schedule_appointment_notifications(appointment_id: str):
                 scheduled_for=sms_time,
                 data={"appointment_id": appointment_id, "type": "sms_reminder"}
             )
-            await db.notifications.insert_one(notification.dict())
+            await insert_notification(notification)
         
         # Create in-app notifications for 2 hours and 10 minutes before
         for hours, minutes in [(2, 0), (0, 10)]:
@@ -437,7 +685,7 @@ async def schedule_appointment_notifications(appointment_id: str):
                     scheduled_for=notification_time,
                     data={"appointment_id": appointment_id, "type": "in_app_reminder"}
                 )
-                await db.notifications.insert_one(notification.dict())
+                await insert_notification(notification)
         
     except Exception as e:
         print(f"Error scheduling notifications: {e}")
@@ -462,10 +710,13 @@ async def process_scheduled_notifications():
                         await send_sms_notification(patient["phone"], notification["message"])
                 
                 # Mark as sent
-                await db.notifications.update_one(
-                    {"id": notification["id"]},
+                result = await db.notifications.update_one(
+                    {"id": notification["id"], "sent_at": None},
                     {"$set": {"sent_at": current_time}}
                 )
+                if result.modified_count:
+                    await adjust_notification_counters(sent=1)
+                    await push_notification({**notification, "sent_at": current_time})
                 
             except Exception as e:
                 print(f"Error processing notification {notification['id']}: {e}")
@@ -474,29 +725,81 @@ async def process_scheduled_notifications():
         print(f"Error in process_scheduled_notifications: {e}")
 
 async def create_admin_daily_reminder():
-    """Create daily booking reminder for admin"""
-    try:
-        today = datetime.utcnow().strftime("%Y-%m-%d")
-        appointments = await db.appointments.find({"appointment_date": today}).to_list(1000)
-        
-        if appointments:
-            admin_users = await db.users.find({"role": "admin"}).to_list(10)
-            for admin in admin_users:
-                notification = Notification(
-                    user_id=admin["id"],
-                    title="Daily Booking Reminder",
-                    message=f"You have {len(appointments)} appointments scheduled for today",
-                    notification_type="system",
-                    data={"appointment_count": len(appointments), "date": today}
-                )
-                await db.notifications.insert_one(notification.dict())
-                
-    except Exception as e:
-        print(f"Error creating admin daily reminder: {e}")
+    """Create daily booking reminder for admin (errors propagate so the job registry records them)"""
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    appointments = await db.appointments.find({"appointment_date": today}).to_list(1000)
+    
+    if appointments:
+        admin_users = await db.users.find({"role": "admin"}).to_list(10)
+        for admin in admin_users:
+            notification = Notification(
+                user_id=admin["id"],
+                title="Daily Booking Reminder",
+                message=f"You have {len(appointments)} appointments scheduled for today",
+                notification_type="system",
+                data={"appointment_count": len(appointments), "date": today}
+            )
+            await insert_notification(notification)
+
+async def apply_notification_retention(max_age_days: int = None, mode: str = None):
+    """Archive or delete sent-and-read notifications older than the retention age, in batches"""
+    max_age_days = NOTIFICATION_RETENTION_DAYS if max_age_days is None else max_age_days
+    mode = mode or NOTIFICATION_RETENTION_MODE
+    if mode not in ("archive", "delete"):
+        raise ValueError(f"Unknown notification retention mode: {mode}")
+
+    started = datetime.utcnow()
+    cutoff = started - timedelta(days=max_age_days)
+    retention_filter = {
+        "is_read": True,
+        "created_at": {"$lt": cutoff},
+        # Scheduled reminders count as delivered once sent; immediate ones on creation
+        "$or": [{"sent_at": {"$ne": None}}, {"scheduled_for": None}]
+    }
+
+    report = {"mode": mode, "cutoff": cutoff, "batches": 0, "removed": 0, "archived": 0, "slowest_batch_ms": 0.0}
+    while True:
+        batch_started = datetime.utcnow()
+        batch = await db.notifications.find(retention_filter).sort("created_at", 1).to_list(NOTIFICATION_RETENTION_BATCH_SIZE)
+        if not batch:
+            break
+
+        if mode == "archive":
+            for notification in batch:
+                notification["archived_at"] = batch_started
+            try:
+                result = await db.notifications_archive.insert_many(batch, ordered=False)
+                report["archived"] += len(result.inserted_ids)
+            except BulkWriteError as e:
+                # Documents copied by an interrupted earlier run keep their _id; skip them
+                if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+                report["archived"] += e.details.get("nInserted", 0)
+
+        result = await db.notifications.delete_many({"_id": {"$in": [n["_id"] for n in batch]}})
+        sent_removed = sum(1 for n in batch if n.get("sent_at"))
+        await adjust_notification_counters(total=-result.deleted_count, sent=-min(sent_removed, result.deleted_count))
+
+        report["batches"] += 1
+        report["removed"] += result.deleted_count
+        batch_ms = (datetime.utcnow() - batch_started).total_seconds() * 1000
+        report["slowest_batch_ms"] = round(max(report["slowest_batch_ms"], batch_ms), 2)
+
+        if len(batch) < NOTIFICATION_RETENTION_BATCH_SIZE:
+            break
+        # Yield between batches so foreground requests are not starved
+        await asyncio.sleep(NOTIFICATION_RETENTION_PAUSE_MS / 1000)
+
+    report["duration_ms"] = round((datetime.utcnow() - started).total_seconds() * 1000, 2)
+    logger.info(f"Notification retention: {report}")
+    return report
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await authenticate_token(credentials.credentials)
+
+async def authenticate_token(token: str):
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         user_id = payload.get("user_id")
         role = payload.get("role")
         if user_id is None:
@@ -509,7 +812,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         return {"id": user_id, "role": role, "user": user}
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 async def require_admin(current_user: dict = Depends(get_current_user)):
@@ -666,21 +969,289 @@ async def update_doctor_status(doctor_id: str, status_data: dict, admin_user: di
     )
     return {"message": "Doctor status updated"}
 
+# Pricing
+async def get_pricing_engine() -> PricingEngine:
+    """Pricing engine with a fresh catalog snapshot (one reload at a time)"""
+    if pricing_engine.is_stale(PRICING_SNAPSHOT_TTL_SECONDS):
+        async with pricing_reload_lock:
+            if pricing_engine.is_stale(PRICING_SNAPSHOT_TTL_SECONDS):
+                pricing_engine.load(
+                    await db.medicines.find({}, {"_id": 0, "id": 1, "name": 1, "price": 1}).to_list(None),
+                    await db.lab_tests.find({}, {"_id": 0, "id": 1, "name": 1, "price": 1}).to_list(None),
+                    await db.lab_packages.find({}, {"_id": 0, "id": 1, "name": 1, "package_price": 1}).to_list(None),
+                    await db.campaigns.find({"is_active": True}, {"_id": 0}).to_list(None)
+                )
+    return pricing_engine
+
+def cart_lines(order_data: dict) -> List[tuple]:
+    """(catalog, item_id, quantity) lines from a medicine or lab order payload"""
+    lines = []
+    try:
+        for item in order_data.get("items", []):
+            lines.append((MEDICINES, item["medicine_id"], int(item.get("quantity", 1))))
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Each item needs a medicine_id and an integer quantity")
+    lines.extend((LAB_TESTS, test_id, 1) for test_id in order_data.get("test_ids", []))
+    lines.extend((LAB_PACKAGES, package_id, 1) for package_id in order_data.get("package_ids", []))
+    return lines
+
+async def price_order(order_data: dict, exclude_campaigns=()) -> Dict[str, Any]:
+    """Server-side quote for an order payload; client prices and totals are ignored"""
+    lines = cart_lines(order_data)
+    if not lines:
+        raise HTTPException(status_code=400, detail="Order has no items")
+    engine = await get_pricing_engine()
+    try:
+        return engine.price_cart(lines, exclude=exclude_campaigns)
+    except PricingError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def release_campaign_redemptions(redemptions: List[Dict[str, Any]]):
+    reopened = False
+    for redemption in redemptions:
+        reopened = await campaign_counters.release(redemption) or reopened
+    if reopened:
+        pricing_engine.invalidate()
+        active_campaign_cache.invalidate()
+
+async def price_and_redeem_order(order_data: dict):
+    """Quote an order and count one use of every applied campaign
+
+    A campaign whose usage limit runs out between pricing and redemption is dropped
+    and the order re-priced without it, so the limit is never exceeded.
+    """
+    exhausted = set()
+    while True:
+        quote = await price_order(order_data, exhausted)
+        redemptions = []
+        for campaign in quote["applied_campaigns"]:
+            redemption = await campaign_counters.redeem(campaign["id"])
+            if redemption is None:
+                exhausted.add(campaign["id"])
+                break
+            redemptions.append(redemption)
+        else:
+            return quote, redemptions
+        await release_campaign_redemptions(redemptions)
+        # redeem() has flagged a sharded campaign exhausted, so the reloaded snapshot leaves it out
+        pricing_engine.invalidate()
+        active_campaign_cache.invalidate()
+
+@api_router.post("/pricing/quote")
+async def get_price_quote(order_data: dict, current_user: dict = Depends(get_current_user)):
+    """Price a medicine or lab cart with active campaigns applied"""
+    return await price_order(order_data)
+
+# Medicine Stock Reservation
+async def restore_medicine_stock(quantities: Dict[str, int]):
+    for medicine_id, quantity in quantities.items():
+        await db.medicines.update_one({"id": medicine_id}, {"$inc": {"stock_quantity": quantity}})
+
+async def reserve_medicine_stock(lines: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Decrement stock for every order line, all or nothing
+
+    Each decrement only applies while enough stock is left, so concurrent orders
+    can never drive stock_quantity below zero; on the first shortfall the lines
+    already reserved are put back.
+    """
+    quantities = defaultdict(int)
+    names = {}
+    for line in lines:
+        quantities[line["medicine_id"]] += line["quantity"]
+        names[line["medicine_id"]] = line.get("name")
+    
+    reserved = {}
+    for medicine_id, quantity in quantities.items():
+        result = await db.medicines.update_one(
+            {"id": medicine_id, "stock_quantity": {"$gte": quantity}},
+            {"$inc": {"stock_quantity": -quantity}}
+        )
+        if result.modified_count != 1:
+            await restore_medicine_stock(reserved)
+            raise HTTPException(status_code=409, detail=f"Insufficient stock for {names[medicine_id] or medicine_id}")
+        reserved[medicine_id] = quantity
+    return reserved
+
+async def release_medicine_order(order_id: str, status: str, query: dict = None) -> Optional[dict]:
+    """Close an open order and give back its stock and campaign uses (exactly once)"""
+    order = await db.medicine_orders.find_one_and_update(
+        {"id": order_id, "status": {"$in": MEDICINE_ORDER_OPEN_STATUSES}, "stock_released": {"$ne": True}, **(query or {})},
+        {"$set": {"status": status, "stock_released": True, "closed_at": datetime.utcnow()}},
+        return_document=True
+    )
+    if order is None:
+        return None
+    
+    # Older orders never took stock, so closing them must not put any back
+    if order.get("stock_reserved"):
+        quantities = defaultdict(int)
+        for item in order["items"]:
+            quantities[item["medicine_id"]] += item["quantity"]
+        await restore_medicine_stock(quantities)
+    await release_campaign_redemptions(order.get("campaign_redemptions", []))
+    return order
+
+async def expire_medicine_reservations():
+    """Release the stock of orders not picked up before their reservation ran out"""
+    expired = 0
+    async for order in db.medicine_orders.find(
+        {"status": {"$in": MEDICINE_ORDER_OPEN_STATUSES}, "reserved_until": {"$lte": datetime.utcnow()}},
+        {"id": 1}
+    ):
+        if await release_medicine_order(order["id"], "expired"):
+            expired += 1
+    return {"expired": expired}
+
 # Medicine Routes
 @api_router.get("/medicines")
 async def get_medicines():
     medicines = await db.medicines.find().to_list(1000)
     return [serialize_doc(doc) for doc in medicines]
 
+async def rebuild_medicine_search_index():
+    medicines = await db.medicines.find(
+        {}, {"_id": 0, "id": 1, "name": 1, "generic_name": 1, "manufacturer": 1, "category": 1, "dosage_form": 1}
+    ).to_list(None)
+    medicine_search_index.load(medicines)
+    return {"medicines": len(medicines)}
+
+@api_router.get("/medicines/search")
+async def search_medicines(
+    q: str = "",
+    category: str = None,
+    dosage_form: str = None,
+    limit: int = 20,
+    offset: int = 0
+):
+    """Ranked, typo-tolerant medicine search over name, generic name and manufacturer"""
+    if limit < 1 or limit > MEDICINE_SEARCH_MAX_LIMIT or offset < 0:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MEDICINE_SEARCH_MAX_LIMIT}")
+    if not medicine_search_index.loaded:
+        await rebuild_medicine_search_index()
+    
+    started = time.perf_counter()
+    matches, total = medicine_search_index.search(q, category=category, dosage_form=dosage_form, limit=limit, offset=offset)
+    search_ms = round((time.perf_counter() - started) * 1000, 2)
+    
+    # Current price and stock come from the database, in ranked order
+    medicines = {
+        doc["id"]: doc
+        for doc in await db.medicines.find({"id": {"$in": [medicine_id for medicine_id, _ in matches]}}).to_list(None)
+    }
+    results = []
+    for medicine_id, score in matches:
+        if medicine_id in medicines:
+            results.append({**serialize_doc(medicines[medicine_id]), "score": round(score, 3)})
+    return {
+        "results": results,
+        "total": total,
+        "search_ms": search_ms,
+        **medicine_search_index.facets()
+    }
+
+@api_router.post("/admin/medicines")
+async def create_medicine(medicine_data: dict, admin_user: dict = Depends(require_admin)):
+    medicine = Medicine(**medicine_data)
+    await db.medicines.insert_one(medicine.dict())
+    medicine_search_index.upsert(medicine.dict())
+    pricing_engine.invalidate()
+    return {"message": "Medicine created", "medicine_id": medicine.id}
+
+@api_router.put("/admin/medicines/{medicine_id}")
+async def update_medicine(medicine_id: str, medicine_data: dict, admin_user: dict = Depends(require_admin)):
+    medicine_data.pop("id", None)
+    medicine = await db.medicines.find_one_and_update(
+        {"id": medicine_id}, {"$set": medicine_data}, return_document=True
+    )
+    if not medicine:
+        raise HTTPException(status_code=404, detail="Medicine not found")
+    medicine_search_index.upsert(medicine)
+    pricing_engine.invalidate()
+    return {"message": "Medicine updated"}
+
+@api_router.delete("/admin/medicines/{medicine_id}")
+async def delete_medicine(medicine_id: str, admin_user: dict = Depends(require_admin)):
+    result = await db.medicines.delete_one({"id": medicine_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Medicine not found")
+    medicine_search_index.remove(medicine_id)
+    pricing_engine.invalidate()
+    return {"message": "Medicine deleted"}
+
 @api_router.post("/medicines/order")
 async def create_medicine_order(order_data: dict, current_user: dict = Depends(get_current_user)):
+    quote, redemptions = await price_and_redeem_order({"items": order_data.get("items", [])})
     order = MedicineOrder(
         patient_id=current_user["id"],
-        items=order_data["items"],
-        total_amount=order_data["total_amount"]
+        items=[
+            {
+                "medicine_id": line["item_id"],
+                "name": line["name"],
+                "quantity": line["quantity"],
+                "price": line["unit_price"],
+                "discount": line["discount"],
+                "line_total": line["line_total"],
+                "campaign_id": line["campaign_id"]
+            }
+            for line in quote["lines"]
+        ],
+        subtotal=quote["subtotal"],
+        discount_amount=quote["discount_amount"],
+        total_amount=quote["total_amount"],
+        applied_campaigns=quote["applied_campaigns"],
+        campaign_redemptions=redemptions,
+        reserved_until=datetime.utcnow() + timedelta(hours=MEDICINE_RESERVATION_HOURS)
+    )
+    try:
+        reserved = await reserve_medicine_stock(order.items)
+    except Exception:
+        await release_campaign_redemptions(redemptions)
+        raise
+    order.stock_reserved = True
+    try:
+        await db.medicine_orders.insert_one(order.dict())
+    except Exception:
+        await restore_medicine_stock(reserved)
+        await release_campaign_redemptions(redemptions)
+        raise
+    return {
+        "message": "Medicine order created",
+        "order_id": order.id,
+        "total_amount": order.total_amount,
+        "reserved_until": order.reserved_until
+    }
+
+@api_router.put("/medicines/orders/{order_id}/cancel")
+async def cancel_medicine_order(order_id: str, current_user: dict = Depends(get_current_user)):
+    """Cancel an open order and release its reserved stock"""
+    query = {} if current_user["role"] == "admin" else {"patient_id": current_user["id"]}
+    order = await release_medicine_order(order_id, "cancelled", query)
+    if order is None:
+        existing = await db.medicine_orders.find_one({"id": order_id, **query}, {"status": 1})
+        if not existing:
+            raise HTTPException(status_code=404, detail="Order not found")
+        raise HTTPException(status_code=409, detail=f"Order is already {existing['status']}")
+    return {"message": "Medicine order cancelled", "order_id": order_id}
+
+@api_router.put("/admin/medicine-orders/{order_id}/status")
+async def update_medicine_order_status(order_id: str, status_data: dict, admin_user: dict = Depends(require_admin)):
+    """Mark an order ready for pickup or picked up; cancelling releases its stock"""
+    new_status = status_data.get("status")
+    if new_status == "cancelled":
+        return await cancel_medicine_order(order_id, admin_user)
+    if new_status not in ("ready_for_pickup", "completed"):
+        raise HTTPException(status_code=400, detail="status must be ready_for_pickup, completed or cancelled")
+    
+    update = {"status": new_status}
+    if new_status == "completed":
+        update["pickup_date"] = datetime.utcnow()
+    result = await db.medicine_orders.update_one(
+        {"id": order_id, "status": {"$in": MEDICINE_ORDER_OPEN_STATUSES}},
+        {"$set": update}
     )
-    await db.medicine_orders.insert_one(order.dict())
-    return {"message": "Medicine order created", "order_id": order.id}
+    if result.matched_count == 0:
+        raise HTTPException(status_code=409, detail="Order not found or no longer open")
+    return {"message": "Medicine order updated", "order_id": order_id, "status": new_status}
 
 # Lab Test Routes
 @api_router.get("/lab-tests")
@@ -693,16 +1264,262 @@ async def get_lab_packages():
     packages = await db.lab_packages.find().to_list(1000)
     return [serialize_doc(doc) for doc in packages]
 
+@api_router.get("/lab-packages/expanded")
+async def get_lab_packages_expanded():
+    """Packages with their tests resolved in a single aggregation"""
+    packages = await db.lab_packages.aggregate([
+        {"$lookup": {"from": "lab_tests", "localField": "test_ids", "foreignField": "id", "as": "tests"}},
+        {"$project": {
+            "_id": 0,
+            "tests._id": 0,
+            "tests.description": 0,
+            "tests.preparation_required": 0,
+            "tests.created_at": 0
+        }},
+        {"$limit": 1000}
+    ]).to_list(None)
+    return [serialize_doc(package) for package in packages]
+
+def lab_package_pricing(test_ids: List[str], package_price: float, test_prices: Dict[str, float]) -> Dict[str, Any]:
+    """Original price and discount of a package from its tests' current prices"""
+    original_price = round(sum(test_prices.get(test_id, 0.0) for test_id in test_ids), 2)
+    discount = round((original_price - package_price) / original_price * 100, 2) if original_price > 0 else 0.0
+    # A package left dearer than its tests is flagged for the admin rather than shown a negative discount
+    return {
+        "original_price": original_price,
+        "discount_percentage": max(discount, 0.0),
+        "price_above_tests": package_price > original_price,
+        "pricing_updated_at": datetime.utcnow()
+    }
+
+async def recompute_lab_package_pricing(test_id: str) -> int:
+    """Refresh stored pricing of every package containing a test whose price changed"""
+    return await reprice_lab_packages({"test_ids": test_id})
+
+async def reprice_lab_packages(query: dict) -> int:
+    """Recompute stored pricing of the packages matching `query` from current test prices"""
+    packages = await db.lab_packages.find(query, {"id": 1, "test_ids": 1, "package_price": 1}).to_list(None)
+    if not packages:
+        return 0
+    test_ids = {tid for package in packages for tid in package["test_ids"]}
+    test_prices = {
+        test["id"]: test["price"]
+        for test in await db.lab_tests.find({"id": {"$in": list(test_ids)}}, {"id": 1, "price": 1}).to_list(None)
+    }
+    await db.lab_packages.bulk_write([
+        UpdateOne(
+            {"id": package["id"]},
+            {"$set": lab_package_pricing(package["test_ids"], package["package_price"], test_prices)}
+        )
+        for package in packages
+    ], ordered=False)
+    return len(packages)
+
+async def validated_lab_package_fields(package_data: dict) -> Dict[str, Any]:
+    """Check test ids and package price; client-sent original price and discount are replaced"""
+    test_ids = package_data.get("test_ids")
+    if not isinstance(test_ids, list) or not all(isinstance(test_id, str) for test_id in test_ids):
+        raise HTTPException(status_code=400, detail="test_ids must be a list of lab test ids")
+    if not test_ids:
+        raise HTTPException(status_code=400, detail="A package needs at least one test")
+    test_ids = list(dict.fromkeys(test_ids))
+    tests = await db.lab_tests.find({"id": {"$in": test_ids}}, {"id": 1, "price": 1}).to_list(None)
+    test_prices = {test["id"]: test["price"] for test in tests}
+    unknown = [test_id for test_id in test_ids if test_id not in test_prices]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown lab tests: {', '.join(unknown)}")
+    
+    try:
+        package_price = float(package_data.get("package_price"))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="package_price must be a number")
+    pricing = lab_package_pricing(test_ids, package_price, test_prices)
+    if package_price <= 0 or package_price > pricing["original_price"]:
+        raise HTTPException(status_code=400, detail=f"package_price must be above 0 and at most the tests' total of {pricing['original_price']}")
+    return {"test_ids": test_ids, "package_price": package_price, **pricing}
+
 @api_router.post("/lab-tests/order")
 async def create_lab_order(order_data: dict, current_user: dict = Depends(get_current_user)):
+    quote, redemptions = await price_and_redeem_order({"test_ids": order_data.get("test_ids", []), "package_ids": order_data.get("package_ids", [])})
     order = LabOrder(
         patient_id=current_user["id"],
         test_ids=order_data.get("test_ids", []),
         package_ids=order_data.get("package_ids", []),
-        total_amount=order_data["total_amount"]
+        items=quote["lines"],
+        subtotal=quote["subtotal"],
+        discount_amount=quote["discount_amount"],
+        total_amount=quote["total_amount"],
+        applied_campaigns=quote["applied_campaigns"],
+        campaign_redemptions=redemptions
+    )
+    order.status_timestamps[order.status] = order.order_date
+    try:
+        await db.lab_orders.insert_one(order.dict())
+    except Exception:
+        await release_campaign_redemptions(redemptions)
+        raise
+    return {"message": "Lab order created", "order_id": order.id, "total_amount": order.total_amount}
+
+# Lab Order Workflow Routes
+# Allowed status transitions: target status -> statuses it may be entered from
+LAB_ORDER_TRANSITIONS = {
+    "sample_collected": ["scheduled"],
+    "in_progress": ["sample_collected"],
+    "completed": ["in_progress"],
+    "cancelled": ["scheduled", "sample_collected"],
+}
+LAB_ORDER_STATUSES = ["scheduled", "sample_collected", "in_progress", "completed", "cancelled"]
+LAB_ORDER_BULK_LIMIT = 1000
+LAB_ORDER_FILTER_KEYS = {"from_status", "patient_id", "test_id", "ordered_before", "ordered_after"}
+
+def lab_order_transition_update(to_status: str, now: datetime) -> Dict[str, Any]:
+    update = {"status": to_status, f"status_timestamps.{to_status}": now}
+    if to_status == "sample_collected":
+        update["sample_collection_date"] = now
+    return {"$set": update}
+
+def validate_lab_order_transition(to_status: str) -> List[str]:
+    if to_status not in LAB_ORDER_TRANSITIONS:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(LAB_ORDER_TRANSITIONS)}")
+    return LAB_ORDER_TRANSITIONS[to_status]
+
+async def release_cancelled_lab_order_campaigns(query: dict):
+    """Give back campaign uses of cancelled orders (once per order)"""
+    async for order in db.lab_orders.find(
+        {**query, "status": "cancelled", "campaigns_released": {"$ne": True}, "campaign_redemptions.0": {"$exists": True}},
+        {"id": 1}
+    ):
+        released = await db.lab_orders.find_one_and_update(
+            {"id": order["id"], "campaigns_released": {"$ne": True}},
+            {"$set": {"campaigns_released": True}}
+        )
+        if released:
+            await release_campaign_redemptions(released.get("campaign_redemptions", []))
+
+@api_router.put("/admin/lab-orders/{order_id}/status")
+async def update_lab_order_status(order_id: str, status_data: dict, admin_user: dict = Depends(require_admin)):
+    to_status = status_data.get("status")
+    from_statuses = validate_lab_order_transition(to_status)
+    result = await db.lab_orders.update_one(
+        {"id": order_id, "status": {"$in": from_statuses}},
+        lab_order_transition_update(to_status, datetime.utcnow())
     )
-    await db.lab_orders.insert_one(order.dict())
-    return {"message": "Lab order created", "order_id": order.id}
+    if result.matched_count == 0:
+        order = await db.lab_orders.find_one({"id": order_id}, {"status": 1})
+        if not order:
+            raise HTTPException(status_code=404, detail="Lab order not found")
+        raise HTTPException(status_code=409, detail=f"Cannot move a {order['status']} order to {to_status}")
+    if to_status == "cancelled":
+        await release_cancelled_lab_order_campaigns({"id": order_id})
+    return {"message": "Lab order updated", "order_id": order_id, "status": to_status}
+
+@api_router.post("/admin/lab-orders/transition")
+async def bulk_transition_lab_orders(transition_data: dict, admin_user: dict = Depends(require_admin)):
+    """Move many orders to a status in one bulk_write, by order_ids or by filter
+
+    Filter keys: from_status, patient_id, test_id, ordered_before, ordered_after.
+    Orders not in a status the target may be entered from are skipped.
+    """
+    to_status = transition_data.get("status")
+    from_statuses = validate_lab_order_transition(to_status)
+    now = datetime.utcnow()
+    update = lab_order_transition_update(to_status, now)
+    
+    order_ids = transition_data.get("order_ids")
+    if order_ids:
+        order_ids = list(dict.fromkeys(order_ids))
+        if len(order_ids) > LAB_ORDER_BULK_LIMIT:
+            raise HTTPException(status_code=400, detail=f"At most {LAB_ORDER_BULK_LIMIT} orders per request")
+        scope = {"id": {"$in": order_ids}}
+        # Decided before the write, so orders that were already in the target status are reported too
+        current = await db.lab_orders.find({"id": {"$in": order_ids}}, {"id": 1, "status": 1}).to_list(None)
+        statuses = {order["id"]: order["status"] for order in current}
+        skipped = [
+            {"order_id": order_id, "status": statuses.get(order_id)}
+            for order_id in order_ids
+            if statuses.get(order_id) not in from_statuses
+        ]
+        operations = [UpdateOne({"id": order_id, "status": {"$in": from_statuses}}, update) for order_id in order_ids]
+    else:
+        filters = transition_data.get("filter") or {}
+        if not isinstance(filters, dict):
+            raise HTTPException(status_code=400, detail="filter must be an object")
+        unknown = sorted(set(filters) - LAB_ORDER_FILTER_KEYS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown filter keys: {', '.join(unknown)}; allowed: {', '.join(sorted(LAB_ORDER_FILTER_KEYS))}")
+        if not any(filters.values()):
+            raise HTTPException(status_code=400, detail="Provide order_ids or a filter with at least one condition")
+        scope = {}
+        if filters.get("from_status"):
+            if filters["from_status"] not in from_statuses:
+                raise HTTPException(status_code=400, detail=f"Cannot move {filters['from_status']} orders to {to_status}")
+            from_statuses = [filters["from_status"]]
+        if filters.get("patient_id"):
+            scope["patient_id"] = filters["patient_id"]
+        if filters.get("test_id"):
+            scope["test_ids"] = filters["test_id"]
+        date_range = {}
+        if filters.get("ordered_after"):
+            date_range["$gte"] = parse_datetime_param(filters["ordered_after"], "ordered_after")
+        if filters.get("ordered_before"):
+            date_range["$lt"] = parse_datetime_param(filters["ordered_before"], "ordered_before")
+        if date_range:
+            scope["order_date"] = date_range
+        # Stamp the batch so exactly the orders moved by this request can be reported back
+        scope["status"] = {"$in": from_statuses}
+        batch_id = str(uuid.uuid4())
+        update["$set"]["last_transition_batch"] = batch_id
+        operations = [UpdateMany(scope, update)]
+        scope = {"last_transition_batch": batch_id}
+    
+    result = await db.lab_orders.bulk_write(operations, ordered=False)
+    if to_status == "cancelled":
+        await release_cancelled_lab_order_campaigns(scope)
+    
+    response = {"message": "Lab orders updated", "status": to_status, "matched": result.matched_count, "modified": result.modified_count}
+    if order_ids:
+        response["skipped"] = skipped
+    return response
+
+@api_router.get("/admin/lab-orders/queue")
+async def get_lab_order_queue(status: str = "scheduled", limit: int = 200, admin_user: dict = Depends(require_admin)):
+    """Work queue: orders in one status, oldest first"""
+    if status not in LAB_ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(LAB_ORDER_STATUSES)}")
+    limit = min(max(limit, 1), LAB_ORDER_BULK_LIMIT)
+    cursor = db.lab_orders.find({"status": status}).sort("order_date", 1).limit(limit)
+    orders = [serialize_doc(order) async for order in cursor]
+    return {"status": status, "count": await db.lab_orders.count_documents({"status": status}), "orders": orders}
+
+@api_router.get("/admin/lab-orders/turnaround")
+async def get_lab_order_turnaround(days: int = 30, admin_user: dict = Depends(require_admin)):
+    """Hours spent between workflow stages for orders completed in the last `days` days"""
+    if days < 1 or days > 365:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 365")
+    since = datetime.utcnow() - timedelta(days=days)
+    orders = await db.lab_orders.find(
+        {"status": "completed", "status_timestamps.completed": {"$gte": since}},
+        {"_id": 0, "status_timestamps": 1}
+    ).to_list(None)
+    
+    stages = [
+        ("scheduled", "sample_collected"),
+        ("sample_collected", "in_progress"),
+        ("in_progress", "completed"),
+        ("scheduled", "completed"),
+    ]
+    frame = pd.DataFrame([order["status_timestamps"] for order in orders], columns=LAB_ORDER_STATUSES[:4], dtype="datetime64[ns]")
+    metrics = {}
+    for start, end in stages:
+        hours = ((frame[end] - frame[start]).dt.total_seconds() / 3600).dropna()
+        metrics[f"{start}_to_{end}"] = {
+            "orders": int(hours.size),
+            "mean_hours": round(float(hours.mean()), 2) if hours.size else None,
+            "median_hours": round(float(hours.median()), 2) if hours.size else None,
+            "p90_hours": round(float(hours.quantile(0.9)), 2) if hours.size else None,
+            "max_hours": round(float(hours.max()), 2) if hours.size else None,
+        }
+    return {"days": days, "completed_orders": len(orders), "stages": metrics}
 
 # Appointment Routes
 @api_router.post("/appointments")
@@ -749,9 +1566,48 @@ async def approve_patient(patient_id: str, admin_user: dict = Depends(require_ad
 
 @api_router.post("/admin/lab-packages")
 async def create_lab_package(package_data: dict, admin_user: dict = Depends(require_admin)):
-    package = LabPackage(**package_data)
+    package = LabPackage(**{**package_data, **await validated_lab_package_fields(package_data)})
     await db.lab_packages.insert_one(package.dict())
-    return {"message": "Lab package created", "package_id": package.id}
+    pricing_engine.invalidate()
+    return {
+        "message": "Lab package created",
+        "package_id": package.id,
+        "original_price": package.original_price,
+        "discount_percentage": package.discount_percentage
+    }
+
+@api_router.put("/admin/lab-packages/{package_id}")
+async def update_lab_package(package_id: str, package_data: dict, admin_user: dict = Depends(require_admin)):
+    package = await db.lab_packages.find_one({"id": package_id})
+    if not package:
+        raise HTTPException(status_code=404, detail="Lab package not found")
+    
+    update = {key: package_data[key] for key in ("name", "description") if key in package_data}
+    update.update(await validated_lab_package_fields({
+        "test_ids": package_data.get("test_ids", package["test_ids"]),
+        "package_price": package_data.get("package_price", package["package_price"])
+    }))
+    await db.lab_packages.update_one({"id": package_id}, {"$set": update})
+    pricing_engine.invalidate()
+    return {"message": "Lab package updated", "original_price": update["original_price"], "discount_percentage": update["discount_percentage"]}
+
+@api_router.post("/admin/lab-tests")
+async def create_lab_test(test_data: dict, admin_user: dict = Depends(require_admin)):
+    lab_test = LabTest(**test_data)
+    await db.lab_tests.insert_one(lab_test.dict())
+    pricing_engine.invalidate()
+    return {"message": "Lab test created", "test_id": lab_test.id}
+
+@api_router.put("/admin/lab-tests/{test_id}")
+async def update_lab_test(test_id: str, test_data: dict, admin_user: dict = Depends(require_admin)):
+    test_data.pop("id", None)
+    result = await db.lab_tests.update_one({"id": test_id}, {"$set": test_data})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Lab test not found")
+    
+    packages_repriced = await recompute_lab_package_pricing(test_id) if "price" in test_data else 0
+    pricing_engine.invalidate()
+    return {"message": "Lab test updated", "packages_repriced": packages_repriced}
 
 # Advanced Doctor Scheduling Routes
 @api_router.post("/admin/doctor-schedule-template")
@@ -875,11 +1731,470 @@ async def get_holidays(admin_user: dict = Depends(require_admin)):
     holidays = await db.holidays.find().to_list(1000)
     return [serialize_doc(holiday) for holiday in holidays]
 
+_transactions_supported = None
+
+async def mongo_supports_transactions() -> bool:
+    """Multi-document transactions need a replica set or sharded cluster"""
+    global _transactions_supported
+    if _transactions_supported is None:
+        try:
+            hello = await client.admin.command("hello")
+            _transactions_supported = "setName" in hello or hello.get("msg") == "isdbgrid"
+        except Exception as e:
+            print(f"Could not detect MongoDB topology: {e}")
+            _transactions_supported = False
+    return _transactions_supported
+
+async def run_in_transaction(operation):
+    """Run `operation(session)` in a MongoDB transaction; without one only if explicitly allowed"""
+    if not await mongo_supports_transactions():
+        if STOCK_REQUIRE_TRANSACTIONS:
+            raise RuntimeError("MongoDB transactions are required for stock postings (STOCK_REQUIRE_TRANSACTIONS)")
+        return await operation(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(operation)
+
+def parse_expiry_date(value: Optional[str]) -> Optional[datetime]:
+    """Lot expiry from a "YYYY-MM-DD" (or full ISO) string"""
+    if not value:
+        return None
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00")).replace(tzinfo=None)
+
+def start_of_today() -> datetime:
+    return datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+async def load_lot_book(item_id: str, pending_change: int = 0, lot_ids=(), session=None) -> LotBook:
+    """An item's lots with stock left (plus any named lots) and its untracked stock
+
+    `pending_change` is the item's stock change posted earlier in the same batch,
+    which current_stock does not include yet.
+    """
+    lots = await db.inventory_lots.find(
+        {"inventory_item_id": item_id, "$or": [{"quantity_remaining": {"$gt": 0}}, {"id": {"$in": list(lot_ids)}}]},
+        {"_id": 0, "id": 1, "lot_number": 1, "quantity_remaining": 1, "expiry_date": 1, "received_at": 1},
+        session=session
+    ).to_list(None)
+    item = await db.inventory_items.find_one({"id": item_id}, {"current_stock": 1}, session=session) or {}
+    return LotBook.for_item(lots, item.get("current_stock", 0) + pending_change)
+
+async def load_lot_books(item_ids: List[str], lot_ids=()) -> Dict[str, LotBook]:
+    """LotBook per item for validating a batch, in two queries"""
+    lots = await db.inventory_lots.find(
+        {"inventory_item_id": {"$in": item_ids}, "$or": [{"quantity_remaining": {"$gt": 0}}, {"id": {"$in": list(lot_ids)}}]},
+        {"_id": 0, "id": 1, "inventory_item_id": 1, "lot_number": 1, "quantity_remaining": 1, "expiry_date": 1, "received_at": 1}
+    ).to_list(None)
+    items = await db.inventory_items.find({"id": {"$in": item_ids}}, {"id": 1, "current_stock": 1}).to_list(None)
+    lots_by_item = defaultdict(list)
+    for lot in lots:
+        lots_by_item[lot["inventory_item_id"]].append(lot)
+    return {item["id"]: LotBook.for_item(lots_by_item[item["id"]], item.get("current_stock", 0)) for item in items}
+
+async def undo_lot_allocations(allocations: List[Dict[str, Any]], session=None):
+    for allocation in allocations:
+        if allocation["lot_id"] is not None:
+            await db.inventory_lots.update_one(
+                {"id": allocation["lot_id"]}, {"$inc": {"quantity_remaining": allocation["quantity"]}}, session=session
+            )
+
+async def deplete_lots(item_id: str, quantity: int, session=None, lot_id: str = None, include_expired: bool = False, pending_change: int = 0) -> List[Dict[str, Any]]:
+    """Take `quantity` from an item's lots first-expired-first-out; returns the allocations
+
+    Raises LotAllocationError (and leaves the lots untouched) when the issue cannot be covered.
+    """
+    book = await load_lot_book(item_id, pending_change, [lot_id] if lot_id else (), session)
+    allocations = book.plan(quantity, start_of_today(), lot_id=lot_id, include_expired=include_expired)
+    applied = []
+    for allocation in allocations:
+        if allocation["lot_id"] is None:
+            continue
+        result = await db.inventory_lots.update_one(
+            {"id": allocation["lot_id"], "quantity_remaining": {"$gte": allocation["quantity"]}},
+            {"$inc": {"quantity_remaining": -allocation["quantity"]}},
+            session=session
+        )
+        if not result.modified_count:
+            # Lost a race with a concurrent posting
+            await undo_lot_allocations(applied, session)
+            raise LotAllocationError("Stock lots changed while posting, please retry")
+        applied.append(allocation)
+    return allocations
+
+async def apply_stock_transaction_lots(transactions: List[StockTransaction], session=None):
+    """Create a lot for every receipt and deplete lots for every issue, in posting order
+
+    Outside a transaction a failing issue undoes the lot changes of the earlier ones.
+    """
+    new_lots = []
+    inserted_lot_ids = []
+    depleted = []
+    pending_changes = defaultdict(int)
+    try:
+        for transaction in transactions:
+            if transaction.stock_change > 0 and (transaction.transaction_type == "purchase" or transaction.expiry_date):
+                new_lots.append(InventoryLot(
+                    inventory_item_id=transaction.inventory_item_id,
+                    transaction_id=transaction.id,
+                    lot_number=transaction.lot_number,
+                    quantity_received=transaction.stock_change,
+                    quantity_remaining=transaction.stock_change,
+                    expiry_date=parse_expiry_date(transaction.expiry_date),
+                    cost_per_unit=transaction.cost_per_unit,
+                    received_at=transaction.transaction_date
+                ).dict())
+            elif transaction.stock_change < 0:
+                if new_lots:
+                    # Issues later in the batch may draw on lots received earlier in it
+                    await db.inventory_lots.insert_many(new_lots, ordered=True, session=session)
+                    inserted_lot_ids.extend(lot["id"] for lot in new_lots)
+                    new_lots = []
+                transaction.lot_allocations = await deplete_lots(
+                    transaction.inventory_item_id,
+                    -transaction.stock_change,
+                    session=session,
+                    lot_id=transaction.lot_id,
+                    include_expired=transaction.transaction_type == "expired",
+                    pending_change=pending_changes[transaction.inventory_item_id]
+                )
+                depleted.append(transaction)
+            pending_changes[transaction.inventory_item_id] += transaction.stock_change
+        if new_lots:
+            await db.inventory_lots.insert_many(new_lots, ordered=True, session=session)
+    except Exception:
+        if session is None:
+            for transaction in depleted:
+                await undo_lot_allocations(transaction.lot_allocations)
+            if inserted_lot_ids:
+                await db.inventory_lots.delete_many({"id": {"$in": inserted_lot_ids}})
+        raise
+
+async def get_expiring_lots(days: int) -> List[dict]:
+    """Lots with stock left that expire within `days` (already expired included), soonest first"""
+    horizon = datetime.utcnow() + timedelta(days=days)
+    return await db.inventory_lots.find({
+        "quantity_remaining": {"$gt": 0},
+        "expiry_date": {"$lte": horizon}
+    }).sort("expiry_date", 1).to_list(None)
+
+async def notify_expiring_lots():
+    """Scheduled job: tell admins about lots entering the expiry window"""
+    lots = [lot for lot in await get_expiring_lots(INVENTORY_EXPIRY_ALERT_DAYS) if not lot.get("expiry_alerted")]
+    if not lots:
+        return {"lots": 0}
+    
+    await db.inventory_lots.update_many({"id": {"$in": [lot["id"] for lot in lots]}}, {"$set": {"expiry_alerted": True}})
+    items = await db.inventory_items.find({"id": {"$in": list({lot["inventory_item_id"] for lot in lots})}}, {"id": 1, "name": 1}).to_list(None)
+    item_names = {item["id"]: item["name"] for item in items}
+    admin_users = await db.users.find({"role": "admin"}).to_list(10)
+    for admin in admin_users:
+        await insert_notification(Notification(
+            user_id=admin["id"],
+            title="Stock Expiring Soon",
+            message=f"{len(lots)} stock lot(s) expire within {INVENTORY_EXPIRY_ALERT_DAYS} days",
+            notification_type="inventory",
+            data={"lots": [
+                {
+                    "lot_id": lot["id"],
+                    "inventory_item_id": lot["inventory_item_id"],
+                    "item_name": item_names.get(lot["inventory_item_id"]),
+                    "quantity_remaining": lot["quantity_remaining"],
+                    "expiry_date": lot["expiry_date"].strftime("%Y-%m-%d")
+                }
+                for lot in lots[:50]
+            ]}
+        ))
+    return {"lots": len(lots)}
+
+async def post_stock_transactions(transactions: List[StockTransaction], session=None):
+    """Write ledger entries and their stock changes in two ordered bulk round trips"""
+    now = datetime.utcnow()
+    stock_changes = defaultdict(int)
+    for transaction in transactions:
+        transaction.stock_change = STOCK_CHANGE_SIGN.get(transaction.transaction_type, 0) * transaction.quantity
+        stock_changes[transaction.inventory_item_id] += transaction.stock_change
+    
+    await apply_stock_transaction_lots(transactions, session)
+    await stock_ledger.append([t.dict() for t in transactions], session=session)
+    await invalidate_stock_snapshots(transactions, session)
+    await db.inventory_items.bulk_write(
+        [
+            UpdateOne({"id": item_id}, [
+                {"$set": {"current_stock": {"$add": ["$current_stock", change]}, "last_updated": now}},
+                LOW_STOCK_FLAG_STAGE
+            ])
+            for item_id, change in stock_changes.items()
+        ],
+        ordered=True,
+        session=session
+    )
+
+async def sum_stock_changes(item_ids: List[str], after: Optional[datetime] = None, until: Optional[datetime] = None) -> Dict[str, int]:
+    """Net stock change per item for ledger entries dated in (after, until]"""
+    return await stock_ledger.sum_changes(item_ids, after=after, until=until)
+
+async def summarize_stock_movements(item_id: str, after: datetime, until: datetime) -> Dict[str, Dict[str, int]]:
+    """Per transaction type quantity, net change and count for one item in (after, until]"""
+    return await stock_ledger.movements(item_id, after, until)
+
+async def invalidate_stock_snapshots(transactions: List[StockTransaction], session=None):
+    """Drop snapshots that a back-dated ledger entry would make stale"""
+    earliest = {}
+    for transaction in transactions:
+        item_id = transaction.inventory_item_id
+        if item_id not in earliest or transaction.transaction_date < earliest[item_id]:
+            earliest[item_id] = transaction.transaction_date
+    for item_id, transaction_date in earliest.items():
+        await db.stock_snapshots.delete_many(
+            {"inventory_item_id": item_id, "snapshot_at": {"$gte": transaction_date}},
+            session=session
+        )
+
+async def create_stock_snapshots(snapshot_at: Optional[datetime] = None):
+    """Record every item's stock level as of `snapshot_at` (default: now)"""
+    snapshot_at = snapshot_at or datetime.utcnow().replace(second=0, microsecond=0)
+    items = await db.inventory_items.find({}, {"id": 1, "current_stock": 1}).to_list(None)
+    item_ids = [item["id"] for item in items]
+    if not item_ids:
+        return {"snapshot_at": snapshot_at, "items": 0}
+    
+    # Stock at T is the current stock minus everything posted after T; re-read when a
+    # posting lands mid-snapshot so the item read and the ledger tail agree
+    for _ in range(3):
+        tail_before = await sum_stock_changes(item_ids, after=snapshot_at)
+        items = await db.inventory_items.find({"id": {"$in": item_ids}}, {"id": 1, "current_stock": 1}).to_list(None)
+        tail_after = await sum_stock_changes(item_ids, after=snapshot_at)
+        if tail_before == tail_after:
+            break
+    
+    now = datetime.utcnow()
+    await db.stock_snapshots.bulk_write([
+        UpdateOne(
+            {"inventory_item_id": item["id"], "snapshot_at": snapshot_at},
+            {"$set": {"stock": item.get("current_stock", 0) - tail_after.get(item["id"], 0), "created_at": now}},
+            upsert=True
+        )
+        for item in items
+    ], ordered=False)
+    return {"snapshot_at": snapshot_at, "items": len(items)}
+
+async def daily_stock_snapshot():
+    """Scheduled job: snapshot stock levels as of midnight UTC"""
+    return await create_stock_snapshots(datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0))
+
+async def get_stock_levels_at(at: datetime, item_ids: List[str]) -> Dict[str, int]:
+    """Stock per item at a point in time from the nearest snapshot plus a bounded ledger tail"""
+    levels = {}
+    
+    # Nearest snapshot at or before `at`, rolled forward
+    previous = await db.stock_snapshots.aggregate([
+        {"$match": {"inventory_item_id": {"$in": item_ids}, "snapshot_at": {"$lte": at}}},
+        {"$sort": {"inventory_item_id": 1, "snapshot_at": -1}},
+        {"$group": {"_id": "$inventory_item_id", "snapshot_at": {"$first": "$snapshot_at"}, "stock": {"$first": "$stock"}}}
+    ]).to_list(None)
+    by_snapshot_time = defaultdict(list)
+    for row in previous:
+        by_snapshot_time[row["snapshot_at"]].append(row)
+    # Snapshots are written for all items at once, so this is usually a single aggregation
+    for snapshot_at, rows in by_snapshot_time.items():
+        changes = await sum_stock_changes([row["_id"] for row in rows], after=snapshot_at, until=at)
+        for row in rows:
+            levels[row["_id"]] = row["stock"] + changes.get(row["_id"], 0)
+    
+    # Earliest snapshot after `at`, rolled backward
+    remaining = [item_id for item_id in item_ids if item_id not in levels]
+    if remaining:
+        following = await db.stock_snapshots.aggregate([
+            {"$match": {"inventory_item_id": {"$in": remaining}, "snapshot_at": {"$gt": at}}},
+            {"$sort": {"inventory_item_id": 1, "snapshot_at": 1}},
+            {"$group": {"_id": "$inventory_item_id", "snapshot_at": {"$first": "$snapshot_at"}, "stock": {"$first": "$stock"}}}
+        ]).to_list(None)
+        by_snapshot_time = defaultdict(list)
+        for row in following:
+            by_snapshot_time[row["snapshot_at"]].append(row)
+        for snapshot_at, rows in by_snapshot_time.items():
+            changes = await sum_stock_changes([row["_id"] for row in rows], after=at, until=snapshot_at)
+            for row in rows:
+                levels[row["_id"]] = row["stock"] - changes.get(row["_id"], 0)
+    
+    # No snapshots yet: roll back from the live stock level
+    remaining = [item_id for item_id in item_ids if item_id not in levels]
+    if remaining:
+        items = await db.inventory_items.find({"id": {"$in": remaining}}, {"id": 1, "current_stock": 1}).to_list(None)
+        changes = await sum_stock_changes(remaining, after=at)
+        for item in items:
+            levels[item["id"]] = item.get("current_stock", 0) - changes.get(item["id"], 0)
+    
+    return levels
+
+async def emit_low_stock_alerts(item_ids: List[str]):
+    """Notify admins once for each item that has just crossed its minimum stock"""
+    items = await db.inventory_items.find({
+        "id": {"$in": list(item_ids)},
+        "is_low_stock": True,
+        "low_stock_alerted": {"$ne": True}
+    }).to_list(None)
+    if not items:
+        return
+    
+    admin_users = await db.users.find({"role": "admin"}).to_list(10)
+    for item in items:
+        # Claim the alert so concurrent postings for the same item notify only once
+        claimed = await db.inventory_items.update_one(
+            {"id": item["id"], "is_low_stock": True, "low_stock_alerted": {"$ne": True}},
+            {"$set": {"low_stock_alerted": True}}
+        )
+        if not claimed.modified_count:
+            continue
+        for admin in admin_users:
+            await insert_notification(Notification(
+                user_id=admin["id"],
+                title="Low Stock Alert",
+                message=f"{item['name']} is low on stock: {item['current_stock']} {item.get('unit', '')} left (minimum {item['minimum_stock']})",
+                notification_type="inventory",
+                data={
+                    "inventory_item_id": item["id"],
+                    "current_stock": item["current_stock"],
+                    "minimum_stock": item["minimum_stock"]
+                }
+            ))
+
+async def validate_stock_transaction_batch(frame: pd.DataFrame):
+    """Validate a batch of stock transaction rows column-wise; returns (valid rows, per-row errors)"""
+    for column in ["inventory_item_id", "transaction_type", "quantity", "cost_per_unit", "total_cost", "notes", "transaction_date", "lot_number", "expiry_date", "lot_id"]:
+        if column not in frame.columns:
+            frame[column] = None
+    frame = frame.replace({"": None})
+    errors = [[] for _ in range(len(frame))]
+    
+    def flag(mask, message):
+        for position in mask.fillna(False).to_numpy(dtype=bool).nonzero()[0]:
+            errors[position].append(message)
+    
+    item_ids = frame["inventory_item_id"].astype("string").str.strip()
+    known_ids = set()
+    wanted_ids = item_ids.dropna().unique().tolist()
+    if wanted_ids:
+        known_items = await db.inventory_items.find({"id": {"$in": wanted_ids}}, {"id": 1}).to_list(None)
+        known_ids = {item["id"] for item in known_items}
+    flag(item_ids.isna(), "inventory_item_id is required")
+    flag(item_ids.notna() & ~item_ids.isin(known_ids), "inventory item not found")
+    
+    transaction_types = frame["transaction_type"].astype("string").str.strip().str.lower()
+    flag(~transaction_types.isin(list(STOCK_CHANGE_SIGN)), f"transaction_type must be one of {', '.join(STOCK_CHANGE_SIGN)}")
+    
+    quantities = pd.to_numeric(frame["quantity"], errors="coerce")
+    flag(quantities.isna() | (quantities % 1 != 0), "quantity must be a whole number")
+    flag((quantities <= 0) & (transaction_types != "adjustment"), "quantity must be positive")
+    flag((quantities == 0) & (transaction_types == "adjustment"), "adjustment quantity must not be zero")
+    
+    costs = pd.to_numeric(frame["cost_per_unit"], errors="coerce")
+    flag(frame["cost_per_unit"].notna() & (costs.isna() | (costs < 0)), "cost_per_unit must be a non-negative number")
+    total_costs = pd.to_numeric(frame["total_cost"], errors="coerce")
+    flag(frame["total_cost"].notna() & total_costs.isna(), "total_cost must be a number")
+    total_costs = total_costs.fillna(quantities.abs() * costs)
+    
+    dates = pd.to_datetime(frame["transaction_date"], errors="coerce", utc=True).dt.tz_localize(None)
+    flag(frame["transaction_date"].notna() & dates.isna(), "transaction_date must be an ISO date")
+    expiry_dates = pd.to_datetime(frame["expiry_date"], errors="coerce", utc=True).dt.tz_localize(None)
+    flag(frame["expiry_date"].notna() & expiry_dates.isna(), "expiry_date must be an ISO date")
+    
+    valid = pd.DataFrame({
+        "inventory_item_id": item_ids,
+        "transaction_type": transaction_types,
+        "quantity": quantities,
+        "cost_per_unit": costs,
+        "total_cost": total_costs,
+        "notes": frame["notes"],
+        "transaction_date": dates,
+        "lot_number": frame["lot_number"],
+        "expiry_date": expiry_dates.dt.strftime("%Y-%m-%d"),
+        "lot_id": frame["lot_id"],
+    })
+    valid = valid[[not row_errors for row_errors in errors]]
+    
+    # Whether lots can cover an issue depends on the rows before it, so availability is
+    # replayed in posting order and only the rows that cannot be covered are rejected
+    if not valid.empty:
+        books = await load_lot_books(valid["inventory_item_id"].unique().tolist(), valid["lot_id"].dropna().tolist())
+        today = start_of_today()
+        now = datetime.utcnow()
+        for position, row in valid.iterrows():
+            book = books[row["inventory_item_id"]]
+            change = STOCK_CHANGE_SIGN[row["transaction_type"]] * int(row["quantity"])
+            has_expiry = pd.notna(row["expiry_date"])
+            if change > 0 and (row["transaction_type"] == "purchase" or has_expiry):
+                book.receive({
+                    "id": f"row-{position}",
+                    "quantity_remaining": change,
+                    "expiry_date": parse_expiry_date(row["expiry_date"]) if has_expiry else None,
+                    "received_at": row["transaction_date"] if pd.notna(row["transaction_date"]) else now
+                })
+            elif change > 0:
+                book.untracked += change
+            elif change < 0:
+                try:
+                    book.take(book.plan(
+                        -change, today,
+                        lot_id=row["lot_id"] if pd.notna(row["lot_id"]) else None,
+                        include_expired=row["transaction_type"] == "expired"
+                    ))
+                except LotAllocationError as e:
+                    errors[position].append(str(e))
+        valid = valid[[not errors[position] for position in valid.index]]
+    return valid, errors
+
+async def apply_stock_transaction_batch(frame: pd.DataFrame, performed_by: str):
+    """Validate and post a batch of stock transactions in chunks, reporting per-row results"""
+    valid, errors = await validate_stock_transaction_batch(frame)
+    results = [
+        {"row": position + 1, "status": "rejected", "errors": row_errors}
+        for position, row_errors in enumerate(errors)
+    ]
+    
+    now = datetime.utcnow()
+    positions = valid.index.tolist()
+    records = valid.astype(object).where(valid.notna(), None).to_dict("records")
+    for start in range(0, len(records), STOCK_BULK_CHUNK_SIZE):
+        chunk_positions = positions[start:start + STOCK_BULK_CHUNK_SIZE]
+        transactions = [
+            StockTransaction(
+                inventory_item_id=record["inventory_item_id"],
+                transaction_type=record["transaction_type"],
+                quantity=int(record["quantity"]),
+                cost_per_unit=record["cost_per_unit"],
+                total_cost=record["total_cost"],
+                notes=record["notes"],
+                performed_by=performed_by,
+                transaction_date=record["transaction_date"] or now,
+                lot_number=record["lot_number"],
+                expiry_date=record["expiry_date"],
+                lot_id=record["lot_id"]
+            )
+            for record in records[start:start + STOCK_BULK_CHUNK_SIZE]
+        ]
+        try:
+            await run_in_transaction(lambda session: post_stock_transactions(transactions, session))
+        except Exception as e:
+            for position in chunk_positions:
+                results[position] = {"row": position + 1, "status": "failed", "errors": [str(e)]}
+            continue
+        # Only once committed, so a concurrent report cannot cache the pre-posting stock
+        inventory_report_cache.invalidate()
+        await emit_low_stock_alerts({t.inventory_item_id for t in transactions})
+        for position, transaction in zip(chunk_positions, transactions):
+            results[position] = {"row": position + 1, "status": "applied", "transaction_id": transaction.id}
+    
+    summary = {status_name: sum(1 for r in results if r["status"] == status_name) for status_name in ["applied", "rejected", "failed"]}
+    return {"message": "Stock transaction batch processed", "total_rows": len(results), **summary, "results": results}
+
 # Inventory Management Routes
 @api_router.post("/admin/inventory")
 async def create_inventory_item(item_data: dict, admin_user: dict = Depends(require_admin)):
     item = InventoryItem(**item_data)
+    item.is_low_stock = item.current_stock <= item.minimum_stock
+    item.low_stock_alerted = False
     await db.inventory_items.insert_one(item.dict())
+    inventory_report_cache.invalidate()
+    await emit_low_stock_alerts([item.id])
     return {"message": "Inventory item created", "item_id": item.id}
 
 @api_router.get("/admin/inventory")
@@ -890,48 +2205,222 @@ async def get_inventory_items(category: str = None, admin_user: dict = Depends(r
 
 @api_router.put("/admin/inventory/{item_id}")
 async def update_inventory_item(item_id: str, item_data: dict, admin_user: dict = Depends(require_admin)):
+    item_data = {key: value for key, value in item_data.items() if key not in ("is_low_stock", "low_stock_alerted")}
     item_data["last_updated"] = datetime.utcnow()
-    await db.inventory_items.update_one({"id": item_id}, {"$set": item_data})
+    # Pipeline update so the low-stock flag is recomputed atomically with the new values
+    await db.inventory_items.update_one(
+        {"id": item_id},
+        [{"$set": {key: {"$literal": value} for key, value in item_data.items()}}, LOW_STOCK_FLAG_STAGE]
+    )
+    inventory_report_cache.invalidate()
+    await emit_low_stock_alerts([item_id])
     return {"message": "Inventory item updated"}
 
 @api_router.post("/admin/inventory/{item_id}/stock-transaction")
 async def create_stock_transaction(item_id: str, transaction_data: dict, admin_user: dict = Depends(require_admin)):
+    item = await db.inventory_items.find_one({"id": item_id}, {"id": 1})
+    if not item:
+        raise HTTPException(status_code=404, detail="Inventory item not found")
+    
     # Create transaction record
     transaction = StockTransaction(
         inventory_item_id=item_id,
         performed_by=admin_user["id"],
         **transaction_data
     )
-    await db.stock_transactions.insert_one(transaction.dict())
+    try:
+        parse_expiry_date(transaction.expiry_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid expiry_date, expected YYYY-MM-DD")
     
-    # Update inventory stock
-    if transaction.transaction_type in ["purchase", "adjustment"]:
-        stock_change = transaction.quantity
-    elif transaction.transaction_type in ["usage", "expired"]:
-        stock_change = -transaction.quantity
-    else:
-        stock_change = 0
+    # Ledger entry and stock update commit together (or not at all)
+    try:
+        await run_in_transaction(lambda session: post_stock_transactions([transaction], session))
+    except LotAllocationError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    inventory_report_cache.invalidate()
+    await emit_low_stock_alerts([item_id])
     
-    await db.inventory_items.update_one(
-        {"id": item_id},
+    return {"message": "Stock transaction recorded", "transaction_id": transaction.id}
+
+@api_router.get("/admin/inventory/stock-at")
+async def get_inventory_stock_at(at: str, category: str = None, admin_user: dict = Depends(require_admin)):
+    """Stock level of every item (optionally one category) at a point in time"""
+    at_time = parse_datetime_param(at, "at")
+    query = {"category": category} if category else {}
+    items = await db.inventory_items.find(query, {"id": 1, "name": 1, "category": 1, "unit": 1}).to_list(None)
+    levels = await get_stock_levels_at(at_time, [item["id"] for item in items])
+    return [
+        {"inventory_item_id": item["id"], "name": item["name"], "category": item.get("category"), "unit": item.get("unit"), "stock": levels.get(item["id"])}
+        for item in items
+    ]
+
+@api_router.get("/admin/inventory/{item_id}/stock-at")
+async def get_item_stock_at(item_id: str, at: str, admin_user: dict = Depends(require_admin)):
+    """Stock level of one item at a point in time"""
+    at_time = parse_datetime_param(at, "at")
+    if not await db.inventory_items.find_one({"id": item_id}, {"id": 1}):
+        raise HTTPException(status_code=404, detail="Inventory item not found")
+    levels = await get_stock_levels_at(at_time, [item_id])
+    return {"inventory_item_id": item_id, "at": at_time, "stock": levels.get(item_id)}
+
+@api_router.get("/admin/inventory/{item_id}/movement")
+async def get_item_stock_movement(item_id: str, start: str, end: str = None, admin_user: dict = Depends(require_admin)):
+    """Opening stock, closing stock and per-type movements of one item over a period"""
+    start_time = parse_datetime_param(start, "start")
+    end_time = parse_datetime_param(end, "end") if end else datetime.utcnow()
+    if end_time < start_time:
+        raise HTTPException(status_code=400, detail="'end' must not be before 'start'")
+    if not await db.inventory_items.find_one({"id": item_id}, {"id": 1}):
+        raise HTTPException(status_code=404, detail="Inventory item not found")
+    
+    opening = (await get_stock_levels_at(start_time, [item_id])).get(item_id, 0)
+    movements = await summarize_stock_movements(item_id, start_time, end_time)
+    net_change = sum(movement["stock_change"] for movement in movements.values())
+    return {
+        "inventory_item_id": item_id,
+        "start": start_time,
+        "end": end_time,
+        "opening_stock": opening,
+        "closing_stock": opening + net_change,
+        "net_change": net_change,
+        "movements": movements
+    }
+
+@api_router.get("/admin/inventory/{item_id}/stock-transactions")
+async def get_item_stock_transactions(
+    item_id: str,
+    start: str = None,
+    end: str = None,
+    limit: int = 100,
+    admin_user: dict = Depends(require_admin)
+):
+    """Ledger entries of one item, newest first"""
+    start_time = parse_datetime_param(start, "start") if start else None
+    end_time = parse_datetime_param(end, "end") if end else None
+    if limit < 1 or limit > 1000:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 1000")
+    if not await db.inventory_items.find_one({"id": item_id}, {"id": 1}):
+        raise HTTPException(status_code=404, detail="Inventory item not found")
+    
+    cursor = stock_ledger.transactions([item_id], start=start_time, until=end_time, newest_first=True, limit=limit)
+    return [serialize_doc(transaction) async for transaction in cursor]
+
+@api_router.post("/admin/inventory/snapshots")
+async def create_inventory_snapshot(admin_user: dict = Depends(require_admin)):
+    """Take a stock snapshot of every item now (normally done by the nightly job)"""
+    result = await create_stock_snapshots()
+    return {"message": "Stock snapshot created", **result}
+
+@api_router.get("/admin/inventory/expiring")
+async def get_expiring_inventory(days: int = 30, admin_user: dict = Depends(require_admin)):
+    """Lots with remaining stock that expire within the next `days` days"""
+    lots = await get_expiring_lots(days)
+    items = await db.inventory_items.find(
+        {"id": {"$in": list({lot["inventory_item_id"] for lot in lots})}},
+        {"id": 1, "name": 1, "unit": 1, "location": 1}
+    ).to_list(None)
+    items_by_id = {item["id"]: item for item in items}
+    return [
         {
-            "$inc": {"current_stock": stock_change},
-            "$set": {"last_updated": datetime.utcnow()}
+            **serialize_doc(lot),
+            "item_name": items_by_id.get(lot["inventory_item_id"], {}).get("name"),
+            "unit": items_by_id.get(lot["inventory_item_id"], {}).get("unit"),
+            "location": items_by_id.get(lot["inventory_item_id"], {}).get("location")
         }
-    )
-    
-    return {"message": "Stock transaction recorded", "transaction_id": transaction.id}
+        for lot in lots
+    ]
+
+@api_router.get("/admin/inventory/{item_id}/lots")
+async def get_inventory_item_lots(item_id: str, include_depleted: bool = False, admin_user: dict = Depends(require_admin)):
+    """Lots of one item in first-expired-first-out order"""
+    query = {"inventory_item_id": item_id}
+    if not include_depleted:
+        query["quantity_remaining"] = {"$gt": 0}
+    lots = await db.inventory_lots.find(query).to_list(1000)
+    # MongoDB sorts missing expiries first; undated lots are consumed last
+    lots.sort(key=lambda lot: (lot.get("expiry_date") is None, lot.get("expiry_date") or datetime.max, lot["received_at"]))
+    return [serialize_doc(lot) for lot in lots]
 
 @api_router.get("/admin/inventory/low-stock")
 async def get_low_stock_items(admin_user: dict = Depends(require_admin)):
-    # Items where current_stock <= minimum_stock
-    pipeline = [
-        {"$match": {"$expr": {"$lte": ["$current_stock", "$minimum_stock"]}}},
-        {"$sort": {"current_stock": 1}}
-    ]
-    items = await db.inventory_items.aggregate(pipeline).to_list(1000)
+    # Items where current_stock <= minimum_stock, served by the partial is_low_stock index
+    items = await db.inventory_items.find({"is_low_stock": True}).sort("current_stock", 1).to_list(1000)
     return [serialize_doc(item) for item in items]
 
+@api_router.post("/admin/inventory/stock-transactions/bulk")
+async def create_stock_transactions_bulk(batch_data: dict, admin_user: dict = Depends(require_admin)):
+    """Post a JSON batch of stock transactions, e.g. a supplier delivery"""
+    rows = batch_data.get("transactions")
+    if not isinstance(rows, list) or not rows:
+        raise HTTPException(status_code=400, detail="transactions must be a non-empty list")
+    return await apply_stock_transaction_batch(pd.DataFrame(rows), admin_user["id"])
+
+@api_router.post("/admin/inventory/stock-transactions/bulk-csv")
+async def create_stock_transactions_bulk_csv(file: UploadFile = File(...), admin_user: dict = Depends(require_admin)):
+    """Post a CSV batch of stock transactions (header row with the StockTransaction field names)"""
+    try:
+        frame = pd.read_csv(io.BytesIO(await file.read()), dtype=str, keep_default_na=False)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not parse CSV: {str(e)}")
+    if frame.empty:
+        raise HTTPException(status_code=400, detail="CSV contains no transactions")
+    return await apply_stock_transaction_batch(frame, admin_user["id"])
+
+# Inventory Report Routes
+async def load_inventory_frame():
+    items = await db.inventory_items.find(
+        {}, {"id": 1, "name": 1, "category": 1, "unit": 1, "current_stock": 1, "minimum_stock": 1, "cost_per_unit": 1}
+    ).to_list(None)
+    return inventory_reports.items_frame(items)
+
+async def load_ledger_frame(transaction_types: List[str], start: datetime):
+    """Stream matching ledger entries into a columnar frame in cursor-sized batches"""
+    cursor = stock_ledger.transactions(
+        transaction_types=transaction_types, start=start, batch_size=inventory_reports.LEDGER_BATCH_SIZE
+    )
+    return await inventory_reports.ledger_frame(cursor)
+
+@api_router.get("/admin/reports/inventory/valuation")
+async def get_inventory_valuation_report(admin_user: dict = Depends(require_admin)):
+    """Current stock value by category plus the most valuable items"""
+    async def compute():
+        return inventory_reports.stock_valuation(await load_inventory_frame())
+    return await inventory_report_cache.get("valuation", compute)
+
+@api_router.get("/admin/reports/inventory/consumption")
+async def get_inventory_consumption_report(months: int = 12, admin_user: dict = Depends(require_admin)):
+    """Monthly consumed quantity and cost per category over the last `months` months"""
+    if months < 1 or months > 60:
+        raise HTTPException(status_code=400, detail="months must be between 1 and 60")
+    
+    async def compute():
+        first_month = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        for _ in range(months - 1):
+            first_month = (first_month - timedelta(days=1)).replace(day=1)
+        ledger = await load_ledger_frame(inventory_reports.CONSUMPTION_TYPES, first_month)
+        return {"since": first_month.isoformat(), **inventory_reports.monthly_consumption(ledger, await load_inventory_frame())}
+    return await inventory_report_cache.get(("consumption", months), compute)
+
+@api_router.get("/admin/reports/inventory/reorder")
+async def get_inventory_reorder_report(
+    window_days: int = 30,
+    lead_time_days: int = 7,
+    cover_days: int = 30,
+    admin_user: dict = Depends(require_admin)
+):
+    """Items at or below their reorder point, with average daily usage and suggested order quantities"""
+    if window_days < 1 or lead_time_days < 0 or cover_days < 0:
+        raise HTTPException(status_code=400, detail="window_days must be positive and lead/cover days non-negative")
+    
+    async def compute():
+        ledger = await load_ledger_frame(["usage"], datetime.utcnow() - timedelta(days=window_days))
+        suggestions = inventory_reports.reorder_suggestions(
+            ledger, await load_inventory_frame(), window_days, lead_time_days, cover_days
+        )
+        return {"window_days": window_days, "lead_time_days": lead_time_days, "cover_days": cover_days, "items": suggestions}
+    return await inventory_report_cache.get(("reorder", window_days, lead_time_days, cover_days), compute)
+
 # Campaign Management Routes
 @api_router.post("/admin/campaigns")
 async def create_campaign(campaign_data: dict, admin_user: dict = Depends(require_admin)):
@@ -940,37 +2429,44 @@ async def create_campaign(campaign_data: dict, admin_user: dict = Depends(requir
         **campaign_data
     )
     await db.campaigns.insert_one(campaign.dict())
+    if campaign.counter_shards > 1:
+        await campaign_counters.configure(campaign.id)
+    pricing_engine.invalidate()
+    active_campaign_cache.invalidate()
     return {"message": "Campaign created", "campaign_id": campaign.id}
 
 @api_router.get("/admin/campaigns")
 async def get_campaigns(admin_user: dict = Depends(require_admin)):
     campaigns = await db.campaigns.find().to_list(1000)
+    sharded = [campaign["id"] for campaign in campaigns if (campaign.get("counter_shards") or 0) > 1]
+    if sharded:
+        shard_counts = await campaign_counters.usage_counts(sharded)
+        for campaign in campaigns:
+            campaign["usage_count"] = campaign.get("usage_count", 0) + shard_counts.get(campaign["id"], 0)
     return [serialize_doc(campaign) for campaign in campaigns]
 
 @api_router.put("/admin/campaigns/{campaign_id}")
 async def update_campaign(campaign_id: str, campaign_data: dict, admin_user: dict = Depends(require_admin)):
+    campaign_data.pop("usage_count", None)  # only changed by redemptions
+    campaign_data.pop("exhausted", None)
     await db.campaigns.update_one({"id": campaign_id}, {"$set": campaign_data})
+    if "usage_limit" in campaign_data or "counter_shards" in campaign_data:
+        await campaign_counters.configure(campaign_id)
+    pricing_engine.invalidate()
+    active_campaign_cache.invalidate()
     return {"message": "Campaign updated"}
 
 @api_router.get("/campaigns/active")
 async def get_active_campaigns():
     """Get active campaigns for patients to see"""
-    from datetime import datetime
-    today = datetime.utcnow().strftime("%Y-%m-%d")
-    
-    campaigns = await db.campaigns.find({
-        "is_active": True,
-        "start_date": {"$lte": today},
-        "end_date": {"$gte": today}
-    }).to_list(1000)
-    
+    campaigns = await active_campaign_cache.get(db.campaigns)
     return [serialize_doc(campaign) for campaign in campaigns]
 
 # Notification Routes
 @api_router.post("/admin/notifications")
 async def create_notification(notification_data: dict, admin_user: dict = Depends(require_admin)):
     notification = Notification(**notification_data)
-    await db.notifications.insert_one(notification.dict())
+    await insert_notification(notification)
     return {"message": "Notification created", "notification_id": notification.id}
 
 @api_router.get("/notifications/my")
@@ -980,39 +2476,161 @@ async def get_my_notifications(current_user: dict = Depends(get_current_user)):
     }).sort("created_at", -1).to_list(50)
     return [serialize_doc(notification) for notification in notifications]
 
+@api_router.get("/notifications/stream")
+async def stream_notifications(request: Request, token: str):
+    """Server-Sent Events stream of new notifications for the current user"""
+    # EventSource cannot set an Authorization header, so the JWT comes as a query parameter
+    current_user = await authenticate_token(token)
+    user_id = current_user["id"]
+    
+    async def event_stream():
+        queue = notification_broker.subscribe(user_id)
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            notification_broker.unsubscribe(user_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.get("/notifications/unread-count")
+async def get_unread_notification_count(current_user: dict = Depends(get_current_user)):
+    """Cheap unread badge count read from the per-user counter"""
+    counter = await db.notification_counters.find_one({"user_id": current_user["id"]})
+    return {"unread_count": max(counter.get("unread", 0), 0) if counter else 0}
+
 @api_router.put("/notifications/{notification_id}/mark-read")
 async def mark_notification_read(notification_id: str, current_user: dict = Depends(get_current_user)):
-    await db.notifications.update_one(
-        {"id": notification_id, "user_id": current_user["id"]},
-        {"$set": {"is_read": True}}
-    )
+    await mark_notifications_read(current_user["id"], {"id": notification_id})
     return {"message": "Notification marked as read"}
 
+@api_router.put("/notifications/mark-read")
+async def mark_notifications_read_bulk(mark_data: dict, current_user: dict = Depends(get_current_user)):
+    """Mark a list of notifications as read"""
+    notification_ids = mark_data.get("notification_ids") or []
+    if not isinstance(notification_ids, list):
+        raise HTTPException(status_code=400, detail="notification_ids must be a list")
+    
+    updated = await mark_notifications_read(current_user["id"], {"id": {"$in": notification_ids}}) if notification_ids else 0
+    return {"message": "Notifications marked as read", "updated_count": updated}
+
+@api_router.put("/notifications/mark-all-read")
+async def mark_all_notifications_read(mark_data: dict = None, current_user: dict = Depends(get_current_user)):
+    """Mark every notification as read, optionally only those created before a timestamp"""
+    query = {}
+    before = (mark_data or {}).get("before")
+    if before:
+        query["created_at"] = {"$lte": parse_datetime_param(before, "before")}
+    
+    updated = await mark_notifications_read(current_user["id"], query)
+    return {"message": "All notifications marked as read", "updated_count": updated}
+
 @api_router.get("/admin/notifications/stats")
 async def get_notification_stats(admin_user: dict = Depends(require_admin)):
     """Get notification statistics for admin dashboard"""
-    total_notifications = await db.notifications.count_documents({})
-    unread_notifications = await db.notifications.count_documents({"is_read": False})
+    # Totals come from the incrementally maintained stats document; pending SMS is
+    # an index-bounded count over unsent, already-due notifications only.
+    stats = await db.notification_stats.find_one({"id": NOTIFICATION_STATS_ID}) or {}
     pending_sms = await db.notifications.count_documents({
-        "notification_type": "appointment",
         "sent_at": None,
-        "scheduled_for": {"$lte": datetime.utcnow()}
+        "scheduled_for": {"$lte": datetime.utcnow()},
+        "notification_type": "appointment"
     })
     
     return {
-        "total_notifications": total_notifications,
-        "unread_notifications": unread_notifications,
+        "total_notifications": stats.get("total", 0),
+        "unread_notifications": stats.get("unread", 0),
+        "sent_notifications": stats.get("sent", 0),
         "pending_sms": pending_sms
     }
 
+@api_router.post("/admin/notifications/retention/run")
+async def run_notification_retention(retention_data: dict = None, admin_user: dict = Depends(require_admin)):
+    """Run notification retention now, optionally with a custom age or mode"""
+    retention_data = retention_data or {}
+    max_age_days = retention_data.get("max_age_days")
+    try:
+        report = await apply_notification_retention(
+            max_age_days=int(max_age_days) if max_age_days is not None else None,
+            mode=retention_data.get("mode")
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Notification retention completed", **serialize_doc(report)}
+
+@api_router.post("/admin/notifications/stats/rebuild")
+async def rebuild_notification_stats(admin_user: dict = Depends(require_admin)):
+    """Recompute notification counters from scratch (backfill or repair)"""
+    stats = await rebuild_notification_counters()
+    return {"message": "Notification counters rebuilt", **stats}
+
 # Feedback Routes  
+FEEDBACK_CATEGORY_PATTERN = re.compile(r"^[A-Za-z0-9_]{1,50}$")
+
+def validated_feedback_categories(categories: Dict[str, int]) -> Dict[str, int]:
+    """Category names become summary field paths, so they are restricted to word characters"""
+    for name, score in categories.items():
+        if not FEEDBACK_CATEGORY_PATTERN.match(name):
+            raise HTTPException(status_code=400, detail=f"Invalid feedback category '{name}'")
+        if not 1 <= score <= 5:
+            raise HTTPException(status_code=400, detail=f"Feedback category '{name}' must be rated 1-5")
+    return categories
+
+def feedback_summary_increments(feedback: dict) -> Dict[str, int]:
+    return {**rollup_increments(feedback), f"rating_histogram.{feedback['rating']}": 1}
+
+async def rebuild_feedback_summaries() -> Dict[str, Any]:
+    """Recompute the per-doctor feedback summaries from the feedback collection"""
+    summaries: Dict[str, Dict[str, Any]] = {}
+    async for feedback in db.feedback.find({}, {"_id": 0, "doctor_id": 1, "rating": 1, "feedback_categories": 1}):
+        summary = summaries.setdefault(feedback["doctor_id"], {
+            "doctor_id": feedback["doctor_id"], "count": 0, "rating_sum": 0,
+            "rating_histogram": {}, "category_sums": {}, "category_counts": {}
+        })
+        for path, amount in feedback_summary_increments(feedback).items():
+            if "." in path:
+                field, key = path.split(".", 1)
+                summary[field][key] = summary[field].get(key, 0) + amount
+            else:
+                summary[path] += amount
+    
+    now = datetime.utcnow()
+    await db.doctor_feedback_summary.delete_many({})
+    if summaries:
+        await db.doctor_feedback_summary.insert_many([{**summary, "updated_at": now} for summary in summaries.values()])
+    return {
+        "doctors": len(summaries),
+        "feedback": sum(summary["count"] for summary in summaries.values()),
+        "rebuilt_at": now
+    }
+
 @api_router.post("/feedback")
 async def submit_feedback(feedback_data: dict, current_user: dict = Depends(get_current_user)):
     feedback = Feedback(
         patient_id=current_user["id"],
         **feedback_data
     )
+    if not 1 <= feedback.rating <= 5:
+        raise HTTPException(status_code=400, detail="Rating must be between 1 and 5")
+    validated_feedback_categories(feedback.feedback_categories)
     await db.feedback.insert_one(feedback.dict())
+    await db.doctor_feedback_summary.update_one(
+        {"doctor_id": feedback.doctor_id},
+        {"$inc": feedback_summary_increments(feedback.dict()), "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+    await feedback_analytics.record(feedback.dict())
     return {"message": "Feedback submitted successfully", "feedback_id": feedback.id}
 
 @api_router.get("/admin/feedback")
@@ -1022,30 +2640,62 @@ async def get_all_feedback(admin_user: dict = Depends(require_admin)):
 
 @api_router.get("/admin/feedback/stats")
 async def get_feedback_stats(admin_user: dict = Depends(require_admin)):
-    """Get feedback statistics for admin dashboard"""
-    pipeline = [
-        {"$group": {
-            "_id": "$doctor_id",
-            "average_rating": {"$avg": "$rating"},
-            "total_feedback": {"$sum": 1}
-        }},
-        {"$lookup": {
-            "from": "doctors",
-            "localField": "_id", 
-            "foreignField": "id",
-            "as": "doctor"
-        }},
-        {"$unwind": "$doctor"},
-        {"$project": {
-            "doctor_name": "$doctor.name",
-            "average_rating": {"$round": ["$average_rating", 2]},
-            "total_feedback": 1
-        }}
-    ]
+    """Get feedback statistics for admin dashboard (read from the per-doctor summaries)"""
+    summaries = await db.doctor_feedback_summary.find({"count": {"$gt": 0}}, {"_id": 0}).to_list(1000)
+    doctors = await db.doctors.find(
+        {"id": {"$in": [summary["doctor_id"] for summary in summaries]}}, {"_id": 0, "id": 1, "name": 1}
+    ).to_list(None)
+    doctor_names = {doctor["id"]: doctor["name"] for doctor in doctors}
     
-    stats = await db.feedback.aggregate(pipeline).to_list(1000)
+    stats = []
+    for summary in summaries:
+        if summary["doctor_id"] not in doctor_names:
+            continue
+        category_counts = summary.get("category_counts", {})
+        stats.append({
+            "_id": summary["doctor_id"],
+            "doctor_name": doctor_names[summary["doctor_id"]],
+            "average_rating": round(summary["rating_sum"] / summary["count"], 2),
+            "total_feedback": summary["count"],
+            "rating_histogram": {str(stars): summary.get("rating_histogram", {}).get(str(stars), 0) for stars in range(1, 6)},
+            "category_averages": {
+                name: round(total / category_counts[name], 2)
+                for name, total in summary.get("category_sums", {}).items()
+                if category_counts.get(name)
+            }
+        })
     return stats
 
+@api_router.post("/admin/feedback/stats/rebuild")
+async def rebuild_feedback_stats(admin_user: dict = Depends(require_admin)):
+    """Recompute the per-doctor feedback summaries and daily rollups from scratch (backfill or repair)"""
+    stats = await rebuild_feedback_summaries()
+    rollups = await feedback_analytics.rebuild()
+    return {"message": "Feedback summaries rebuilt", **stats, "daily_rollups": rollups["rollups"]}
+
+async def with_doctor_names(trends: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    doctors = await db.doctors.find(
+        {"id": {"$in": [trend["doctor_id"] for trend in trends]}}, {"_id": 0, "id": 1, "name": 1}
+    ).to_list(None)
+    doctor_names = {doctor["id"]: doctor["name"] for doctor in doctors}
+    return [{**trend, "doctor_name": doctor_names.get(trend["doctor_id"])} for trend in trends]
+
+@api_router.get("/admin/feedback/trends")
+async def get_feedback_trends(declining_only: bool = False, admin_user: dict = Depends(require_admin)):
+    """Rolling 7/30/90-day rating averages and deltas vs the previous window, per doctor and category"""
+    trends = await feedback_analytics.trends()
+    if declining_only:
+        trends = [trend for trend in trends if trend["declining"]]
+    return await with_doctor_names(trends)
+
+@api_router.get("/admin/feedback/trends/{doctor_id}")
+async def get_doctor_feedback_trends(doctor_id: str, admin_user: dict = Depends(require_admin)):
+    """One doctor's windowed trends plus the daily 7-day rolling average series"""
+    trends = await feedback_analytics.trends(doctor_id)
+    if not trends:
+        raise HTTPException(status_code=404, detail="No recent feedback for this doctor")
+    return (await with_doctor_names(trends))[0]
+
 # Daily Booking Reminders for Admin
 @api_router.get("/admin/daily-bookings")
 async def get_daily_bookings(date: str = None, admin_user: dict = Depends(require_admin)):
@@ -1070,7 +2720,30 @@ async def get_daily_bookings(date: str = None, admin_user: dict = Depends(requir
     
     return enriched_appointments
 
+# Background Job Routes
+@api_router.get("/admin/jobs")
+async def get_scheduled_jobs(admin_user: dict = Depends(require_admin)):
+    """Get schedule and duration metrics for every registered background job"""
+    return job_registry.metrics()
+
+@api_router.post("/admin/jobs/{job_name}/run")
+async def run_scheduled_job(job_name: str, admin_user: dict = Depends(require_admin)):
+    """Run a background job immediately, outside its schedule"""
+    if job_name not in job_registry.jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    try:
+        return await job_registry.run_now(job_name)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 # Patient Document Upload Routes
+DOCUMENT_TYPES = ["opcard", "lab_result", "ecg_result", "prescription", "medical_report", "xray", "scan"]
+DOCUMENT_EXTENSIONS = ['.pdf', '.jpg', '.jpeg', '.png', '.doc', '.docx']
+
+def document_download_url(document_id: str) -> str:
+    """Blobs are not mounted as static files; documents are only served by the download endpoint"""
+    return f"/api/documents/{document_id}/download"
+
 @api_router.post("/admin/patients/{patient_id}/upload-document")
 async def upload_patient_document(
     patient_id: str,
@@ -1078,7 +2751,8 @@ async def upload_patient_document(
     description: str = None,
     appointment_id: str = None,
     file: UploadFile = File(...),
-    admin_user: dict = Depends(require_admin)
+    admin_user: dict = Depends(require_admin),
+    background_tasks: BackgroundTasks = BackgroundTasks()
 ):
     """Upload a document for a patient (OP card, lab results, ECG, etc.)"""
     
@@ -1088,59 +2762,238 @@ async def upload_patient_document(
         raise HTTPException(status_code=404, detail="Patient not found")
     
     # Validate document type
-    allowed_types = ["opcard", "lab_result", "ecg_result", "prescription", "medical_report", "xray", "scan"]
-    if document_type not in allowed_types:
-        raise HTTPException(status_code=400, detail=f"Invalid document type. Allowed: {', '.join(allowed_types)}")
+    if document_type not in DOCUMENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid document type. Allowed: {', '.join(DOCUMENT_TYPES)}")
     
     # Validate file type
-    allowed_extensions = ['.pdf', '.jpg', '.jpeg', '.png', '.doc', '.docx']
     file_extension = Path(file.filename).suffix.lower()
-    if file_extension not in allowed_extensions:
-        raise HTTPException(status_code=400, detail=f"Invalid file type. Allowed: {', '.join(allowed_extensions)}")
+    if file_extension not in DOCUMENT_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid file type. Allowed: {', '.join(DOCUMENT_EXTENSIONS)}")
+    
+    # Stream to a temp file in chunks, hashing on the way; nothing is visible until the record exists
+    try:
+        staged = await blob_store.stage(file, DOCUMENT_MAX_UPLOAD_BYTES)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except OSError as e:
+        raise HTTPException(status_code=500, detail=f"Error uploading document: {str(e)}")
     
-    # Create unique filename
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    unique_filename = f"{patient_id}_{document_type}_{timestamp}{file_extension}"
-    file_path = UPLOADS_DIR / "patient_documents" / unique_filename
+    # Reference the content's blob first so the collector cannot remove it under the new record
+    try:
+        blob_key, new_blob = await blob_store.claim(staged, file_extension)
+    except RuntimeError as e:
+        await staged.discard()
+        raise HTTPException(status_code=503, detail=str(e))
     
+    document_id = str(uuid.uuid4())
+    document = PatientDocument(
+        id=document_id,
+        patient_id=patient_id,
+        document_type=document_type,
+        document_name=file.filename,
+        file_path=document_download_url(document_id),
+        file_size=staged.size,
+        sha256=staged.sha256,
+        blob_key=blob_key,
+        preview_status=initial_preview_status(blob_key, file_extension),
+        mime_type=file.content_type,
+        uploaded_by=admin_user["id"],
+        description=description,
+        appointment_id=appointment_id
+    )
     try:
-        # Save file
-        async with aiofiles.open(file_path, 'wb') as f:
-            content = await file.read()
-            await f.write(content)
-        
-        # Create database record
+        await db.patient_documents.insert_one(document.dict())
+    except Exception as e:
+        await blob_store.release(blob_key)
+        await staged.discard()
+        raise HTTPException(status_code=500, detail=f"Error uploading document: {str(e)}")
+    
+    try:
+        await blob_store.store(staged, blob_key)
+    except OSError as e:
+        # Without its file the record would point nowhere
+        await db.patient_documents.delete_one({"id": document.id})
+        await blob_store.release(blob_key)
+        await staged.discard()
+        raise HTTPException(status_code=500, detail=f"Error uploading document: {str(e)}")
+    
+    if document.preview_status == "pending":
+        background_tasks.add_task(generate_document_preview, blob_key)
+    return {
+        "message": "Document uploaded successfully",
+        "document_id": document.id,
+        "file_url": document.file_path,
+        "file_size": document.file_size,
+        "sha256": document.sha256,
+        "duplicate": not new_blob
+    }
+
+@api_router.post("/admin/patients/{patient_id}/upload-documents")
+async def bulk_upload_patient_documents(
+    patient_id: str,
+    document_type: str,
+    description: str = None,
+    appointment_id: str = None,
+    files: List[UploadFile] = File(...),
+    admin_user: dict = Depends(require_admin),
+    background_tasks: BackgroundTasks = BackgroundTasks()
+):
+    """Upload many documents at once; ZIP archives are expanded and each file gets its own result"""
+    patient = await db.users.find_one({"id": patient_id}, {"_id": 1})
+    if not patient:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    if document_type not in DOCUMENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Invalid document type. Allowed: {', '.join(DOCUMENT_TYPES)}")
+    
+    # (file name, content type, opener returning an async reader) per file, ZIP members included
+    entries = []
+    results = []
+    archives = []
+    declared_size = 0
+    for upload in files:
+        if Path(upload.filename or "").suffix.lower() != ".zip":
+            entries.append((upload.filename, upload.content_type, lambda upload=upload: upload))
+            declared_size += upload.size or 0
+            continue
+        try:
+            archive = await asyncio.to_thread(zipfile.ZipFile, upload.file)
+        except zipfile.BadZipFile:
+            results.append({"filename": upload.filename, "status": "error", "error": "Invalid ZIP archive"})
+            continue
+        archives.append(archive)
+        for member in archive.infolist():
+            name = Path(member.filename).name
+            if member.is_dir() or member.filename.startswith("__MACOSX/") or name.startswith("."):
+                continue
+            if member.file_size > DOCUMENT_MAX_UPLOAD_BYTES:
+                results.append({"filename": name, "status": "error", "error": str(UploadTooLarge(DOCUMENT_MAX_UPLOAD_BYTES))})
+                continue
+            if member.file_size > DOCUMENT_ZIP_MAX_RATIO * max(member.compress_size, 1):
+                results.append({"filename": name, "status": "error", "error": "Suspicious compression ratio, file skipped"})
+                continue
+            declared_size += member.file_size
+            entries.append((
+                name,
+                mimetypes.guess_type(name)[0],
+                lambda archive=archive, member=member: ThreadedReader(archive.open(member))
+            ))
+    if len(entries) > DOCUMENT_BULK_MAX_FILES:
+        for archive in archives:
+            archive.close()
+        raise HTTPException(status_code=400, detail=f"At most {DOCUMENT_BULK_MAX_FILES} files per upload")
+    if declared_size > DOCUMENT_BULK_MAX_EXTRACTED_BYTES:
+        for archive in archives:
+            archive.close()
+        raise HTTPException(status_code=413, detail=f"Files exceed the {DOCUMENT_BULK_MAX_EXTRACTED_MB} MB total limit once extracted")
+    
+    slots = asyncio.Semaphore(DOCUMENT_BULK_CONCURRENCY)
+    # Declared ZIP sizes can lie; the bytes actually extracted are counted against the same limit
+    extracted = TotalSizeLimit(DOCUMENT_BULK_MAX_EXTRACTED_BYTES)
+    
+    async def stage_entry(filename, content_type, open_reader):
+        extension = Path(filename or "").suffix.lower()
+        if extension not in DOCUMENT_EXTENSIONS:
+            return {"filename": filename, "status": "error", "error": "Invalid file type"}
+        async with slots:
+            reader = None
+            try:
+                # Opening a ZIP member fails for encrypted members, unsupported compression or a bad header
+                reader = open_reader()
+                staged = await blob_store.stage(extracted.wrap(reader), DOCUMENT_MAX_UPLOAD_BYTES)
+            except UploadTooLarge as e:
+                return {"filename": filename, "status": "error", "error": str(e)}
+            except Exception as e:
+                return {"filename": filename, "status": "error", "error": f"Could not read file: {e}"}
+            finally:
+                if isinstance(reader, ThreadedReader):
+                    reader.close()
+            try:
+                blob_key, new_blob = await blob_store.claim(staged, extension)
+            except Exception as e:
+                await staged.discard()
+                return {"filename": filename, "status": "error", "error": str(e)}
+        document_id = str(uuid.uuid4())
         document = PatientDocument(
+            id=document_id,
             patient_id=patient_id,
             document_type=document_type,
-            document_name=file.filename,
-            file_path=f"/uploads/patient_documents/{unique_filename}",
-            file_size=len(content),
-            mime_type=file.content_type,
+            document_name=filename,
+            file_path=document_download_url(document_id),
+            file_size=staged.size,
+            sha256=staged.sha256,
+            blob_key=blob_key,
+            preview_status=initial_preview_status(blob_key, extension),
+            mime_type=content_type,
             uploaded_by=admin_user["id"],
             description=description,
             appointment_id=appointment_id
         )
-        
-        await db.patient_documents.insert_one(document.dict())
-        
-        return {
-            "message": "Document uploaded successfully",
-            "document_id": document.id,
-            "file_url": document.file_path
-        }
-        
-    except Exception as e:
-        # Clean up file if database insert fails
-        if file_path.exists():
-            file_path.unlink()
-        raise HTTPException(status_code=500, detail=f"Error uploading document: {str(e)}")
+        return {"filename": filename, "status": "staged", "staged": staged, "document": document, "duplicate": not new_blob}
+    
+    try:
+        # One file failing unexpectedly must not abandon the others' claimed blobs
+        staged_entries = [
+            {"filename": entry[0], "status": "error", "error": f"Could not read file: {result}"}
+            if isinstance(result, Exception) else result
+            for entry, result in zip(
+                entries, await asyncio.gather(*(stage_entry(*entry) for entry in entries), return_exceptions=True)
+            )
+        ]
+    finally:
+        for archive in archives:
+            archive.close()
+    ready = [entry for entry in staged_entries if entry["status"] == "staged"]
+    
+    # One round trip for all metadata; the files only become visible once their records exist
+    if ready:
+        try:
+            await db.patient_documents.insert_many([entry["document"].dict() for entry in ready])
+        except Exception as e:
+            await db.patient_documents.delete_many({"id": {"$in": [entry["document"].id for entry in ready]}})
+            for entry in ready:
+                await blob_store.release(entry["document"].blob_key)
+                await entry["staged"].discard()
+                entry.update(status="error", error=f"Error saving document: {e}")
+            ready = []
+    
+    async def store_entry(entry):
+        document = entry["document"]
+        try:
+            async with slots:
+                await blob_store.store(entry["staged"], document.blob_key)
+            entry["status"] = "uploaded"
+        except OSError as e:
+            await db.patient_documents.delete_one({"id": document.id})
+            await blob_store.release(document.blob_key)
+            await entry["staged"].discard()
+            entry.update(status="error", error=f"Error storing document: {e}")
+    
+    await asyncio.gather(*(store_entry(entry) for entry in ready))
+    
+    for blob_key in {entry["document"].blob_key for entry in ready if entry["status"] == "uploaded" and entry["document"].preview_status == "pending"}:
+        background_tasks.add_task(generate_document_preview, blob_key)
+    
+    for entry in staged_entries:
+        document = entry.pop("document", None)
+        entry.pop("staged", None)
+        if entry["status"] == "uploaded":
+            entry.update(document_id=document.id, file_url=document.file_path, file_size=document.file_size, sha256=document.sha256)
+        else:
+            entry.pop("duplicate", None)
+        results.append(entry)
+    uploaded = sum(1 for entry in results if entry["status"] == "uploaded")
+    return {
+        "message": f"{uploaded} of {len(results)} documents uploaded",
+        "uploaded": uploaded,
+        "failed": len(results) - uploaded,
+        "results": results
+    }
 
 @api_router.get("/admin/patients/{patient_id}/documents")
 async def get_patient_documents(patient_id: str, admin_user: dict = Depends(require_admin)):
     """Get all documents for a patient"""
     documents = await db.patient_documents.find({"patient_id": patient_id}).to_list(1000)
-    return [serialize_doc(doc) for doc in documents]
+    return [with_preview_url(serialize_doc(doc), admin_user["id"]) for doc in documents]
 
 @api_router.get("/patients/{patient_id}/documents")
 async def get_my_documents(patient_id: str, current_user: dict = Depends(get_current_user)):
@@ -1150,7 +3003,7 @@ async def get_my_documents(patient_id: str, current_user: dict = Depends(get_cur
         raise HTTPException(status_code=403, detail="Access denied")
     
     documents = await db.patient_documents.find({"patient_id": patient_id}).to_list(1000)
-    return [serialize_doc(doc) for doc in documents]
+    return [with_preview_url(serialize_doc(doc), current_user["id"]) for doc in documents]
 
 @api_router.delete("/admin/patients/{patient_id}/documents/{document_id}")
 async def delete_patient_document(
@@ -1159,10 +3012,15 @@ async def delete_patient_document(
     admin_user: dict = Depends(require_admin)
 ):
     """Delete a patient document"""
-    document = await db.patient_documents.find_one({"id": document_id, "patient_id": patient_id})
+    document = await db.patient_documents.find_one_and_delete({"id": document_id, "patient_id": patient_id})
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
+    if document.get("blob_key"):
+        # Shared content: the blob is deleted by the collector once nothing references it
+        await blob_store.release(document["blob_key"])
+        return {"message": "Document deleted successfully"}
+    
     # Delete file from disk
     try:
         file_path = Path("/app/backend" + document["file_path"])
@@ -1171,11 +3029,145 @@ async def delete_patient_document(
     except Exception as e:
         print(f"Warning: Could not delete file {document['file_path']}: {e}")
     
-    # Delete from database
-    await db.patient_documents.delete_one({"id": document_id})
-    
     return {"message": "Document deleted successfully"}
 
+def document_file_path(document: dict) -> Path:
+    if document.get("blob_key"):
+        return blob_store.path(document["blob_key"])
+    return Path("/app/backend" + document["file_path"])
+
+async def get_accessible_document(document_id: str, user: dict) -> dict:
+    document = await db.patient_documents.find_one({"id": document_id})
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if user["id"] != document["patient_id"] and user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    return document
+
+def document_link_token(document_id: str, user_id: str, expires_at: datetime) -> str:
+    # No user_id claim, so the link token cannot be used as an access token
+    return jwt.encode(
+        {"document_id": document_id, "download_user_id": user_id, "scope": "document_download", "exp": expires_at},
+        JWT_SECRET, algorithm=JWT_ALGORITHM
+    )
+
+def with_preview_url(document: dict, user_id: str) -> dict:
+    """Signed preview URL, usable directly as an <img> src"""
+    expires_at = datetime.utcnow() + timedelta(seconds=DOCUMENT_LINK_TTL_SECONDS)
+    document["preview_url"] = f"/api/documents/{document['id']}/preview?token={document_link_token(document['id'], user_id, expires_at)}"
+    return document
+
+async def authorize_document_request(
+    document_id: str,
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+) -> dict:
+    """The requested document, for its patient or an admin (Bearer token) or a signed link"""
+    if credentials:
+        return await get_accessible_document(document_id, await authenticate_token(credentials.credentials))
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    try:
+        claims = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Download link expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid download link")
+    if claims.get("scope") != "document_download" or claims.get("document_id") != document_id:
+        raise HTTPException(status_code=401, detail="Invalid download link")
+    document = await db.patient_documents.find_one({"id": document_id})
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document
+
+@api_router.post("/documents/{document_id}/download-link")
+async def create_document_download_link(document_id: str, current_user: dict = Depends(get_current_user)):
+    """Short-lived signed URL for one document"""
+    await get_accessible_document(document_id, current_user)
+    expires_at = datetime.utcnow() + timedelta(seconds=DOCUMENT_LINK_TTL_SECONDS)
+    token = document_link_token(document_id, current_user["id"], expires_at)
+    return {"url": f"/api/documents/{document_id}/download?token={token}", "expires_at": expires_at}
+
+@api_router.api_route("/documents/{document_id}/download", methods=["GET", "HEAD"])
+async def download_document(
+    request: Request,
+    download: bool = False,
+    document: dict = Depends(authorize_document_request)
+):
+    """Stream a document to its patient or an admin (Bearer token or signed link), with Range support"""
+    path = document_file_path(document)
+    x_accel_redirect = None
+    if DOCUMENT_X_ACCEL_PREFIX:
+        x_accel_redirect = f"{DOCUMENT_X_ACCEL_PREFIX}/{path.relative_to(UPLOADS_DIR).as_posix()}"
+    try:
+        return await file_download_response(
+            request,
+            path,
+            filename=document.get("document_name") or path.name,
+            media_type=document.get("mime_type"),
+            etag=f'"{document["sha256"]}"' if document.get("sha256") else None,
+            disposition="attachment" if download else "inline",
+            x_accel_redirect=x_accel_redirect
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Document file not found")
+
+def initial_preview_status(blob_key: str, extension: str) -> str:
+    if not can_preview(extension):
+        return "unsupported"
+    # Duplicate content reuses the preview already rendered for its blob
+    return "ready" if blob_store.derivative_path(blob_key, PREVIEW_SUFFIX).exists() else "pending"
+
+async def generate_document_preview(blob_key: str):
+    """Render a blob's preview in the process pool and mark its documents"""
+    destination = blob_store.derivative_path(blob_key, PREVIEW_SUFFIX)
+    if not destination.exists():
+        try:
+            await preview_generator.render(blob_store.path(blob_key), destination)
+        except Exception as e:
+            # Another render of the same blob (e.g. in another worker) may have finished first
+            if not destination.exists():
+                logger.warning(f"Preview generation failed for blob {blob_key}: {e}")
+                await db.patient_documents.update_many({"blob_key": blob_key}, {"$set": {"preview_status": "failed"}})
+                return
+    await db.patient_documents.update_many({"blob_key": blob_key}, {"$set": {"preview_status": "ready"}})
+
+async def retry_pending_previews():
+    """Render previews left pending by a restart or a crashed worker"""
+    cutoff = datetime.utcnow() - timedelta(minutes=5)
+    blob_keys = await db.patient_documents.distinct(
+        "blob_key", {"preview_status": "pending", "created_at": {"$lte": cutoff}}
+    )
+    for blob_key in blob_keys:
+        await generate_document_preview(blob_key)
+    return {"previews": len(blob_keys)}
+
+@api_router.get("/documents/{document_id}/preview")
+async def get_document_preview(request: Request, document: dict = Depends(authorize_document_request)):
+    """Thumbnail of an image or the first page of a PDF; a placeholder icon until one is ready"""
+    if document.get("preview_status") == "ready" and document.get("blob_key"):
+        try:
+            return await file_download_response(
+                request,
+                blob_store.derivative_path(document["blob_key"], PREVIEW_SUFFIX),
+                filename=f"{Path(document.get('document_name') or 'document').stem}{PREVIEW_SUFFIX}",
+                media_type="image/jpeg",
+                etag=f'"{document["sha256"]}-preview"'
+            )
+        except FileNotFoundError:
+            pass
+    extension = Path(document.get("document_name") or document["file_path"]).suffix.lstrip(".")
+    status = document.get("preview_status") or "unsupported"
+    return Response(
+        content=placeholder_svg(extension or "file", status),
+        media_type="image/svg+xml",
+        headers={"cache-control": "no-store", "x-preview-status": status}
+    )
+
+async def collect_document_blobs():
+    """Delete document blobs no document has referenced for the grace period"""
+    return await blob_store.collect(timedelta(minutes=DOCUMENT_BLOB_GC_GRACE_MINUTES))
+
 # Enhanced Doctor Management Routes
 @api_router.post("/admin/doctors")
 async def create_doctor(doctor_data: dict, admin_user: dict = Depends(require_admin)):
@@ -1212,6 +3204,15 @@ async def delete_doctor(doctor_id: str, admin_user: dict = Depends(require_admin
 # Include the router in the main app
 app.include_router(api_router)
 
+# Refuse oversized upload bodies while they stream in, before multipart parsing spools them
+app.add_middleware(
+    RequestSizeLimitMiddleware,
+    limits=[
+        (r"^/api/admin/patients/[^/]+/upload-document$", DOCUMENT_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES),
+        (r"^/api/admin/patients/[^/]+/upload-documents$", DOCUMENT_BULK_MAX_UPLOAD_MB * 1024 * 1024 + MULTIPART_OVERHEAD_BYTES),
+    ],
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1227,6 +3228,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Periodic jobs run by the background scheduler (cron expressions are in UTC)
+job_registry = JobRegistry(db.scheduled_jobs)
+job_registry.register("process_scheduled_notifications", "* * * * *", process_scheduled_notifications, catch_up=False)
+job_registry.register("admin_daily_reminder", "0 8 * * *", create_admin_daily_reminder)
+job_registry.register("notification_retention", "30 2 * * *", apply_notification_retention)
+job_registry.register("daily_stock_snapshot", "5 0 * * *", daily_stock_snapshot)
+job_registry.register("expiring_stock_alert", "0 7 * * *", notify_expiring_lots)
+job_registry.register("medicine_search_rebuild", "*/10 * * * *", rebuild_medicine_search_index, catch_up=False)
+job_registry.register("expire_medicine_reservations", "*/15 * * * *", expire_medicine_reservations, catch_up=False)
+job_registry.register("collect_document_blobs", "20 * * * *", collect_document_blobs, catch_up=False)
+job_registry.register("retry_pending_previews", "*/10 * * * *", retry_pending_previews, catch_up=False)
+
 @app.on_event("startup")
 async def startup_event():
     # Create admin user if not exists
@@ -1246,29 +3259,91 @@ async def startup_event():
         })
         logger.info("Admin user created with email: admin@unicarepolyclinic.com")
     
+    # Indexes for the notification feed, the scheduler's due-scan and the counters
+    await db.notifications.create_index([("user_id", 1), ("created_at", -1)])
+    await db.notifications.create_index([("sent_at", 1), ("scheduled_for", 1)])
+    await db.notification_counters.create_index("user_id", unique=True)
+    await db.notifications.create_index([("is_read", 1), ("created_at", 1)])
+    if NOTIFICATION_ARCHIVE_TTL_DAYS:
+        await db.notifications_archive.create_index(
+            "archived_at", expireAfterSeconds=int(NOTIFICATION_ARCHIVE_TTL_DAYS) * 86400
+        )
+    
+    # Backfill notification counters the first time they are needed
+    if not await db.notification_stats.find_one({"id": NOTIFICATION_STATS_ID}):
+        await rebuild_notification_counters()
+        logger.info("Notification counters rebuilt")
+    
+    # Running-campaign lookups and next-start boundary for the active campaign cache
+    await db.campaigns.create_index([("is_active", 1), ("start_date", 1)])
+    await campaign_counters.ensure_indexes()
+    # Open medicine orders whose reservation has run out
+    await db.medicine_orders.create_index([("status", 1), ("reserved_until", 1)])
+    await rebuild_medicine_search_index()
+    # Package expansion ($lookup on lab_tests.id) and repricing packages that contain a test
+    await db.lab_tests.create_index("id")
+    await db.lab_packages.create_index("test_ids")
+    # Packages created before pricing was server-maintained carry client-sent or no pricing
+    repriced = await reprice_lab_packages({"pricing_updated_at": None})
+    if repriced:
+        logger.info(f"Lab package pricing backfilled for {repriced} packages")
+    # Point reads and $inc upserts of the per-doctor feedback summary
+    await db.doctor_feedback_summary.create_index("doctor_id", unique=True)
+    await feedback_analytics.ensure_indexes()
+    if not await db.doctor_feedback_summary.find_one({}) and await db.feedback.find_one({}):
+        await rebuild_feedback_summaries()
+        logger.info("Feedback summaries rebuilt")
+    if not await db.feedback_daily.find_one({}) and await db.feedback.find_one({}):
+        await feedback_analytics.rebuild()
+        logger.info("Feedback daily rollups rebuilt")
+    # Blob reference lookups and the collector's scan for unreferenced blobs
+    await blob_store.ensure_indexes()
+    # Marking all documents of a blob once its preview is rendered, and the retry scan for stuck previews
+    await db.patient_documents.create_index("blob_key")
+    await db.patient_documents.create_index(
+        [("preview_status", 1), ("created_at", 1)], partialFilterExpression={"preview_status": "pending"}
+    )
+    # Lab work queues per status (oldest first) and turnaround over recently completed orders
+    await db.lab_orders.create_index([("status", 1), ("order_date", 1)])
+    await db.lab_orders.create_index("status_timestamps.completed", partialFilterExpression={"status": "completed"})
+    
+    # Low-stock flag: partial index over flagged items and backfill for items created before it
+    await db.inventory_items.create_index(
+        [("is_low_stock", 1), ("current_stock", 1)],
+        partialFilterExpression={"is_low_stock": True}
+    )
+    await db.inventory_items.update_many({"is_low_stock": {"$exists": False}}, [LOW_STOCK_FLAG_STAGE])
+    
+    if not await mongo_supports_transactions():
+        message = "MongoDB does not support transactions (no replica set): stock postings are not atomic"
+        if STOCK_REQUIRE_TRANSACTIONS:
+            raise RuntimeError(f"{message}; run MongoDB as a replica set or set STOCK_REQUIRE_TRANSACTIONS=false")
+        logger.error(message)
+    
+    # Ledger range scans per item (either layout) and nearest-snapshot lookups
+    await stock_ledger.ensure_indexes()
+    await db.stock_snapshots.create_index([("inventory_item_id", 1), ("snapshot_at", -1)], unique=True)
+    # FEFO lookups per item and the "expiring within N days" scan over lots with stock left
+    await db.inventory_lots.create_index([("inventory_item_id", 1), ("expiry_date", 1), ("received_at", 1)])
+    await db.inventory_lots.create_index(
+        "expiry_date",
+        partialFilterExpression={"quantity_remaining": {"$gt": 0}}
+    )
+    
+    await notification_broker.start()
+    
     # Start background tasks
     asyncio.create_task(notification_scheduler())
     logger.info("Background notification scheduler started")
 
 async def notification_scheduler():
-    """Background scheduler for notifications"""
-    while True:
-        try:
-            # Process scheduled notifications every minute
-            await process_scheduled_notifications()
-            
-            # Check if it's time for daily admin reminder (every day at 8:00 AM)
-            current_time = datetime.utcnow()
-            if current_time.hour == 8 and current_time.minute == 0:
-                await create_admin_daily_reminder()
-            
-            # Wait for 1 minute before next check
-            await asyncio.sleep(60)
-            
-        except Exception as e:
-            logger.error(f"Error in notification scheduler: {e}")
-            await asyncio.sleep(60)  # Wait before retrying
+    """Background scheduler for notifications and other periodic jobs"""
+    # Jobs wake up on their cron slot boundaries instead of polling the wall clock
+    # every 60 s, so the daily reminder can neither be skipped nor fire twice.
+    await job_registry.run_forever()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await notification_broker.stop()
+    preview_generator.shutdown()
     client.close()
\ No newline at end of file
@@ -0,0 +1,338 @@
+"""Storage layouts for the stock transaction ledger.
+
+"document" keeps one MongoDB document per StockTransaction in `stock_transactions`.
+"bucket" groups transactions per inventory item and day (or hour) into one
+`stock_transaction_buckets` document holding an array of compact entries plus
+running totals, which cuts document and index counts by orders of magnitude on
+busy items. Callers read and write through StockLedger and always see the
+StockTransaction field names, whichever layout is active.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from pymongo import ReplaceOne, UpdateOne
+
+LEDGER_LAYOUTS = ("document", "bucket")
+BUCKET_SPANS = {"day": timedelta(days=1), "hour": timedelta(hours=1)}
+
+# Compact entry keys used inside buckets -> StockTransaction field names
+ENTRY_FIELDS = {
+    "id": "id",
+    "t": "transaction_type",
+    "q": "quantity",
+    "c": "stock_change",
+    "u": "cost_per_unit",
+    "tc": "total_cost",
+    "n": "notes",
+    "by": "performed_by",
+    "ts": "transaction_date",
+    "ln": "lot_number",
+    "ex": "expiry_date",
+    "lid": "lot_id",
+    "la": "lot_allocations",
+}
+FIELD_ENTRIES = {field: key for key, field in ENTRY_FIELDS.items()}
+
+# Signed stock effect of a ledger document; older entries predate the stored stock_change field
+STOCK_CHANGE_EXPR = {"$ifNull": ["$stock_change", {"$switch": {
+    "branches": [
+        {"case": {"$in": ["$transaction_type", ["purchase", "adjustment"]]}, "then": "$quantity"},
+        {"case": {"$in": ["$transaction_type", ["usage", "expired"]]}, "then": {"$multiply": ["$quantity", -1]}}
+    ],
+    "default": 0
+}}]}
+
+
+def _date_range(after: Optional[datetime] = None, start: Optional[datetime] = None, until: Optional[datetime] = None) -> Dict[str, datetime]:
+    """(after, until] / [start, until] bounds as a MongoDB range"""
+    bounds = {}
+    if after is not None:
+        bounds["$gt"] = after
+    if start is not None:
+        bounds["$gte"] = start
+    if until is not None:
+        bounds["$lte"] = until
+    return bounds
+
+
+class StockLedger:
+    def __init__(self, db, layout: str = "document", bucket: str = "day"):
+        if layout not in LEDGER_LAYOUTS:
+            raise ValueError(f"Unknown stock ledger layout '{layout}', expected one of {', '.join(LEDGER_LAYOUTS)}")
+        if bucket not in BUCKET_SPANS:
+            raise ValueError(f"Unknown stock ledger bucket '{bucket}', expected one of {', '.join(BUCKET_SPANS)}")
+        self.db = db
+        self.layout = layout
+        self.bucket = bucket
+        self.span = BUCKET_SPANS[bucket]
+
+    @property
+    def bucketed(self) -> bool:
+        return self.layout == "bucket"
+
+    def bucket_start(self, moment: datetime) -> datetime:
+        if self.bucket == "hour":
+            return moment.replace(minute=0, second=0, microsecond=0)
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    @staticmethod
+    def compact(transaction: Dict[str, Any]) -> Dict[str, Any]:
+        """Bucket entry for a transaction; empty optional fields are left out"""
+        return {
+            key: transaction[field]
+            for key, field in ENTRY_FIELDS.items()
+            if transaction.get(field) not in (None, [], "")
+        }
+
+    async def ensure_indexes(self):
+        await self.db.stock_transactions.create_index([("inventory_item_id", 1), ("transaction_date", 1)])
+        await self.db.stock_transaction_buckets.create_index([("inventory_item_id", 1), ("bucket_start", 1)], unique=True)
+        await self.db.stock_transaction_buckets.create_index("entries.id")
+
+    # Writes
+
+    async def append(self, transactions: List[Dict[str, Any]], session=None):
+        """Append transaction documents to the ledger in posting order"""
+        if not self.bucketed:
+            await self.db.stock_transactions.insert_many(transactions, ordered=True, session=session)
+            return
+
+        operations = []
+        for transaction in transactions:
+            change = transaction.get("stock_change") or 0
+            start = self.bucket_start(transaction["transaction_date"])
+            operations.append(UpdateOne(
+                {"inventory_item_id": transaction["inventory_item_id"], "bucket_start": start},
+                {
+                    "$push": {"entries": self.compact(transaction)},
+                    "$inc": {
+                        "count": 1,
+                        "total_in": max(change, 0),
+                        "total_out": max(-change, 0),
+                        "net_change": change,
+                    },
+                    "$setOnInsert": {"bucket_end": start + self.span},
+                },
+                upsert=True
+            ))
+        await self.db.stock_transaction_buckets.bulk_write(operations, ordered=True, session=session)
+
+    # Reads
+
+    def _bucket_match(self, item_ids: Optional[List[str]], after=None, start=None, until=None) -> Dict[str, Any]:
+        match = {}
+        if item_ids is not None:
+            match["inventory_item_id"] = {"$in": list(item_ids)}
+        lower = after if after is not None else start
+        if lower is not None:
+            match["bucket_end"] = {"$gt": lower}
+        if until is not None:
+            match["bucket_start"] = {"$lte": until}
+        return match
+
+    def _entry_condition(self, after=None, start=None, until=None, transaction_types=None) -> Dict[str, Any]:
+        """$filter condition over `$$this` (a bucket entry)"""
+        conditions = []
+        if after is not None:
+            conditions.append({"$gt": ["$$this.ts", after]})
+        if start is not None:
+            conditions.append({"$gte": ["$$this.ts", start]})
+        if until is not None:
+            conditions.append({"$lte": ["$$this.ts", until]})
+        if transaction_types is not None:
+            conditions.append({"$in": ["$$this.t", list(transaction_types)]})
+        return {"$and": conditions} if conditions else {"$literal": True}
+
+    async def sum_changes(self, item_ids: List[str], after: Optional[datetime] = None, until: Optional[datetime] = None) -> Dict[str, int]:
+        """Net stock change per item for ledger entries dated in (after, until]"""
+        if not self.bucketed:
+            match = {"inventory_item_id": {"$in": list(item_ids)}}
+            date_range = _date_range(after=after, until=until)
+            if date_range:
+                match["transaction_date"] = date_range
+            rows = await self.db.stock_transactions.aggregate([
+                {"$match": match},
+                {"$group": {"_id": "$inventory_item_id", "change": {"$sum": STOCK_CHANGE_EXPR}}}
+            ]).to_list(None)
+            return {row["_id"]: row["change"] for row in rows}
+
+        # Buckets lying wholly inside the range contribute their running total; only the
+        # (at most two) edge buckets per item are filtered entry by entry
+        inside = [{"$literal": True}]
+        if after is not None:
+            inside.append({"$gt": ["$bucket_start", after]})
+        if until is not None:
+            inside.append({"$lte": ["$bucket_end", until]})
+        rows = await self.db.stock_transaction_buckets.aggregate([
+            {"$match": self._bucket_match(item_ids, after=after, until=until)},
+            {"$group": {"_id": "$inventory_item_id", "change": {"$sum": {"$cond": [
+                {"$and": inside},
+                "$net_change",
+                {"$sum": {"$map": {
+                    "input": {"$filter": {"input": "$entries", "cond": self._entry_condition(after=after, until=until)}},
+                    "in": "$$this.c"
+                }}}
+            ]}}}}
+        ]).to_list(None)
+        return {row["_id"]: row["change"] for row in rows}
+
+    async def movements(self, item_id: str, after: datetime, until: datetime) -> Dict[str, Dict[str, int]]:
+        """Per transaction type quantity, net change and count for one item in (after, until]"""
+        if self.bucketed:
+            pipeline = [
+                {"$match": self._bucket_match([item_id], after=after, until=until)},
+                {"$unwind": "$entries"},
+                {"$match": {"entries.ts": _date_range(after=after, until=until)}},
+                {"$group": {
+                    "_id": "$entries.t",
+                    "quantity": {"$sum": "$entries.q"},
+                    "stock_change": {"$sum": "$entries.c"},
+                    "count": {"$sum": 1}
+                }}
+            ]
+            rows = await self.db.stock_transaction_buckets.aggregate(pipeline).to_list(None)
+        else:
+            rows = await self.db.stock_transactions.aggregate([
+                {"$match": {"inventory_item_id": item_id, "transaction_date": _date_range(after=after, until=until)}},
+                {"$group": {
+                    "_id": "$transaction_type",
+                    "quantity": {"$sum": "$quantity"},
+                    "stock_change": {"$sum": STOCK_CHANGE_EXPR},
+                    "count": {"$sum": 1}
+                }}
+            ]).to_list(None)
+        return {row["_id"]: {"quantity": row["quantity"], "stock_change": row["stock_change"], "count": row["count"]} for row in rows}
+
+    def transactions(
+        self,
+        item_ids: Optional[List[str]] = None,
+        transaction_types: Optional[List[str]] = None,
+        start: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        newest_first: Optional[bool] = None,
+        limit: Optional[int] = None,
+        batch_size: int = 1000
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Cursor over ledger entries shaped like StockTransaction documents
+
+        Results are unordered unless `newest_first` is given.
+        """
+        if not self.bucketed:
+            query = {}
+            if item_ids is not None:
+                query["inventory_item_id"] = {"$in": list(item_ids)}
+            if transaction_types is not None:
+                query["transaction_type"] = {"$in": list(transaction_types)}
+            date_range = _date_range(start=start, until=until)
+            if date_range:
+                query["transaction_date"] = date_range
+            cursor = self.db.stock_transactions.find(query, {"_id": 0}).batch_size(batch_size)
+            if newest_first is not None:
+                cursor = cursor.sort("transaction_date", -1 if newest_first else 1)
+            if limit:
+                cursor = cursor.limit(limit)
+            return cursor
+
+        pipeline = [
+            {"$match": self._bucket_match(item_ids, start=start, until=until)},
+            {"$project": {
+                "_id": 0,
+                "inventory_item_id": 1,
+                "entries": {"$filter": {
+                    "input": "$entries",
+                    "cond": self._entry_condition(start=start, until=until, transaction_types=transaction_types)
+                }}
+            }},
+            {"$unwind": "$entries"},
+        ]
+        if newest_first is not None:
+            pipeline.append({"$sort": {"entries.ts": -1 if newest_first else 1}})
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline.append({"$replaceRoot": {"newRoot": {
+            "inventory_item_id": "$inventory_item_id",
+            **{field: f"$entries.{key}" for key, field in ENTRY_FIELDS.items()}
+        }}})
+        return self.db.stock_transaction_buckets.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+
+    # Migration
+
+    async def migrate_documents_to_buckets(self, batch_size: int = 1000, progress=None) -> Dict[str, Any]:
+        """Rebuild buckets from `stock_transactions`
+
+        Each bucket is written whole with an upsert-replace, so the migration can be
+        re-run safely; run it before switching STOCK_LEDGER_LAYOUT to "bucket".
+        """
+        started = datetime.utcnow()
+        report = {"transactions": 0, "buckets": 0}
+        pending = []
+        current_key = None
+        current = None
+
+        def close_bucket():
+            pending.append(ReplaceOne(
+                {"inventory_item_id": current["inventory_item_id"], "bucket_start": current["bucket_start"]},
+                current,
+                upsert=True
+            ))
+
+        cursor = self.db.stock_transactions.find({}, {"_id": 0}).sort(
+            [("inventory_item_id", 1), ("transaction_date", 1)]
+        ).batch_size(batch_size)
+        async for transaction in cursor:
+            if transaction.get("stock_change") is None:
+                sign = {"purchase": 1, "adjustment": 1, "usage": -1, "expired": -1}.get(transaction.get("transaction_type"), 0)
+                transaction["stock_change"] = sign * transaction.get("quantity", 0)
+            key = (transaction["inventory_item_id"], self.bucket_start(transaction["transaction_date"]))
+            if key != current_key:
+                if current is not None:
+                    close_bucket()
+                current_key = key
+                current = {
+                    "inventory_item_id": key[0],
+                    "bucket_start": key[1],
+                    "bucket_end": key[1] + self.span,
+                    "count": 0, "total_in": 0, "total_out": 0, "net_change": 0,
+                    "entries": []
+                }
+            change = transaction["stock_change"]
+            current["entries"].append(self.compact(transaction))
+            current["count"] += 1
+            current["total_in"] += max(change, 0)
+            current["total_out"] += max(-change, 0)
+            current["net_change"] += change
+            report["transactions"] += 1
+
+            if len(pending) >= batch_size:
+                await self.db.stock_transaction_buckets.bulk_write(pending, ordered=False)
+                report["buckets"] += len(pending)
+                pending.clear()
+                if progress:
+                    progress(report)
+        if current is not None:
+            close_bucket()
+        if pending:
+            await self.db.stock_transaction_buckets.bulk_write(pending, ordered=False)
+            report["buckets"] += len(pending)
+
+        report["duration_seconds"] = round((datetime.utcnow() - started).total_seconds(), 2)
+        return report
+
+    async def verify_buckets(self) -> Dict[str, Any]:
+        """Compare transaction counts and net stock change between both layouts"""
+        documents = await self.db.stock_transactions.aggregate([
+            {"$group": {"_id": None, "count": {"$sum": 1}, "net_change": {"$sum": STOCK_CHANGE_EXPR}}}
+        ]).to_list(1)
+        buckets = await self.db.stock_transaction_buckets.aggregate([
+            {"$group": {"_id": None, "count": {"$sum": "$count"}, "net_change": {"$sum": "$net_change"}}}
+        ]).to_list(1)
+        documents = documents[0] if documents else {"count": 0, "net_change": 0}
+        buckets = buckets[0] if buckets else {"count": 0, "net_change": 0}
+        return {
+            "document_transactions": documents["count"],
+            "bucket_transactions": buckets["count"],
+            "document_net_change": documents["net_change"],
+            "bucket_net_change": buckets["net_change"],
+            "matches": documents["count"] == buckets["count"] and documents["net_change"] == buckets["net_change"],
+        }
@@ -0,0 +1,92 @@
+"""First-expired-first-out planning of stock issues over an item's lots.
+
+LotBook holds an item's lots with stock left plus its untracked stock (current_stock
+above the lot total, i.e. stock that predates lot tracking). plan() decides which
+lots an issue draws on, or raises LotAllocationError when the issue cannot be
+covered; take() applies a plan. The same book validates bulk imports row by row
+in memory and plans the conditional lot updates of an actual posting.
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+
+class LotAllocationError(ValueError):
+    """An issue the item's lots cannot cover (unknown, expired or short lot, or too little stock)"""
+
+    def __init__(self, message: str, status_code: int = 409):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def is_expired(lot: Dict[str, Any], today: datetime) -> bool:
+    return lot.get("expiry_date") is not None and lot["expiry_date"] < today
+
+
+class LotBook:
+    def __init__(self, lots: Iterable[Dict[str, Any]], untracked: int = 0):
+        self.lots = {lot["id"]: dict(lot) for lot in lots}
+        self.untracked = max(untracked, 0)
+
+    @classmethod
+    def for_item(cls, lots: Iterable[Dict[str, Any]], current_stock: int) -> "LotBook":
+        lots = list(lots)
+        return cls(lots, current_stock - sum(lot["quantity_remaining"] for lot in lots))
+
+    def receive(self, lot: Dict[str, Any]):
+        self.lots[lot["id"]] = dict(lot)
+
+    def plan(
+        self,
+        quantity: int,
+        today: datetime,
+        lot_id: Optional[str] = None,
+        include_expired: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Allocations ({"lot_id", "quantity"}, lot_id None for untracked stock) covering `quantity`"""
+        if lot_id:
+            lot = self.lots.get(lot_id)
+            if lot is None:
+                raise LotAllocationError(f"Lot {lot_id} not found for this inventory item", status_code=404)
+            label = lot.get("lot_number") or lot_id
+            if not include_expired and is_expired(lot, today):
+                raise LotAllocationError(f"Lot {label} has expired and can only be written off")
+            if lot["quantity_remaining"] < quantity:
+                raise LotAllocationError(f"Lot {label} has only {lot['quantity_remaining']} left")
+            return [{"lot_id": lot_id, "quantity": quantity}]
+
+        # Dated lots in expiry order, then undated lots oldest first; expired lots are
+        # only drawn down by write-offs, never dispensed
+        stocked = [lot for lot in self.lots.values() if lot["quantity_remaining"] > 0]
+        dated = sorted(
+            (lot for lot in stocked if lot.get("expiry_date") is not None and (include_expired or not is_expired(lot, today))),
+            key=lambda lot: (lot["expiry_date"], lot.get("received_at") or datetime.min)
+        )
+        undated = sorted(
+            (lot for lot in stocked if lot.get("expiry_date") is None),
+            key=lambda lot: lot.get("received_at") or datetime.min
+        )
+        available = sum(lot["quantity_remaining"] for lot in dated + undated) + self.untracked
+        if available < quantity:
+            expired = sum(lot["quantity_remaining"] for lot in stocked if is_expired(lot, today))
+            if not include_expired and available + expired >= quantity:
+                raise LotAllocationError("Only expired lots are left for this item; record them as an expired write-off")
+            raise LotAllocationError(f"Insufficient stock: {available} available")
+
+        allocations = []
+        remaining = quantity
+        for lot in dated + undated:
+            if remaining <= 0:
+                break
+            take = min(lot["quantity_remaining"], remaining)
+            allocations.append({"lot_id": lot["id"], "quantity": take})
+            remaining -= take
+        if remaining > 0:
+            allocations.append({"lot_id": None, "quantity": remaining})
+        return allocations
+
+    def take(self, allocations: List[Dict[str, Any]]):
+        for allocation in allocations:
+            if allocation["lot_id"] is None:
+                self.untracked -= allocation["quantity"]
+            else:
+                self.lots[allocation["lot_id"]]["quantity_remaining"] -= allocation["quantity"]
@@ -0,0 +1,194 @@
+import requests
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+class CampaignConcurrencyTester:
+    def __init__(self, base_url="https://634fec4b-409c-4c75-b58c-fb21cbd6d0ba.preview.emergentagent.com"):
+        self.base_url = f"{base_url}/api"
+        self.admin_token = None
+        self.patient_token = None
+        self.tests_run = 0
+        self.tests_passed = 0
+        self.medicine_id = None
+
+    def run_test(self, name, method, endpoint, expected_status, data=None, use_admin=False):
+        """Run a single API test"""
+        url = f"{self.base_url}/{endpoint}"
+        headers = {'Content-Type': 'application/json'}
+
+        token_to_use = self.admin_token if use_admin else self.patient_token
+        if token_to_use:
+            headers['Authorization'] = f'Bearer {token_to_use}'
+
+        self.tests_run += 1
+        print(f"\n🔍 Testing {name}...")
+
+        try:
+            if method == 'GET':
+                response = requests.get(url, headers=headers)
+            elif method == 'POST':
+                response = requests.post(url, json=data, headers=headers)
+            elif method == 'PUT':
+                response = requests.put(url, json=data, headers=headers)
+
+            success = response.status_code == expected_status
+            if success:
+                self.tests_passed += 1
+                print(f"✅ Passed - Status: {response.status_code}")
+                try:
+                    return success, response.json()
+                except:
+                    return success, {}
+            else:
+                print(f"❌ Failed - Expected {expected_status}, got {response.status_code}")
+                try:
+                    print(f"Response: {response.json()}")
+                except:
+                    print(f"Response text: {response.text}")
+
+            return success, {}
+
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            return False, {}
+
+    def check(self, name, condition, detail=""):
+        """Record a non-HTTP assertion"""
+        self.tests_run += 1
+        if condition:
+            self.tests_passed += 1
+            print(f"✅ {name} {detail}")
+        else:
+            print(f"❌ {name} {detail}")
+        return condition
+
+    def setup(self):
+        print("\n=== SETUP ===")
+        success, response = self.run_test(
+            "Admin Login", "POST", "auth/login", 200,
+            data={"email": "admin@unicarepolyclinic.com", "password": "admin-007"}
+        )
+        if not success:
+            return False
+        self.admin_token = response['access_token']
+
+        timestamp = datetime.now().strftime('%H%M%S%f')
+        test_email = f"campaign_{timestamp}@unicaretest.com"
+        success, _ = self.run_test(
+            "Patient Registration", "POST", "auth/register", 200,
+            data={
+                "email": test_email,
+                "phone": f"+91987{timestamp[-7:]}",
+                "full_name": f"Campaign Tester {timestamp}",
+                "password": "Patient123!"
+            }
+        )
+        if not success:
+            return False
+        success, response = self.run_test(
+            "Patient Login", "POST", "auth/login", 200,
+            data={"email": test_email, "password": "Patient123!"}
+        )
+        if not success:
+            return False
+        self.patient_token = response['access_token']
+
+        success, medicines = self.run_test("Get Medicines", "GET", "medicines", 200)
+        if not success or not medicines:
+            print("❌ No medicines in the catalog to order")
+            return False
+        self.medicine_id = medicines[0]['id']
+        return True
+
+    def place_order(self, _):
+        response = requests.post(
+            f"{self.base_url}/medicines/order",
+            json={"items": [{"medicine_id": self.medicine_id, "quantity": 1}]},
+            headers={'Authorization': f'Bearer {self.patient_token}'}
+        )
+        return response.status_code, response.json() if response.status_code == 200 else {}
+
+    def test_usage_limit_under_concurrency(self, usage_limit, counter_shards, orders=100, workers=25):
+        """Fire concurrent orders at a limited campaign; exactly usage_limit may get the discount"""
+        print(f"\n=== CONCURRENT REDEMPTION (limit {usage_limit}, shards {counter_shards}) ===")
+        today = datetime.utcnow()
+        success, response = self.run_test(
+            "Create Limited Campaign", "POST", "admin/campaigns", 200,
+            data={
+                "name": f"Concurrency test {today.strftime('%H%M%S%f')}",
+                "description": "Usage limit enforcement test",
+                "campaign_type": "discount",
+                "discount_percentage": 90,
+                "applicable_to": "medicines",
+                "applicable_items": [self.medicine_id],
+                "start_date": (today - timedelta(days=1)).strftime("%Y-%m-%d"),
+                "end_date": (today + timedelta(days=1)).strftime("%Y-%m-%d"),
+                "usage_limit": usage_limit,
+                "counter_shards": counter_shards
+            },
+            use_admin=True
+        )
+        if not success:
+            return False
+        campaign_id = response['campaign_id']
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(self.place_order, range(orders)))
+
+        placed = [body for status, body in results if status == 200]
+        self.check("All orders placed", len(placed) == orders, f"({len(placed)}/{orders})")
+
+        # Orders do not expose their campaigns directly; compare against the undiscounted total
+        totals = sorted(body['total_amount'] for body in placed)
+        full_price = totals[-1] if totals else 0
+        discounted = sum(1 for total in totals if total < full_price)
+        self.check("Discount granted exactly usage_limit times", discounted == usage_limit, f"({discounted} discounted orders)")
+
+        success, campaigns = self.run_test("Get Campaigns", "GET", "admin/campaigns", 200, use_admin=True)
+        campaign = next((c for c in campaigns if c['id'] == campaign_id), {})
+        self.check("usage_count equals usage_limit", campaign.get('usage_count') == usage_limit, f"(usage_count {campaign.get('usage_count')})")
+
+        exhausted_ok = True
+        if counter_shards > 1:
+            # Sharded counters never raise the campaign's own usage_count to the limit
+            exhausted_ok = self.check("Sharded campaign flagged exhausted", campaign.get('exhausted') is True)
+            later = [self.place_order(n) for n in range(5)]
+            later_totals = [body.get('total_amount') for status, body in later if status == 200]
+            exhausted_ok &= self.check(
+                "Orders after exhaustion pay full price",
+                len(later_totals) == 5 and all(total == full_price for total in later_totals),
+                f"({later_totals})"
+            )
+            success, active = self.run_test("Get Active Campaigns", "GET", "campaigns/active", 200)
+            exhausted_ok &= self.check("Exhausted campaign no longer listed as active", success and all(c['id'] != campaign_id for c in active))
+
+        self.run_test("Deactivate Campaign", "PUT", f"admin/campaigns/{campaign_id}", 200, data={"is_active": False}, use_admin=True)
+        return discounted == usage_limit and campaign.get('usage_count') == usage_limit and exhausted_ok
+
+def main():
+    tester = CampaignConcurrencyTester()
+
+    if not tester.setup():
+        print("❌ Setup failed - cannot continue")
+        return 1
+
+    single = tester.test_usage_limit_under_concurrency(usage_limit=10, counter_shards=0)
+    sharded = tester.test_usage_limit_under_concurrency(usage_limit=10, counter_shards=8)
+
+    # Print final results
+    print("\n" + "=" * 60)
+    print(f"📊 CAMPAIGN CONCURRENCY TEST RESULTS")
+    print(f"Tests Run: {tester.tests_run}")
+    print(f"Tests Passed: {tester.tests_passed}")
+    print(f"Success Rate: {(tester.tests_passed/tester.tests_run)*100:.1f}%")
+
+    if single and sharded and tester.tests_passed == tester.tests_run:
+        print("🎉 Usage limits hold under concurrent checkouts!")
+        return 0
+    else:
+        print(f"⚠️ Campaign usage limit issues found")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
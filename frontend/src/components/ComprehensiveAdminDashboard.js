@@ -387,6 +387,18 @@ const ComprehensiveAdminDashboard = () => {
     }
   };
 
+  const openPatientDocument = async (documentId) => {
+    // Documents are only served to authorised users; open them through a short-lived signed link
+    const viewer = window.open('', '_blank');
+    try {
+      const response = await axios.post(`${API}/documents/${documentId}/download-link`);
+      viewer.location.href = `${BACKEND_URL}${response.data.url}`;
+    } catch (error) {
+      viewer.close();
+      alert('Error opening document: ' + (error.response?.data?.detail || 'Something went wrong'));
+    }
+  };
+
   const handleDayToggle = (day) => {
     const days = [...newScheduleTemplate.days_of_week];
     if (days.includes(day)) {
@@ -1604,6 +1616,12 @@ const ComprehensiveAdminDashboard = () => {
                 <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-4">
                   {patientDocuments.map((doc) => (
                     <div key={doc.id} className="border rounded-lg p-4">
+                      <img
+                        src={`${BACKEND_URL}${doc.preview_url}`}
+                        alt={doc.document_name}
+                        loading="lazy"
+                        className="w-full h-40 object-contain bg-gray-50 rounded mb-3"
+                      />
                       <div className="flex justify-between items-start mb-2">
                         <h3 className="font-semibold text-gray-900">{doc.document_name}</h3>
                         <button
@@ -1621,14 +1639,12 @@ const ComprehensiveAdminDashboard = () => {
                         {doc.description && <p><span className="font-medium">Notes:</span> {doc.description}</p>}
                       </div>
                       <div className="mt-3">
-                        <a
-                          href={`${BACKEND_URL}${doc.file_path}`}
-                          target="_blank"
-                          rel="noopener noreferrer"
+                        <button
+                          onClick={() => openPatientDocument(doc.id)}
                           className="inline-block w-full text-center bg-blue-600 text-white py-2 px-3 rounded text-sm hover:bg-blue-700"
                         >
                           👁️ View Document
-                        </a>
+                        </button>
                       </div>
                     </div>
                   ))}
@@ -25,7 +25,7 @@ const LabTestsPage = () => {
     try {
       const [testsResponse, packagesResponse] = await Promise.all([
         axios.get(`${API}/lab-tests`),
-        axios.get(`${API}/lab-packages`)
+        axios.get(`${API}/lab-packages/expanded`)
       ]);
       setTests(testsResponse.data);
       setPackages(packagesResponse.data);
@@ -78,8 +78,7 @@ const LabTestsPage = () => {
   };
 
   const getTestsFromPackages = () => {
-    const testIds = selectedPackages.flatMap(pkg => pkg.test_ids);
-    return tests.filter(test => testIds.includes(test.id));
+    return selectedPackages.flatMap(pkg => pkg.tests);
   };
 
   const handleBookTests = async () => {
@@ -285,27 +284,28 @@ const LabTestsPage = () => {
                   <div className="mb-4">
                     <h4 className="font-medium text-gray-900 mb-2">Included Tests:</h4>
                     <div className="space-y-1">
-                      {pkg.test_ids.map(testId => {
-                        const test = tests.find(t => t.id === testId);
-                        return test ? (
-                          <div key={testId} className="flex justify-between text-sm">
-                            <span className="text-gray-600">{test.name}</span>
-                            <span className="text-gray-500">₹{test.price}</span>
-                          </div>
-                        ) : null;
-                      })}
+                      {pkg.tests.map(test => (
+                        <div key={test.id} className="flex justify-between text-sm">
+                          <span className="text-gray-600">{test.name}</span>
+                          <span className="text-gray-500">₹{test.price}</span>
+                        </div>
+                      ))}
                     </div>
                   </div>
 
                   <div className="flex justify-between items-center">
                     <div>
                       <div className="flex items-center space-x-2">
-                        <span className="text-lg text-gray-500 line-through">₹{pkg.original_price}</span>
+                        {pkg.discount_percentage > 0 && (
+                          <span className="text-lg text-gray-500 line-through">₹{pkg.original_price}</span>
+                        )}
                         <span className="text-xl font-bold text-blue-600">₹{pkg.package_price}</span>
                       </div>
-                      <span className="text-sm text-green-600 font-medium">
-                        Save {pkg.discount_percentage}% (₹{pkg.original_price - pkg.package_price})
-                      </span>
+                      {pkg.discount_percentage > 0 && (
+                        <span className="text-sm text-green-600 font-medium">
+                          Save {pkg.discount_percentage}% (₹{pkg.original_price - pkg.package_price})
+                        </span>
+                      )}
                     </div>
                   </div>
                 </div>
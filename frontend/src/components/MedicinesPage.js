@@ -4,24 +4,34 @@ import axios from 'axios';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const PAGE_SIZE = 60;
 
 const MedicinesPage = () => {
   const [medicines, setMedicines] = useState([]);
+  const [total, setTotal] = useState(0);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [cart, setCart] = useState([]);
   const [searchTerm, setSearchTerm] = useState('');
   const [selectedCategory, setSelectedCategory] = useState('');
+  const [categories, setCategories] = useState([]);
   const [cartModal, setCartModal] = useState(false);
   const navigate = useNavigate();
 
   useEffect(() => {
-    fetchMedicines();
-  }, []);
+    // Debounce typing so each keystroke does not trigger a request
+    const timer = setTimeout(() => fetchMedicines(0), searchTerm ? 250 : 0);
+    return () => clearTimeout(timer);
+  }, [searchTerm, selectedCategory]);
 
-  const fetchMedicines = async () => {
+  const fetchMedicines = async (offset) => {
     try {
-      const response = await axios.get(`${API}/medicines`);
-      setMedicines(response.data);
+      const response = await axios.get(`${API}/medicines/search`, {
+        params: { q: searchTerm, category: selectedCategory || undefined, limit: PAGE_SIZE, offset }
+      });
+      setMedicines(current => offset === 0 ? response.data.results : [...current, ...response.data.results]);
+      setTotal(response.data.total);
+      setCategories(response.data.categories);
     } catch (error) {
       console.error('Error fetching medicines:', error);
     } finally {
@@ -29,14 +39,11 @@ const MedicinesPage = () => {
     }
   };
 
-  const categories = [...new Set(medicines.map(med => med.category))];
-
-  const filteredMedicines = medicines.filter(medicine => {
-    const matchesSearch = medicine.name.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                         medicine.generic_name?.toLowerCase().includes(searchTerm.toLowerCase());
-    const matchesCategory = selectedCategory === '' || medicine.category === selectedCategory;
-    return matchesSearch && matchesCategory;
-  });
+  const loadMore = async () => {
+    setLoadingMore(true);
+    await fetchMedicines(medicines.length);
+    setLoadingMore(false);
+  };
 
   const addToCart = (medicine) => {
     const existingItem = cart.find(item => item.id === medicine.id);
@@ -66,7 +73,8 @@ const MedicinesPage = () => {
       return;
     }
 
-    const medicine = medicines.find(med => med.id === medicineId);
+    // Items added from an earlier search may no longer be in the loaded page
+    const medicine = medicines.find(med => med.id === medicineId) || cart.find(item => item.id === medicineId);
     if (newQuantity > medicine.stock_quantity) {
       alert('Cannot add more items. Stock limit reached.');
       return;
@@ -186,7 +194,7 @@ const MedicinesPage = () => {
 
         {/* Medicines Grid */}
         <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
-          {filteredMedicines.map((medicine) => (
+          {medicines.map((medicine) => (
             <div key={medicine.id} className="bg-white rounded-lg shadow-md overflow-hidden">
               <div className="p-6">
                 <div className="flex justify-between items-start mb-3">
@@ -244,7 +252,20 @@ const MedicinesPage = () => {
           ))}
         </div>
 
-        {filteredMedicines.length === 0 && (
+        {medicines.length < total && (
+          <div className="text-center mt-8">
+            <p className="text-sm text-gray-500 mb-3">Showing {medicines.length} of {total} medicines</p>
+            <button
+              onClick={loadMore}
+              disabled={loadingMore}
+              className="bg-white border border-blue-600 text-blue-600 px-6 py-2 rounded-lg hover:bg-blue-50 disabled:opacity-50"
+            >
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
+
+        {medicines.length === 0 && (
           <div className="text-center py-12">
             <p className="text-gray-500 text-lg">No medicines found matching your criteria.</p>
           </div>
@@ -7,19 +7,56 @@ const API = `${BACKEND_URL}/api`;
 
 const NotificationCenter = () => {
   const [notifications, setNotifications] = useState([]);
+  const [unreadCount, setUnreadCount] = useState(0);
   const [loading, setLoading] = useState(true);
   const [showDropdown, setShowDropdown] = useState(false);
   const { user } = useAuth();
 
   useEffect(() => {
     if (user) {
-      fetchNotifications();
-      // Set up polling for new notifications every 30 seconds
-      const interval = setInterval(fetchNotifications, 30000);
-      return () => clearInterval(interval);
+      fetchUnreadCount();
+      // New notifications are pushed over SSE; the slow poll only resyncs the counter
+      const interval = setInterval(fetchUnreadCount, 300000);
+      const token = localStorage.getItem('token');
+      const eventSource = token && window.EventSource
+        ? new EventSource(`${API}/notifications/stream?token=${encodeURIComponent(token)}`)
+        : null;
+      if (eventSource) {
+        eventSource.addEventListener('notification', (event) => {
+          const { notification, unread_count } = JSON.parse(event.data);
+          setNotifications(current => current.some(n => n.id === notification.id)
+            ? current
+            : [notification, ...current]);
+          // The server's counter already includes scheduled reminders created earlier
+          if (typeof unread_count === 'number') {
+            setUnreadCount(unread_count);
+          }
+        });
+      }
+      return () => {
+        clearInterval(interval);
+        if (eventSource) {
+          eventSource.close();
+        }
+      };
     }
   }, [user]);
 
+  useEffect(() => {
+    if (user && showDropdown) {
+      fetchNotifications();
+    }
+  }, [user, showDropdown]);
+
+  const fetchUnreadCount = async () => {
+    try {
+      const response = await axios.get(`${API}/notifications/unread-count`);
+      setUnreadCount(response.data.unread_count);
+    } catch (error) {
+      console.error('Error fetching unread count:', error);
+    }
+  };
+
   const fetchNotifications = async () => {
     try {
       const response = await axios.get(`${API}/notifications/my`);
@@ -34,6 +71,9 @@ const NotificationCenter = () => {
   const markAsRead = async (notificationId) => {
     try {
       await axios.put(`${API}/notifications/${notificationId}/mark-read`);
+      if (notifications.some(n => n.id === notificationId && !n.is_read)) {
+        setUnreadCount(count => Math.max(count - 1, 0));
+      }
       setNotifications(notifications.map(notification =>
         notification.id === notificationId
           ? { ...notification, is_read: true }
@@ -45,17 +85,22 @@ const NotificationCenter = () => {
   };
 
   const markAllAsRead = async () => {
+    if (notifications.length === 0) {
+      return;
+    }
+    // Only what the user has seen: notifications arriving after the newest loaded one stay unread.
+    // The raw ISO string keeps the server's microseconds, which a Date round trip would drop.
+    const newest = notifications.reduce(
+      (latest, notification) => (notification.created_at > latest ? notification.created_at : latest),
+      notifications[0].created_at
+    );
     try {
-      const unreadNotifications = notifications.filter(n => !n.is_read);
-      await Promise.all(
-        unreadNotifications.map(notification =>
-          axios.put(`${API}/notifications/${notification.id}/mark-read`)
-        )
-      );
+      await axios.put(`${API}/notifications/mark-all-read`, { before: newest });
       setNotifications(notifications.map(notification => ({
         ...notification,
         is_read: true
       })));
+      fetchUnreadCount();
     } catch (error) {
       console.error('Error marking all notifications as read:', error);
     }
@@ -115,8 +160,6 @@ const NotificationCenter = () => {
     }
   };
 
-  const unreadCount = notifications.filter(n => !n.is_read).length;
-
   return (
     <div className="relative">
       {/* Notification Bell */}
@@ -0,0 +1,127 @@
+import requests
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+class MedicineStockLoadTester:
+    def __init__(self, base_url="https://634fec4b-409c-4c75-b58c-fb21cbd6d0ba.preview.emergentagent.com"):
+        self.base_url = f"{base_url}/api"
+        self.patient_tokens = []
+        self.tests_run = 0
+        self.tests_passed = 0
+
+    def check(self, name, condition, detail=""):
+        """Record a single assertion"""
+        self.tests_run += 1
+        if condition:
+            self.tests_passed += 1
+            print(f"✅ {name} {detail}")
+        else:
+            print(f"❌ {name} {detail}")
+        return condition
+
+    def register_patients(self, count):
+        """Create and login test patients to spread orders across"""
+        print(f"\n=== REGISTERING {count} TEST PATIENTS ===")
+        for n in range(count):
+            timestamp = datetime.now().strftime('%H%M%S%f')
+            email = f"stockload_{timestamp}_{n}@unicaretest.com"
+            response = requests.post(f"{self.base_url}/auth/register", json={
+                "email": email,
+                "full_name": f"Stock Load Tester {n}",
+                "password": "Patient123!"
+            })
+            if response.status_code != 200:
+                print(f"❌ Registration failed: {response.text}")
+                return False
+            response = requests.post(f"{self.base_url}/auth/login", json={"email": email, "password": "Patient123!"})
+            if response.status_code != 200:
+                print(f"❌ Login failed: {response.text}")
+                return False
+            self.patient_tokens.append(response.json()['access_token'])
+        print(f"✅ {count} patients ready")
+        return True
+
+    def get_medicine(self, medicine_id=None):
+        medicines = requests.get(f"{self.base_url}/medicines").json()
+        if medicine_id:
+            return next((m for m in medicines if m['id'] == medicine_id), None)
+        in_stock = [m for m in medicines if m.get('stock_quantity', 0) > 0]
+        return min(in_stock, key=lambda m: m['stock_quantity']) if in_stock else None
+
+    def place_order(self, args):
+        n, medicine_id, quantity = args
+        token = self.patient_tokens[n % len(self.patient_tokens)]
+        response = requests.post(
+            f"{self.base_url}/medicines/order",
+            json={"items": [{"medicine_id": medicine_id, "quantity": quantity}]},
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        order_id = response.json().get('order_id') if response.status_code == 200 else None
+        return response.status_code, order_id, token
+
+    def cancel_order(self, args):
+        order_id, token = args
+        response = requests.put(
+            f"{self.base_url}/medicines/orders/{order_id}/cancel",
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        return response.status_code
+
+    def test_concurrent_orders(self, orders=300, workers=50, quantity=1):
+        """Place more concurrent orders than there is stock; stock must end exactly at zero or above"""
+        medicine = self.get_medicine()
+        if not medicine:
+            print("❌ No medicine with stock to test against")
+            return False
+        initial_stock = medicine['stock_quantity']
+        print(f"\n=== {orders} CONCURRENT ORDERS FOR {medicine['name']} (stock {initial_stock}) ===")
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(self.place_order, [(n, medicine['id'], quantity) for n in range(orders)]))
+
+        placed = [(order_id, token) for status, order_id, token in results if status == 200]
+        rejected = sum(1 for status, _, _ in results if status == 409)
+        errors = orders - len(placed) - rejected
+        expected_placed = min(orders, initial_stock // quantity)
+        final_stock = self.get_medicine(medicine['id'])['stock_quantity']
+
+        self.check("No unexpected errors", errors == 0, f"({errors} non-200/409 responses)")
+        self.check("Orders accepted match available stock", len(placed) == expected_placed, f"({len(placed)} placed, {rejected} rejected, expected {expected_placed})")
+        self.check("Stock never negative", final_stock >= 0, f"(final stock {final_stock})")
+        self.check("Stock decremented exactly by accepted orders", final_stock == initial_stock - len(placed) * quantity, f"({initial_stock} -> {final_stock})")
+
+        print(f"\n=== CANCELLING {len(placed)} ORDERS CONCURRENTLY ===")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Each order is cancelled twice; the second attempt must not release stock again
+            statuses = list(pool.map(self.cancel_order, placed + placed))
+        restored_stock = self.get_medicine(medicine['id'])['stock_quantity']
+        self.check("Each order cancelled exactly once", statuses.count(200) == len(placed), f"({statuses.count(200)} cancelled, {statuses.count(409)} already cancelled)")
+        self.check("Stock restored after cancellation", restored_stock == initial_stock, f"({restored_stock}, expected {initial_stock})")
+        return self.tests_passed == self.tests_run
+
+def main():
+    tester = MedicineStockLoadTester()
+
+    if not tester.register_patients(10):
+        print("❌ Setup failed - cannot continue")
+        return 1
+
+    success = tester.test_concurrent_orders()
+
+    # Print final results
+    print("\n" + "=" * 60)
+    print(f"📊 MEDICINE STOCK LOAD TEST RESULTS")
+    print(f"Tests Run: {tester.tests_run}")
+    print(f"Tests Passed: {tester.tests_passed}")
+    print(f"Success Rate: {(tester.tests_passed/tester.tests_run)*100:.1f}%")
+
+    if success:
+        print("🎉 Stock reservations stay consistent under concurrent orders!")
+        return 0
+    else:
+        print(f"⚠️ Medicine stock reservation issues found")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
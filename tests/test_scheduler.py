@@ -0,0 +1,52 @@
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from scheduler import CronSchedule  # noqa: E402
+
+# 2024-06-05 is a Wednesday; 2024-06-09 the following Sunday
+WEDNESDAY = datetime(2024, 6, 5, 12, 0)
+
+
+def test_lone_seven_is_sunday():
+    schedule = CronSchedule("0 9 * * 7")
+    assert schedule.weekdays == {0}
+    assert schedule.next_after(WEDNESDAY) == datetime(2024, 6, 9, 9, 0)
+
+
+def test_range_ending_in_seven_includes_sunday():
+    schedule = CronSchedule("0 9 * * 5-7")
+    assert schedule.weekdays == {5, 6, 0}
+    assert schedule.next_after(WEDNESDAY) == datetime(2024, 6, 7, 9, 0)
+    assert schedule.next_after(datetime(2024, 6, 8, 10, 0)) == datetime(2024, 6, 9, 9, 0)
+
+
+def test_steps():
+    schedule = CronSchedule("*/15 8-18/5 * * *")
+    assert schedule.minutes == {0, 15, 30, 45}
+    assert schedule.hours == {8, 13, 18}
+    assert schedule.next_after(datetime(2024, 6, 5, 13, 50)) == datetime(2024, 6, 5, 18, 0)
+    assert schedule.next_after(datetime(2024, 6, 5, 18, 45)) == datetime(2024, 6, 6, 8, 0)
+
+
+def test_day_of_month_and_day_of_week_match_either():
+    # Runs on the 1st of the month and on every Sunday
+    schedule = CronSchedule("0 0 1 * 0")
+    assert schedule.next_after(WEDNESDAY) == datetime(2024, 6, 9, 0, 0)
+    assert schedule.next_after(datetime(2024, 6, 29, 0, 0)) == datetime(2024, 6, 30, 0, 0)
+    assert schedule.next_after(datetime(2024, 6, 30, 0, 0)) == datetime(2024, 7, 1, 0, 0)
+
+
+def test_only_restricted_day_field_applies():
+    schedule = CronSchedule("0 0 * * 1")
+    assert schedule.next_after(WEDNESDAY) == datetime(2024, 6, 10, 0, 0)
+
+
+@pytest.mark.parametrize("expression", ["0 0 * * 8", "0 0 * * 6-8", "60 * * * *", "*/0 * * * *", "0 0 * *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)